@@ -0,0 +1,438 @@
+from datetime import datetime, timezone
+from statistics import median
+from time import perf_counter
+import argparse
+import json
+import numpy as np
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import user_pref
+
+GOLDEN_FILE = os.path.join(current, "golden.json")
+RESULTS_DIR = os.path.join(current, "results")
+# Slowdown of a benchmark's median over the baseline that counts as a
+# regression, unless golden.json sets its own "budget_pct"
+DEFAULT_BUDGET_PCT = 15
+WARMUP_CALLS = 3
+MIN_CALLS = 20
+MIN_TIME_S = 0.3
+# The timings are taken in rounds and the round with the lowest median is
+# kept, so a burst of other work on the Pi doesn't count as a regression
+ROUNDS = 5
+RESOLUTIONS = ((640, 480), (1280, 720))
+LED_COUNTS = {
+    "128leds": {"top": 40, "bottom": 40, "left": 24, "right": 24},
+    "376leds": {"top": 120, "bottom": 120, "left": 68, "right": 68},
+}
+LED_TRANSITION_ITERATIONS = 10
+LED_STARTUP_TIMEOUT_S = 30
+
+def synthetic_frame(resolution, seed=0):
+    """
+    Returns an RGB frame of smooth gradients with a little noise, like a
+    camera picture of a screen, that is the same on every run.
+    """
+    width, height = resolution
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    frame = np.stack([255 * xs / width, 255 * ys / height,
+                      127 + 96 * np.sin((xs + ys) / 40)], axis=-1)
+    noise = np.random.default_rng(seed).normal(0, 4, frame.shape)
+    return np.clip(np.rint(frame + noise), 0, 255).astype(np.uint8)
+
+
+def synthetic_colors(counts, seed=0):
+    """
+    Returns the RGB colors of every side, as sampled from a frame.
+    """
+    rng = np.random.default_rng(seed)
+    return {side: rng.integers(0, 256, (count, 3), dtype=np.uint8) \
+                for side, count in counts.items()}
+
+
+def virtual_led_config(counts):
+    return {
+        "counts": counts,
+        "strips": [{
+            "type": "virtual",
+            "order": list(counts),
+            "orientation": {side: True for side in counts},
+        }],
+    }
+
+
+class _ColorSink:
+    """
+    Stands in for LEDInterface, keeping the last colors sent.
+    """
+    def set_colors(self, colors, frameNb=-1, captureTime=None):
+        self.colors = colors
+
+
+def bench_sample_points(resolution, counts):
+    from camera_worker import benchmark_control_points
+    from utils import get_led_sample_points
+
+    controlPoints = benchmark_control_points(resolution)
+    run = lambda: get_led_sample_points(controlPoints, counts)
+    points = run()
+    value = [int(np.sum([np.sum(points[side]) for side in sorted(points)])),
+             sum(len(points[side]) for side in points)]
+    return (run, value)
+
+
+def bench_process_one_frame(resolution, counts):
+    """
+    Samples a frame and hands the colors to the LEDs, as ImageController
+    does for every decoded frame, with the default sampling prefs.
+    """
+    from camera_worker import benchmark_control_points
+    from image_controller import ImageController
+    from metrics import MetricsRegistry
+    import tracer
+
+    frame = synthetic_frame(resolution)
+    imageController = ImageController(MetricsRegistry(), display={
+        "name": "benchmark",
+        "control_points": benchmark_control_points(resolution),
+        "counts": counts,
+    })
+    imageController._setup(tracer.NullTracer(), resolution,
+                           recordFlights=False)
+    sink = _ColorSink()
+    imageController.set_led_interface(sink)
+
+    run = lambda: imageController._process_one_frame(frame)
+    colors = run()
+    value = [int(colors[side].astype(np.int64).sum()) \
+                for side in sorted(colors)]
+    return (run, value)
+
+
+def bench_decode(resolution):
+    """
+    Decodes a synthetic JPEG frame like the pipeline does. The value is the
+    mean pixel value, which may move slightly between libjpeg-turbo
+    versions.
+    """
+    from pooled_decoder import PooledTurboJPEG
+    from turbojpeg import TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, TJPF_RGB
+
+    decoder = PooledTurboJPEG()
+    jpeg = decoder.encode(synthetic_frame(resolution), quality=85,
+                          pixel_format=TJPF_RGB)
+    run = lambda: decoder.decode(jpeg, pixel_format=TJPF_RGB,
+                                 flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+    value = [round(float(run().mean()), 2)]
+    return (run, value)
+
+
+def bench_led_transition(counts):
+    """
+    Moves the LEDs one step towards new colors and writes them to a virtual
+    strip, with the default smoothing and color prefs.
+    """
+    from led_controller import LEDController, _rgb_to_hsv
+    from metrics import MetricsRegistry
+    import tracer
+
+    ledController = LEDController(None, None, None,
+                                  virtual_led_config(counts),
+                                  MetricsRegistry())
+    ledController._setup(tracer.NullTracer(), publishColors=False)
+    for side, colors in synthetic_colors(counts).items():
+        ledController._targetColors[side] = _rgb_to_hsv(colors / 255)
+
+    run = ledController._transition_to_target_colors
+    for _ in range(LED_TRANSITION_ITERATIONS):
+        run()
+    value = [int(ledController._stripColors.astype(np.int64).sum())]
+    return (run, value)
+
+
+def bench_color_transport(counts):
+    """
+    Sends colors to the LED controller process and waits until it read them.
+    """
+    from led_controller import LEDInterface
+    from metrics import MetricsRegistry
+
+    metricsRegistry = MetricsRegistry()
+    ledInterface = LEDInterface(virtual_led_config(counts), metricsRegistry)
+    ledInterface.__enter__()
+    ledInterface.update_and_get_power_state()
+    colors = synthetic_colors(counts)
+    ledInterface.set_colors(colors)
+    ledInterface.wait_until_colors_read(LED_STARTUP_TIMEOUT_S)
+
+    def run():
+        ledInterface.set_colors(colors)
+        ledInterface.wait_until_colors_read()
+
+    def close():
+        ledInterface.__exit__(None, None, None)
+        received = metricsRegistry.sample_value(
+                "backlight_led_colors_received_total")
+        dropped = metricsRegistry.sample_value(
+                "backlight_led_colors_dropped_total")
+        # Every set of colors must arrive: read, or replaced by a newer one
+        return [received + dropped == ledInterface._sentColors]
+
+    return (run, close)
+
+
+def bench_snapshot_publish(counts):
+    from color_snapshot import ColorSnapshotReader, ColorSnapshotWriter
+
+    numLeds = sum(counts.values())
+    sideIndices = {}
+    start = 0
+    for side, count in counts.items():
+        sideIndices[side] = np.arange(start, start + count)
+        start += count
+    stripColors = np.concatenate(list(synthetic_colors(counts).values()))
+    snapshotPath = os.path.join(tempfile.gettempdir(),
+                                "backlight_benchmark_colors")
+    writer = ColorSnapshotWriter(sideIndices, snapshotPath)
+    run = lambda: writer.publish(stripColors)
+    run()
+    reader = ColorSnapshotReader(snapshotPath)
+    value = [numLeds, bool(np.array_equal(reader.read(), stripColors))]
+    reader.close()
+    writer.close()
+    # Writes after close() would fail, so time a new writer
+    timedWriter = ColorSnapshotWriter(sideIndices, snapshotPath)
+
+    def close():
+        timedWriter.close()
+        return value
+
+    return (lambda: timedWriter.publish(stripColors), close)
+
+
+def benchmarks():
+    """
+    Returns every benchmark by name, as a function returning (run, value):
+    the call to time and the golden value to check. The value may also be a
+    function called after timing.
+    """
+    cases = {}
+    for resolution in RESOLUTIONS:
+        res = f"{resolution[0]}x{resolution[1]}"
+        for countsName, counts in LED_COUNTS.items():
+            cases[f"sample_points/{res}/{countsName}"] = \
+                lambda resolution=resolution, counts=counts: \
+                    bench_sample_points(resolution, counts)
+            cases[f"process_one_frame/{res}/{countsName}"] = \
+                lambda resolution=resolution, counts=counts: \
+                    bench_process_one_frame(resolution, counts)
+        cases[f"decode/{res}"] = \
+            lambda resolution=resolution: bench_decode(resolution)
+    for countsName, counts in LED_COUNTS.items():
+        cases[f"led_transition/{countsName}"] = \
+            lambda counts=counts: bench_led_transition(counts)
+        cases[f"color_transport/{countsName}"] = \
+            lambda counts=counts: bench_color_transport(counts)
+        cases[f"snapshot_publish/{countsName}"] = \
+            lambda counts=counts: bench_snapshot_publish(counts)
+    return cases
+
+
+def time_calls(run):
+    """
+    Returns the time of every call of the fastest of ROUNDS rounds, each
+    made for at least MIN_CALLS calls and MIN_TIME_S seconds after a few
+    warmup calls.
+    """
+    for _ in range(WARMUP_CALLS):
+        run()
+    rounds = []
+    for _ in range(ROUNDS):
+        times = []
+        startTime = perf_counter()
+        while len(times) < MIN_CALLS \
+                or perf_counter() - startTime < MIN_TIME_S:
+            callStart = perf_counter()
+            run()
+            times.append(perf_counter() - callStart)
+        rounds.append(times)
+    return min(rounds, key=median)
+
+
+def check_golden(name, value, golden):
+    """
+    Returns None if value matches the golden value of the benchmark,
+    otherwise why it doesn't.
+    """
+    if name not in golden:
+        return "no golden value"
+    expected = golden[name]["value"]
+    tolerance = golden[name].get("tolerance", 0)
+    if len(value) != len(expected) or any(
+            abs(v - e) > tolerance if isinstance(e, (int, float)) \
+                and not isinstance(e, bool) else v != e \
+            for v, e in zip(value, expected)):
+        return f"got {value}, expected {expected}"
+    return None
+
+
+def run_benchmarks(nameFilter=None):
+    """
+    Runs the benchmarks against the default prefs and returns the results,
+    ready to be stored as JSON.
+    """
+    golden = _read_json(GOLDEN_FILE) if os.path.exists(GOLDEN_FILE) else {}
+    results = {}
+    # An empty config directory, so config/pipeline.json and the color LUT
+    # of this machine don't change the outputs
+    with tempfile.TemporaryDirectory() as configDir:
+        os.environ[user_pref.CONFIG_DIR_ENV] = configDir
+        for name, setup in benchmarks().items():
+            if nameFilter is not None and nameFilter not in name:
+                continue
+            run, value = setup()
+            times = time_calls(run)
+            if callable(value):
+                value = value()
+            mismatch = check_golden(name, value, golden)
+            results[name] = {
+                "median_us": median(times) * 1e6,
+                "p90_us": float(np.percentile(times, 90)) * 1e6,
+                "calls": len(times),
+                "value": value,
+                "golden": "ok" if mismatch is None else mismatch,
+            }
+            print(f"{name:<40} {results[name]['median_us']:>10.1f}us "
+                  f"(p90 {results[name]['p90_us']:.1f}us)"
+                  f"{'' if mismatch is None else '  GOLDEN: ' + mismatch}")
+        del os.environ[user_pref.CONFIG_DIR_ENV]
+
+    commit, dirty = _git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.machine(),
+            "cpus": len(os.sched_getaffinity(0)),
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current):
+    """
+    Prints every benchmark of current next to baseline and returns the
+    names of the ones that got slower than their budget or broke their
+    golden value.
+    """
+    golden = _read_json(GOLDEN_FILE) if os.path.exists(GOLDEN_FILE) else {}
+    print(f"Comparing {current['commit']} with {baseline['commit']}")
+    failed = []
+    for name, result in current["results"].items():
+        if result["golden"] != "ok":
+            failed.append(name)
+            print(f"{name:<40} GOLDEN: {result['golden']}")
+            continue
+        if name not in baseline["results"]:
+            print(f"{name:<40} {result['median_us']:>10.1f}us (new)")
+            continue
+
+        budgetPct = golden.get(name, {}).get("budget_pct",
+                                             DEFAULT_BUDGET_PCT)
+        baseMedian = baseline["results"][name]["median_us"]
+        changePct = (result["median_us"] / baseMedian - 1) * 100
+        regression = changePct > budgetPct
+        if regression:
+            failed.append(name)
+        print(f"{name:<40} {baseMedian:>10.1f}us -> "
+              f"{result['median_us']:>10.1f}us ({changePct:+.1f}%)"
+              f"{'  REGRESSION (budget ' + str(budgetPct) + '%)' if regression else ''}")
+    return failed
+
+
+def update_golden(results):
+    """
+    Stores the values of results as the golden values, keeping the
+    tolerances and budgets already set.
+    """
+    golden = _read_json(GOLDEN_FILE) if os.path.exists(GOLDEN_FILE) else {}
+    for name, result in results["results"].items():
+        golden.setdefault(name, {})["value"] = result["value"]
+    with open(GOLDEN_FILE, "w") as goldenFile:
+        json.dump(golden, goldenFile, indent=4, sort_keys=True)
+        goldenFile.write("\n")
+
+
+def _git_commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=current, capture_output=True,
+                              text=True).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(git("status", "--porcelain", "--", parent))
+    return (commit, dirty)
+
+
+def _read_json(jsonPath):
+    with open(jsonPath, "r") as jsonFile:
+        return json.load(jsonFile)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+            description="Run the microbenchmarks of the pipeline's hot "
+                        "functions, or compare two stored runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    runParser = subparsers.add_parser(
+            "run", help="Run the benchmarks and store the results in "
+                        "results/<commit>.json")
+    runParser.add_argument("--filter", metavar="TEXT",
+                           help="Only run benchmarks whose name contains "
+                                "TEXT")
+    runParser.add_argument("--compare", metavar="BASELINE",
+                           help="Compare with the results in BASELINE")
+    runParser.add_argument("--update-golden", action="store_true",
+                           help="Store the outputs as the new golden values")
+    compareParser = subparsers.add_parser(
+            "compare", help="Compare two stored runs")
+    compareParser.add_argument("baseline")
+    compareParser.add_argument("current")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    if args.command == "compare":
+        failed = compare(_read_json(args.baseline), _read_json(args.current))
+    else:
+        results = run_benchmarks(args.filter)
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        resultsPath = os.path.join(
+                RESULTS_DIR,
+                f"{results['commit']}{'-dirty' if results['dirty'] else ''}"
+                ".json")
+        with open(resultsPath, "w") as resultsFile:
+            json.dump(results, resultsFile, indent=4)
+        print(f"Wrote {resultsPath}")
+
+        if args.update_golden:
+            update_golden(results)
+            print(f"Updated {GOLDEN_FILE}")
+        failed = [name for name, result in results["results"].items() \
+                    if result["golden"] != "ok" and not args.update_golden]
+        if args.compare is not None:
+            failed = compare(_read_json(args.compare), results)
+
+    if failed:
+        print(f"ERROR: {len(failed)} benchmark(s) failed: {failed}")
+        exit(1)
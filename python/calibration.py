@@ -1,11 +1,13 @@
 from datetime import datetime
-from math import floor
+from frame_capture import capture_settled_frame
+from led_discovery import discover_led_layout
 from os import path
 from pin_to_pin import AVAILABLE_PINS
 from utils import get_led_sample_points
 from scipy.interpolate import CubicSpline
+from screen_detection import detect_screen_control_points
 from time import perf_counter, sleep
-from turbojpeg import TurboJPEG, TJFLAG_FASTUPSAMPLE, TJFLAG_FASTDCT
+from turbojpeg import TurboJPEG
 from v4l2py.device import Device, BufferType
 import cv2
 import json
@@ -16,9 +18,10 @@ import threading
 import user_pref
 
 IMG_OUTPUT_PATH = "/tmp"
-DEFAULT_RECORDING_WAIT_TIME_S = 10
+DEFAULT_SETTLE_TIMEOUT_S = 10
+CALIBRATION_MEDIAN_FRAMES = 3
 
-def _capture_frame(waitTimeSec = DEFAULT_RECORDING_WAIT_TIME_S):
+def _open_calibration_camera():
     device, resolution = user_pref.read_device_prefs()
     print(device, resolution)
 
@@ -30,38 +33,30 @@ def _capture_frame(waitTimeSec = DEFAULT_RECORDING_WAIT_TIME_S):
 
     # reopen device to ensure that auto_exposure_value is reflected when
     # setting exposure_time_absolute value
-    with Device(device) as cam:
-        cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1], "MJPG")
-        cam.set_fps(BufferType.VIDEO_CAPTURE, 30)
-        cam.controls.auto_exposure.value = 1
-        cam.controls.white_balance_automatic.value = False
-        cam.controls.brightness.value = -64
-        cam.controls.contrast.value = 0
-        cam.controls.saturation.value = 80
-        cam.controls.hue.value = 0
-        cam.controls.gamma.value = 100
-        cam.controls.gain.value = 100
-        cam.controls.white_balance_temperature.value = 4100
-        cam.controls.exposure_time_absolute.value = 128
-        jpegDecoder = TurboJPEG()
-
-        print(f"Running camera stream for ~{waitTimeSec}s before capturing "
-                "frame")
-
-        start_time = perf_counter()
-        diff = perf_counter() - start_time
-        prev_diff = floor(diff)
-        for f in cam:
-            jpegFrame = f
-            if floor(diff) != prev_diff:
-                prev_diff = floor(diff)
-                print(f"{prev_diff}", end="..", flush=True)
-            diff = perf_counter() - start_time
-            if diff >= waitTimeSec:
-                break
-        print()
-        print("Capturing frame.")
-        frame = jpegDecoder.decode(bytes(jpegFrame), flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+    cam = Device(device)
+    cam.open()
+    cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1], "MJPG")
+    cam.set_fps(BufferType.VIDEO_CAPTURE, 30)
+    cam.controls.auto_exposure.value = 1
+    cam.controls.white_balance_automatic.value = False
+    cam.controls.brightness.value = -64
+    cam.controls.contrast.value = 0
+    cam.controls.saturation.value = 80
+    cam.controls.hue.value = 0
+    cam.controls.gamma.value = 100
+    cam.controls.gain.value = 100
+    cam.controls.white_balance_temperature.value = 4100
+    cam.controls.exposure_time_absolute.value = 128
+    return cam
+
+
+def _capture_frame(timeoutSec = DEFAULT_SETTLE_TIMEOUT_S,
+                   numMedianFrames = CALIBRATION_MEDIAN_FRAMES):
+    with _open_calibration_camera() as cam:
+        print(f"Running camera stream until exposure settles "
+              f"(at most ~{timeoutSec}s) before capturing frame")
+        frame = capture_settled_frame(cam, numMedianFrames=numMedianFrames,
+                                      timeoutSec=timeoutSec)
 
     return frame
 
@@ -77,6 +72,26 @@ def capture_frame_for_calibration():
     print(f"Wrote calibration image: {imageFilePath}")
 
 
+def detect_control_points():
+    print("Detecting screen edges for calibration")
+    print("--------------------------------------")
+    print("Make sure the screen is showing a bright, plain image (ex. a "
+          "full screen white page).")
+    frame = _capture_frame()
+
+    startTime = perf_counter()
+    controlPoints = detect_screen_control_points(frame)
+    print(f"Screen detection took {perf_counter() - startTime:.3f}s")
+    if controlPoints is None:
+        print("ERROR: Could not find the screen in the captured frame. "
+              "Please fill out the control points manually.")
+        return False
+
+    calibrationPath = user_pref.write_calibration_data(controlPoints)
+    print(f"Wrote detected control points to {calibrationPath}")
+    return True
+
+
 def display_calibrated_frame():
     print("Displaying a calibrated frame")
     print("-----------------------------")
@@ -97,7 +112,7 @@ def display_calibrated_frame():
     rightY = [c[1] for c in controlPoints["right"]]
     rightSpline = CubicSpline(rightY, rightX)
 
-    frame = _capture_frame(waitTimeSec=5)
+    frame = _capture_frame(timeoutSec=5)
 
     topXs = [x for x in range(topX[0], topX[-1])]
     topYs = np.rint(topSpline(topXs)).astype(np.int32)
@@ -266,6 +281,31 @@ def get_strip_orientation_from_user(drivingPin, stripOrder, stripSizes):
     return stripOrientation
 
 
+def discover_led_information(drivingPin):
+    print("Discovering LED strip layout.")
+    print("-----------------------------")
+    numLeds = get_int_from_user("    Total number of LEDs on the strip",
+                                lambda x: x >= 8 and x <= 2048)
+    controlPoints = user_pref.read_calibration_data()
+    print("Turn off the screen (or show a black image) and dim the room so "
+          "the LEDs are clearly visible to the camera.")
+    input("Press Enter to start.")
+
+    pin = AVAILABLE_PINS[drivingPin]
+    startTime = perf_counter()
+    with neopixel.NeoPixel(pin, numLeds, auto_write=False) as strip, \
+            _open_calibration_camera() as cam:
+        ledLayout = discover_led_layout(strip, cam, TurboJPEG(), numLeds,
+                                        controlPoints)
+    print(f"LED discovery took {perf_counter() - startTime:.1f}s")
+
+    if ledLayout is not None:
+        print(f"    Order: {ledLayout['order']}")
+        print(f"    Counts: {ledLayout['counts']}")
+        print(f"    Orientation: {ledLayout['orientation']}")
+    return ledLayout
+
+
 def get_led_information_from_user():
     print("Setting up LED Strips")
     print("---------------------")
@@ -277,30 +317,44 @@ def get_led_information_from_user():
                                    lambda x: x in AVAILABLE_PINS.keys())
     print()
 
-    print("Count the number of LEDs on the strip on the sides of the "
-          "monitor.")
-    numLedTop = get_int_from_user("    Number of LEDs on the TOP edge",
-                                  lambda x: x > 0 and x <= 512)
-    numLedBottom = get_int_from_user("    Number of LEDs on the BOTTOM edge",
-                                     lambda x: x > 0 and x <= 512)
-    numLedLeft = get_int_from_user("    Number of LEDs on the LEFT edge",
-                                   lambda x: x > 0 and x <= 512)
-    numLedRight = get_int_from_user("    Number of LEDs on the RIGHT edge",
-                                    lambda x: x > 0 and x <= 512)
-    stripSizes = {
-        "top": numLedTop,
-        "bottom": numLedBottom,
-        "left": numLedLeft,
-        "right": numLedRight
-    }
+    ledLayout = None
+    userInput = get_str_from_user("Discover the LED layout with the camera? "
+                                  "[y|n]", lambda s: s in {"y", "n"})
     print()
+    if userInput == "y":
+        ledLayout = discover_led_information(drivingPin)
+        print()
 
-    stripOrder = get_strip_order_from_user()
-    print()
+    if ledLayout is not None:
+        stripSizes = ledLayout["counts"]
+        stripOrder = ledLayout["order"]
+        stripOrientation = ledLayout["orientation"]
+    else:
+        print("Count the number of LEDs on the strip on the sides of the "
+              "monitor.")
+        numLedTop = get_int_from_user("    Number of LEDs on the TOP edge",
+                                      lambda x: x > 0 and x <= 512)
+        numLedBottom = get_int_from_user("    Number of LEDs on the BOTTOM edge",
+                                         lambda x: x > 0 and x <= 512)
+        numLedLeft = get_int_from_user("    Number of LEDs on the LEFT edge",
+                                       lambda x: x > 0 and x <= 512)
+        numLedRight = get_int_from_user("    Number of LEDs on the RIGHT edge",
+                                        lambda x: x > 0 and x <= 512)
+        stripSizes = {
+            "top": numLedTop,
+            "bottom": numLedBottom,
+            "left": numLedLeft,
+            "right": numLedRight
+        }
+        print()
 
-    stripOrientation = get_strip_orientation_from_user(drivingPin, stripOrder,
-                                                       stripSizes)
-    print()
+        stripOrder = get_strip_order_from_user()
+        print()
+
+        stripOrientation = get_strip_orientation_from_user(drivingPin,
+                                                           stripOrder,
+                                                           stripSizes)
+        print()
 
     powerPin = get_int_from_user("Pin to turn LEDs on and off",
                                     lambda x: x in AVAILABLE_PINS.keys())
@@ -349,11 +403,17 @@ def calculate_sample_points():
 
 def run_full_calibration():
     while True:
-        capture_frame_for_calibration()
-        calibrationPath = path.join(user_pref.CONFIG_PATH,
-                                    user_pref.CALIBRATION_FILE)
+        userInput = get_str_from_user("Detect screen edges automatically? "
+                                      "[y|n]", lambda s: s in {"y", "n"})
         print()
-        input(f"Please fill out {calibrationPath} and press Enter.")
+        if userInput == "y" and detect_control_points():
+            print()
+        else:
+            capture_frame_for_calibration()
+            calibrationPath = path.join(user_pref.CONFIG_PATH,
+                                        user_pref.CALIBRATION_FILE)
+            print()
+            input(f"Please fill out {calibrationPath} and press Enter.")
         calibrationPath = path.join(user_pref.CONFIG_PATH,
                                     user_pref.CALIBRATION_FILE)
         if not path.exists(calibrationPath):
@@ -382,15 +442,18 @@ if __name__ == "__main__":
 
     if (len(sys.argv) > 2):
         print("Invalid args. Usage:")
-        print(f"    python {sys.argv[0]} [set-control|get-control|set-led]")
+        print(f"    python {sys.argv[0]} [set-control|auto-control|get-control|set-led]")
         print(f"    Args: ")
         print(f"        set-control : Get a frame to get control points from")
+        print(f"        auto-control: Detect control points from a frame")
         print(f"        get-control : Show bounds as set by control points")
         print(f"        set-led     : Setup LED strip information")
         print(f"        set-samples : Pre-calculate the sample points to be used")
         exit(1)
     elif sys.argv[1] == "set-control":
         capture_frame_for_calibration()
+    elif sys.argv[1] == "auto-control":
+        detect_control_points()
     elif sys.argv[1] == "get-control":
         display_calibrated_frame()
     elif sys.argv[1] == "set-led":
@@ -399,9 +462,10 @@ if __name__ == "__main__":
         calculate_sample_points()
     else:
         print("Invalid args. Usage:")
-        print(f"    python {sys.argv[0]} [set-control|get-control|set-led]")
+        print(f"    python {sys.argv[0]} [set-control|auto-control|get-control|set-led]")
         print(f"    Args: ")
         print(f"        set-control : Get a frame to get control points from")
+        print(f"        auto-control: Detect control points from a frame")
         print(f"        get-control : Show bounds as set by control points")
         print(f"        set-led     : Setup LED strip information")
         print(f"        set-samples : Pre-calculate the sample points to be used")
@@ -1,5 +1,5 @@
 from scipy.interpolate import CubicSpline
-from turbojpeg import TurboJPEG, TJFLAG_FASTUPSAMPLE, TJFLAG_FASTDCT
+from turbojpeg import TJFLAG_FASTUPSAMPLE, TJFLAG_FASTDCT
 from v4l2py.device import Device, BufferType
 import numpy as np
 import os
@@ -9,6 +9,7 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
+from pooled_decoder import PooledTurboJPEG
 import user_pref
 
 class CameraController:
@@ -56,7 +57,7 @@ class CameraController:
         self._rightYs = [y for y in range(rightY[0], rightY[-1])]
         self._rightXs = np.rint(rightSpline(self._rightYs)).astype(np.int32)
 
-        self._jpegDecoder = TurboJPEG()
+        self._jpegDecoder = PooledTurboJPEG()
 
 
     def get_control_bounds(self):
@@ -0,0 +1,75 @@
+from color_snapshot import ColorSnapshotReader
+from time import perf_counter, sleep
+import json
+import numpy as np
+import struct
+
+DEFAULT_STREAM_FPS = 10
+MAX_STREAM_FPS = 60
+PIPELINE_POLL_S = 1
+# Start and length of a run of changed LEDs, followed by their RGB colors
+RUN_HEADER_FORMAT = "<HH"
+
+def encode_changes(colors, prevColors=None):
+    """
+    Returns the LEDs that changed since prevColors as runs of a start index,
+    a length and the RGB colors of the LEDs in the run, or b"" if nothing
+    changed. Without prevColors, all LEDs are sent as one run.
+    """
+    if prevColors is None:
+        changed = np.ones(len(colors), dtype=bool)
+    else:
+        changed = np.any(colors != prevColors, axis=1)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], changed, [0]))))
+    if len(edges) == 0:
+        return b""
+
+    starts, ends = edges[::2], edges[1::2]
+    # Resending a single unchanged LED (3 bytes) is cheaper than starting a
+    # new run (4 bytes)
+    keep = np.flatnonzero(starts[1:] - ends[:-1] > 1)
+    starts = np.concatenate((starts[:1], starts[1:][keep]))
+    ends = np.concatenate((ends[:-1][keep], ends[-1:]))
+
+    message = bytearray()
+    for start, end in zip(starts, ends):
+        message += struct.pack(RUN_HEADER_FORMAT, start, end - start)
+        message += colors[start:end].tobytes()
+    return bytes(message)
+
+
+def stream_led_colors(ws, fps=DEFAULT_STREAM_FPS):
+    """
+    Sends the LED colors of the running pipeline over the WebSocket ws, fps
+    times a second, until the client disconnects. The sides are sent as JSON
+    text, {"sides": [[name, count], ...]}, whenever they change (and empty
+    while the pipeline isn't running), followed by binary messages with the
+    runs of LEDs that changed, indexed across all sides in that order.
+
+    Colors are read from the pipeline's shared memory snapshot, so the
+    pipeline does no extra work for any number of clients.
+    """
+    interval = 1 / min(max(fps, 1), MAX_STREAM_FPS)
+    reader = ColorSnapshotReader()
+    sides = []
+    prevColors = None
+    ws.send(json.dumps({"sides": sides}))
+    try:
+        while ws.connected:
+            start = perf_counter()
+            colors = reader.read()
+            if (reader.sides or []) != sides:
+                sides = reader.sides or []
+                ws.send(json.dumps({"sides": sides}))
+                prevColors = None
+
+            waitS = PIPELINE_POLL_S
+            if colors is not None:
+                changes = encode_changes(colors, prevColors)
+                if changes:
+                    ws.send(changes)
+                prevColors = colors
+                waitS = interval
+            sleep(max(0, waitS - (perf_counter() - start)))
+    finally:
+        reader.close()
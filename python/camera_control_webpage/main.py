@@ -1,8 +1,22 @@
 from flask import Flask, render_template, Response, request
+from flask_sock import Sock
 from camera_controller import CameraController
+from led_colors_stream import DEFAULT_STREAM_FPS, stream_led_colors
+from metrics import CONTENT_TYPE, DEFAULT_METRICS_PORT
+from urllib.error import URLError
+from urllib.request import urlopen
+import argparse
 import json
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--metrics-port", metavar="PORT", type=int,
+                    default=DEFAULT_METRICS_PORT,
+                    help="The --metrics-port of the pipeline, whose metrics "
+                         "are relayed at /metrics")
+args = parser.parse_args()
+
 app = Flask("camera_control.playground", template_folder="templates")
+sock = Sock(app)
 
 
 cameraController = CameraController()
@@ -22,6 +36,22 @@ def set_camera_control():
     cameraController.set_camera_controls(request.json)
     return ""
 
+@app.route("/metrics")
+def metrics():
+    # Relays the metrics of a pipeline running with --metrics-port
+    try:
+        with urlopen(f"http://127.0.0.1:{args.metrics_port}/metrics",
+                     timeout=1) as response:
+            return Response(response.read(), mimetype=CONTENT_TYPE)
+    except URLError:
+        return Response("backlight pipeline is not running\n", status=503)
+
+@sock.route("/led_colors")
+def led_colors(ws):
+    # Ex. /led_colors?fps=30
+    stream_led_colors(ws, request.args.get("fps", DEFAULT_STREAM_FPS,
+                                           type=float))
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -1,5 +1,11 @@
 var cameraVals = {}
 var sliderInitVals = {}
+// Width of the band the LED colors are drawn in around the camera feed, the
+// padding of .frame_wrapper
+var LED_BORDER_PX = 24;
+var ledSocket = null;
+var ledSides = [];
+var ledColors = new Uint8Array(0);
 document.onload = function() {
     fetch("/get_control_bounds", {
         method: "GET",
@@ -52,3 +58,104 @@ function setEventHandlers() {
         })
     }
 }
+
+window.addEventListener("load", function() {
+    var ledFps = document.getElementById("led_fps");
+    ledFps.addEventListener("change", function() {
+        connectLedColors(this.value);
+    });
+    window.addEventListener("resize", drawLedColors);
+    connectLedColors(ledFps.value);
+});
+
+function connectLedColors(fps) {
+    if (ledSocket != null) {
+        ledSocket.onclose = null;
+        ledSocket.close();
+        ledSocket = null;
+    }
+    if (fps == 0) {
+        ledSides = [];
+        drawLedColors();
+        return;
+    }
+
+    var protocol = window.location.protocol == "https:" ? "wss:" : "ws:";
+    ledSocket = new WebSocket(protocol + "//" + window.location.host
+                              + "/led_colors?fps=" + fps);
+    ledSocket.binaryType = "arraybuffer";
+    ledSocket.onmessage = function(event) {
+        if (typeof event.data == "string") {
+            ledSides = JSON.parse(event.data)["sides"];
+            var numLeds = ledSides.reduce((total, side) => total + side[1], 0);
+            ledColors = new Uint8Array(numLeds * 3);
+        } else {
+            applyLedChanges(new DataView(event.data));
+        }
+        drawLedColors();
+    };
+    // Keep trying while the webpage restarts
+    ledSocket.onclose = function() {
+        setTimeout(() => connectLedColors(fps), 1000);
+    };
+}
+
+function applyLedChanges(view) {
+    // Runs of a uint16 start index, a uint16 length and the RGB colors of
+    // the LEDs in the run
+    var offset = 0;
+    while (offset < view.byteLength) {
+        var start = view.getUint16(offset, true);
+        var length = view.getUint16(offset + 2, true);
+        ledColors.set(new Uint8Array(view.buffer, offset + 4, length * 3),
+                      start * 3);
+        offset += 4 + length * 3;
+    }
+}
+
+function drawLedColors() {
+    var canvas = document.getElementById("led_canvas");
+    canvas.width = canvas.clientWidth;
+    canvas.height = canvas.clientHeight;
+    var context = canvas.getContext("2d");
+    context.clearRect(0, 0, canvas.width, canvas.height);
+
+    // With several displays, sides are named "<display>.<side>". Only the
+    // first display is drawn, since the page shows a single camera.
+    var drawnDisplay = null;
+    var offset = 0;
+    for (var [name, count] of ledSides) {
+        var nameParts = name.split(".");
+        var side = nameParts.pop();
+        var display = nameParts.join(".");
+        if (drawnDisplay == null) {
+            drawnDisplay = display;
+        }
+        if (display == drawnDisplay) {
+            drawSide(context, side, ledColors.subarray(offset * 3,
+                                                       (offset + count) * 3),
+                     count, canvas.width, canvas.height);
+        }
+        offset += count;
+    }
+}
+
+function drawSide(context, side, colors, count, width, height) {
+    // Like the sample points, top and bottom go left to right, and left and
+    // right go top to bottom
+    for (var i = 0; i < count; i++) {
+        context.fillStyle = "rgb(" + colors[i * 3] + ", " + colors[i * 3 + 1]
+                            + ", " + colors[i * 3 + 2] + ")";
+        if (side == "top" || side == "bottom") {
+            var ledWidth = (width - 2 * LED_BORDER_PX) / count;
+            context.fillRect(LED_BORDER_PX + i * ledWidth,
+                             side == "top" ? 0 : height - LED_BORDER_PX,
+                             Math.ceil(ledWidth), LED_BORDER_PX);
+        } else {
+            var ledHeight = (height - 2 * LED_BORDER_PX) / count;
+            context.fillRect(side == "left" ? 0 : width - LED_BORDER_PX,
+                             LED_BORDER_PX + i * ledHeight,
+                             LED_BORDER_PX, Math.ceil(ledHeight));
+        }
+    }
+}
@@ -0,0 +1,285 @@
+from led_controller import LEDInterface, LED_PROCESS_START_METHOD
+from metrics import MetricsRegistry, register_process_memory
+from multiprocessing import get_context
+from supervisor import Backoff, StageRecovery, DEFAULT_SUPERVISOR_PREFS
+from time import monotonic, perf_counter, sleep
+from user_pref import DISPLAY_SIDES
+import os
+import process_signals
+import profiler
+import sys
+import tracer
+import user_pref
+
+POWER_POLL_S = 0.3
+WORKER_JOIN_TIMEOUT_S = 5
+BENCHMARK_LED_COUNTS = {"top": 40, "bottom": 40, "left": 24, "right": 24}
+BENCHMARK_STARTUP_TIMEOUT_S = 30
+
+def run(displayName, imageController, displayColors, cpu):
+    """
+    Entry point of the camera worker process of one display. Captures,
+    decodes and samples the display's camera whenever the power is on, and
+    sends the colors to the LED controller process.
+    """
+    processName = f"camera_{displayName}"
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    profiler.start_if_enabled(processName)
+
+    try:
+        with imageController:
+            # The profiler, the tracer and the flight recorder installed their
+            # handlers by now
+            process_signals.handlers_ready()
+            imageController.set_led_interface(displayColors)
+            while not displayColors.should_stop():
+                if displayColors.update_and_get_power_state():
+                    imageController.start_capture_and_processing()
+                    imageController.stop_capture_and_processing()
+                else:
+                    imageController.decodeHeartbeat.beat()
+                    sleep(POWER_POLL_S)
+    except KeyboardInterrupt:
+        pass
+
+    displayColors.close()
+    profiler.stop()
+    tracer.get_tracer(processName).write()
+
+
+class CameraWorkers:
+    """
+    Runs the ImageController of every display in its own process, all sending
+    their colors to the one LED controller process that composes them into
+    the strips. When there are enough cores, every worker is pinned to its own
+    core, leaving the first one to the main and LED controller processes.
+
+    supervise() restarts a worker that died or hung on its own, without
+    touching the other displays or the LED controller.
+    """
+    def __init__(self, imageControllers, ledInterface, metricsRegistry):
+        self._context = get_context(LED_PROCESS_START_METHOD)
+        self._stop = self._context.Value('b', 0, lock=False)
+        self._metricsRegistry = metricsRegistry
+        self._ledInterface = ledInterface
+        self._ledRestarts = ledInterface.restarts
+        self._imageControllers = imageControllers
+        self._supervisorPrefs = user_pref.read_pipeline_prefs(
+                "supervisor", DEFAULT_SUPERVISOR_PREFS)
+
+        cpus = sorted(os.sched_getaffinity(0))
+        self._cpus = {}
+        self._recoveries = {}
+        self._backoffs = {}
+        for idx, displayName in enumerate(imageControllers):
+            self._cpus[displayName] = cpus[(idx + 1) % len(cpus)] \
+                                        if len(cpus) > 1 else None
+            self._recoveries[displayName] = StageRecovery(
+                    metricsRegistry, "camera_worker",
+                    {"display": displayName})
+            self._backoffs[displayName] = Backoff(
+                    self._supervisorPrefs["reopen_min_backoff_s"],
+                    self._supervisorPrefs["reopen_max_backoff_s"])
+        self._workers = {}
+        self._startTimes = {}
+        # When each worker that failed is started again
+        self._pendingStarts = {}
+
+
+    def __enter__(self):
+        for displayName in self._imageControllers:
+            self._start_worker(displayName)
+            register_process_memory(
+                    self._metricsRegistry, f"camera_{displayName}",
+                    lambda displayName=displayName: \
+                        self._workers[displayName].pid)
+        return self
+
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.value = True
+        for worker in self._workers.values():
+            worker.join(WORKER_JOIN_TIMEOUT_S)
+            if worker.is_alive():
+                print(f"WARN: {worker.name} did not stop. Terminating it.")
+                worker.terminate()
+                worker.join()
+
+
+    def supervise(self):
+        """
+        Restarts the workers that died or stopped beating their heartbeat for
+        worker_timeout_s, and all of them when the LED process was restarted,
+        since they send their colors through its queue. Called regularly by
+        the main process.
+        """
+        if self._ledInterface.restarts != self._ledRestarts:
+            self._ledRestarts = self._ledInterface.restarts
+            print("The LED controller was restarted. Restarting the camera "
+                  "workers.")
+            self._pendingStarts.clear()
+            for displayName in self._imageControllers:
+                self._stop_worker(displayName)
+                self._start_worker(displayName)
+            return
+
+        for displayName, imageController in self._imageControllers.items():
+            self._check_worker(displayName, imageController)
+
+
+    def _check_worker(self, displayName, imageController):
+        if displayName in self._pendingStarts:
+            if monotonic() >= self._pendingStarts[displayName]:
+                del self._pendingStarts[displayName]
+                self._start_worker(displayName)
+            return
+
+        worker = self._workers[displayName]
+        recovery = self._recoveries[displayName]
+        heartbeatTime = imageController.decodeHeartbeat.time()
+        if recovery.recovering() and heartbeatTime \
+                > self._startTimes[displayName]:
+            recovery.recovered(heartbeatTime)
+            self._backoffs[displayName].reset()
+
+        # The new worker gets the timeout to start up too
+        silentS = monotonic() - max(heartbeatTime,
+                                    self._startTimes[displayName])
+        if worker.is_alive():
+            if silentS <= self._supervisorPrefs["worker_timeout_s"]:
+                return
+            recovery.failed(f"{displayName}: no heartbeat for {silentS:.1f}s")
+            # A worker killed while writing to the color queue would leave it
+            # locked for the other workers, so the LED controller and its
+            # queue are restarted along with every worker
+            self._stop_worker(displayName)
+            self._ledInterface.restart_led_process()
+            return
+
+        recovery.failed(f"{displayName}: the process exited with code "
+                        f"{worker.exitcode}")
+        # Ex. the camera is unplugged, so the worker fails to open it
+        self._pendingStarts[displayName] = \
+            monotonic() + self._backoffs[displayName].next_delay()
+
+
+    def _start_worker(self, displayName):
+        displayColors = self._ledInterface.display_colors(displayName,
+                                                          self._stop)
+        worker = self._context.Process(
+                target=run,
+                args=[displayName, self._imageControllers[displayName],
+                      displayColors, self._cpus[displayName]],
+                name=f"camera_{displayName}")
+        self._startTimes[displayName] = monotonic()
+        process_signals.start_process(worker)
+        self._workers[displayName] = worker
+
+
+    def _stop_worker(self, displayName):
+        worker = self._workers[displayName]
+        worker.terminate()
+        worker.join(WORKER_JOIN_TIMEOUT_S)
+        if worker.is_alive():
+            worker.kill()
+            worker.join()
+
+
+def benchmark_control_points(resolution, margin=0.1):
+    """
+    Returns the control points of a screen inset by margin of the frame.
+    """
+    width, height = resolution
+    left, right = round(width * margin), round(width * (1 - margin))
+    top, bottom = round(height * margin), round(height * (1 - margin))
+    centerX, centerY = width // 2, height // 2
+    return {
+        "top": [(left, top), (centerX, top), (right, top)],
+        "bottom": [(left, bottom), (centerX, bottom), (right, bottom)],
+        "left": [(left, top), (left, centerY), (left, bottom)],
+        "right": [(right, top), (right, centerY), (right, bottom)],
+    }
+
+
+def measure_scaling(recordingPath, resolution, numDisplays, durationS):
+    """
+    Runs numDisplays displays that all stream recordingPath into one virtual
+    strip for durationS seconds and returns the frames processed per second
+    by each display and the LED frames written per second.
+    """
+    # Imported here, since the camera worker processes only need it once
+    # their ImageController is unpickled
+    from image_controller import ImageController
+
+    displays = [{
+        "name": f"display{idx}",
+        "device": recordingPath,
+        "resolution": resolution,
+        "control_points": benchmark_control_points(resolution),
+        "counts": BENCHMARK_LED_COUNTS,
+    } for idx in range(numDisplays)]
+    sides = [f"{display['name']}.{side}" \
+                for display in displays for side in DISPLAY_SIDES]
+    ledConfig = {
+        "counts": {side: BENCHMARK_LED_COUNTS[side.split(".")[1]] \
+                        for side in sides},
+        "strips": [{
+            "type": "virtual",
+            "order": sides,
+            "orientation": {side: True for side in sides},
+        }],
+    }
+
+    metricsRegistry = MetricsRegistry()
+    imageControllers = {
+        display["name"]: ImageController(metricsRegistry, display=display) \
+            for display in displays
+    }
+
+    def processed_frames():
+        return [metricsRegistry.sample_value(
+                    "backlight_frames_processed_total",
+                    {"display": display["name"]}) for display in displays]
+
+    def led_frames():
+        return metricsRegistry.sample_value("backlight_led_frames_total")
+
+    with LEDInterface(ledConfig, metricsRegistry) as ledInterface, \
+        CameraWorkers(imageControllers, ledInterface, metricsRegistry):
+        ledInterface.update_and_get_power_state()
+        # Only measure once every worker is up and processing frames
+        deadline = perf_counter() + BENCHMARK_STARTUP_TIMEOUT_S
+        while min(processed_frames()) == 0 and perf_counter() < deadline:
+            sleep(0.1)
+
+        startTime = perf_counter()
+        startFrames, startLedFrames = processed_frames(), led_frames()
+        sleep(durationS)
+        elapsed = perf_counter() - startTime
+        endFrames, endLedFrames = processed_frames(), led_frames()
+
+    displayFps = [(end - start) / elapsed \
+                    for start, end in zip(startFrames, endFrames)]
+    return (displayFps, (endLedFrames - startLedFrames) / elapsed)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5, 6):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} <recorded mjpeg> <width> <height> "
+              "[max displays] [seconds]")
+        exit(1)
+
+    recordingPath = os.path.abspath(sys.argv[1])
+    resolution = (int(sys.argv[2]), int(sys.argv[3]))
+    maxDisplays = int(sys.argv[4]) if len(sys.argv) >= 5 else 3
+    durationS = float(sys.argv[5]) if len(sys.argv) == 6 else 5
+
+    print(f"{len(os.sched_getaffinity(0))} cores available")
+    for numDisplays in range(1, maxDisplays + 1):
+        displayFps, ledFps = measure_scaling(recordingPath, resolution,
+                                             numDisplays, durationS)
+        fpsList = ", ".join(f"{fps:.1f}" for fps in displayFps)
+        print(f"{numDisplays} display(s): {sum(displayFps):.1f} camera fps "
+              f"in total ({fpsList}), {ledFps:.1f} LED fps")
@@ -0,0 +1,214 @@
+from time import perf_counter
+import json
+import numpy as np
+import sys
+import user_pref
+
+DEFAULT_LUT_SIZE = 33
+DEFAULT_COLOR_PREFS = {
+    "brightness": 0.5,
+    "gamma": [1.0, 1.0, 1.0],
+    "lut_size": DEFAULT_LUT_SIZE,
+    "matrix": [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]],
+    "offset": [0.0, 0.0, 0.0],
+    "saturation": 1.0,
+}
+LUMA_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+
+class ColorCorrector:
+    """
+    Maps camera RGB colors to LED RGB colors through an optional 3D LUT
+    (trilinear interpolation) followed by a per-channel gamma curve.
+
+    The colors are corrected channel by channel, as a (3, N) array, in
+    buffers kept between frames, since numpy is slow on the short rows of
+    (N, 3) arrays.
+    """
+    def __init__(self, lut=None, gamma=(1.0, 1.0, 1.0)):
+        if lut is not None:
+            size = lut.shape[0]
+            cells = size - 1
+            levels = lut.astype(np.float32) * 255
+            # Every cell's 8 corners with their 3 channels in rows of 24, the
+            # corner order being the blue, green and red bits, so one gather
+            # gets all the values of a color's cell
+            corners = [levels[r:cells + r, g:cells + g, b:cells + b] \
+                        .reshape(-1, 3).T \
+                            for b in (0, 1) for g in (0, 1) for r in (0, 1)]
+            self._cellCorners = np.ascontiguousarray(
+                    np.concatenate(corners))
+            # Per uint8 value, its cell along one channel and its fraction of
+            # the way to the next one
+            position = np.arange(256) * (cells / 255)
+            self._cellTable = np.minimum(position.astype(np.intp), cells - 1)
+            self._fractionTable = (position - self._cellTable) \
+                                    .astype(np.float32)
+            self._cellStrides = np.array([cells * cells, cells, 1], np.intp)
+            # Interpolating between values in [0, 1] stays in [0, 1]
+            self._clipLevels = lut.min() < 0 or lut.max() > 1
+        else:
+            self._cellCorners = None
+
+        levels = np.arange(256) / 255
+        # Flattened, with each channel's table 256 entries after the last
+        self._gammaTable = np.concatenate([
+            np.rint(np.power(levels, channelGamma) * 255) \
+                for channelGamma in gamma
+        ]).astype(np.uint8)
+        self._gammaOffsets = np.arange(0, 3 * 256, 256)[:, np.newaxis]
+        self._numColors = None
+
+
+    def apply(self, colors):
+        """
+        Corrects an (N, 3) array of uint8 RGB colors.
+        """
+        if len(colors) != self._numColors:
+            self._allocate(len(colors))
+        np.copyto(self._channels, colors.T)
+        if self._cellCorners is not None:
+            self._apply_lut()
+        np.add(self._channels, self._gammaOffsets, out=self._gammaIndices)
+        self._gammaTable.take(self._gammaIndices, out=self._channels)
+        return self._channels.T.copy()
+
+
+    def _allocate(self, numColors):
+        self._numColors = numColors
+        self._channels = np.empty((3, numColors), np.uint8)
+        self._gammaIndices = np.empty((3, numColors), np.intp)
+        if self._cellCorners is not None:
+            self._cellIndices = np.empty((3, numColors), np.intp)
+            self._cells = np.empty(numColors, np.intp)
+            self._fractions = np.empty((3, numColors), np.float32)
+            self._corners = np.empty((24, numColors), np.float32)
+            self._edges = np.empty((12, numColors), np.float32)
+            self._faces = np.empty((6, numColors), np.float32)
+            self._levels = np.empty((3, numColors), np.float32)
+
+
+    def _apply_lut(self):
+        self._cellTable.take(self._channels, out=self._cellIndices)
+        np.dot(self._cellStrides, self._cellIndices, out=self._cells)
+        self._fractionTable.take(self._channels, out=self._fractions)
+        self._cellCorners.take(self._cells, axis=1, out=self._corners)
+        # Interpolates along blue, green and then red, every step halving
+        # the corners left
+        _lerp(self._corners[:12], self._corners[12:], self._fractions[2],
+              self._edges)
+        _lerp(self._edges[:6], self._edges[6:], self._fractions[1],
+              self._faces)
+        _lerp(self._faces[:3], self._faces[3:], self._fractions[0],
+              self._levels)
+        if self._clipLevels:
+            np.clip(self._levels, 0, 255, out=self._levels)
+        np.rint(self._levels, out=self._levels)
+        np.copyto(self._channels, self._levels, casting="unsafe")
+
+
+def _lerp(low, high, fraction, out):
+    np.subtract(high, low, out=out)
+    np.multiply(out, fraction, out=out)
+    np.add(out, low, out=out)
+
+
+def build_lut(size=DEFAULT_LUT_SIZE, matrix=None, offset=None,
+              saturation=1.0):
+    """
+    Bakes an affine color transform and a saturation adjustment into a
+    (size, size, size, 3) LUT with values in [0, 1].
+    """
+    levels = np.linspace(0, 1, size)
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"),
+                    axis=-1).reshape(-1, 3)
+
+    if matrix is not None:
+        grid = grid @ np.array(matrix, dtype=np.float64).T
+    if offset is not None:
+        grid = grid + np.array(offset, dtype=np.float64)
+    if saturation != 1.0:
+        luma = (grid @ LUMA_WEIGHTS)[:, np.newaxis]
+        grid = luma + (grid - luma) * saturation
+
+    return np.clip(grid, 0, 1).reshape(size, size, size, 3).astype(np.float32)
+
+
+def build_lut_from_reference(cameraColors, targetColors,
+                             size=DEFAULT_LUT_SIZE):
+    """
+    Fits the affine transform that best maps captured camera colors to the
+    desired LED colors (both (N, 3) in 0..255) and bakes it into a LUT.
+    """
+    camera = np.array(cameraColors, dtype=np.float64) / 255
+    target = np.array(targetColors, dtype=np.float64) / 255
+    if len(camera) < 4 or len(camera) != len(target):
+        print("ERROR: The color reference needs at least 4 matching camera "
+              "and target colors.")
+        exit(1)
+
+    design = np.hstack([camera, np.ones((len(camera), 1))])
+    solution, _, _, _ = np.linalg.lstsq(design, target, rcond=None)
+    matrix = solution[:3].T
+    offset = solution[3]
+    return build_lut(size, matrix=matrix, offset=offset)
+
+
+def read_color_corrector():
+    """
+    Returns the ColorCorrector for the configured LUT and gamma, or None if
+    no color correction is configured.
+    """
+    colorPrefs = user_pref.read_pipeline_prefs("color", DEFAULT_COLOR_PREFS)
+    lut = user_pref.read_color_lut()
+    gamma = colorPrefs["gamma"]
+    if lut is None and all(g == 1.0 for g in gamma):
+        return None
+
+    return ColorCorrector(lut, gamma)
+
+
+def measure_apply(numLeds, numFrames=10000):
+    """
+    Returns the time to correct the colors of numLeds LEDs with the default
+    LUT size and a gamma curve, in seconds per frame.
+    """
+    lut = build_lut(DEFAULT_LUT_SIZE, saturation=1.2)
+    corrector = ColorCorrector(lut, (2.2, 2.2, 2.2))
+    colors = np.random.default_rng(0).integers(0, 256, (numLeds, 3),
+                                               dtype=np.uint8)
+    corrector.apply(colors)
+    startTime = perf_counter()
+    for _ in range(numFrames):
+        corrector.apply(colors)
+    return (perf_counter() - startTime) / numFrames
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ("build", "bench"):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} build [reference.json]")
+        print(f"    python {sys.argv[0]} bench [num LEDs]")
+        print(f"    Args: ")
+        print(f"        reference.json : Captured camera colors and the LED "
+              "colors they should produce")
+        exit(1)
+
+    if sys.argv[1] == "bench":
+        numLeds = int(sys.argv[2]) if len(sys.argv) == 3 else 300
+        print(f"Corrected {numLeds} LEDs in "
+              f"{measure_apply(numLeds) * 1e6:.1f}us per frame")
+        exit(0)
+
+    colorPrefs = user_pref.read_pipeline_prefs("color", DEFAULT_COLOR_PREFS)
+    if len(sys.argv) == 3:
+        with open(sys.argv[2], "r") as referenceFile:
+            reference = json.load(referenceFile)
+        lut = build_lut_from_reference(reference["camera"],
+                                       reference["target"],
+                                       colorPrefs["lut_size"])
+    else:
+        lut = build_lut(colorPrefs["lut_size"], colorPrefs["matrix"],
+                        colorPrefs["offset"], colorPrefs["saturation"])
+
+    lutPath = user_pref.write_color_lut(lut)
+    print(f"Wrote {lut.shape[0]}^3 color LUT to {lutPath}")
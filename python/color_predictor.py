@@ -0,0 +1,158 @@
+import numpy as np
+import sys
+
+DEFAULT_PREDICTION_PREFS = {
+    "enabled": False,
+    "alpha": 0.85,
+    "beta": 0.5,
+    "output_latency_ms": 0,
+    "max_lead_ms": 100,
+    "scene_cut_threshold": 15,
+}
+# sRGB (linear) to LMS, and cube rooted LMS to OKLab
+OKLAB_M1 = np.array([[0.4122214708, 0.5363325363, 0.0514459929],
+                     [0.2119034982, 0.6806995451, 0.1073969566],
+                     [0.0883024619, 0.2817188376, 0.6299787005]])
+OKLAB_M2 = np.array([[0.2104542553, 0.7936177850, -0.0040720468],
+                     [1.9779984951, -2.4285922050, 0.4505937099],
+                     [0.0259040371, 0.7827717662, -0.8086757660]])
+OKLAB_M1_INV = np.linalg.inv(OKLAB_M1)
+OKLAB_M2_INV = np.linalg.inv(OKLAB_M2)
+
+class ColorPredictor:
+    """
+    Tracks the color and color velocity of every LED of one side with an
+    alpha-beta filter in OKLab, where equal distances look about equally
+    different, and extrapolates the colors to the time they are shown.
+
+    Colors are timestamped with their capture time, so extrapolating to the
+    show time makes up for the whole pipeline delay. When the new colors are
+    far from the predicted ones (a scene cut), the filter snaps to them
+    instead of following them. Colors are extrapolated at most maxLeadS past
+    the last capture, so they don't overshoot when frames stop coming.
+    """
+    def __init__(self, alpha, beta, sceneCutThreshold, maxLeadS):
+        self._alpha = alpha
+        self._beta = beta
+        self._maxLeadS = maxLeadS
+        # Prefs are in OKLab distance x100, ~1 is a just noticeable difference
+        self._sceneCutThreshold = sceneCutThreshold / 100
+        self._position = None
+        self._velocity = None
+        self._time = None
+
+
+    def update(self, rgb, captureTime):
+        """
+        Adds the colors (in [0, 1]) captured at captureTime and returns True
+        if they are a scene cut.
+        """
+        measured = rgb_to_oklab(rgb)
+        if self._position is None:
+            self._snap(measured, captureTime)
+            return True
+
+        dt = captureTime - self._time
+        if dt <= 0:
+            # Out of order or duplicate timestamps carry no velocity
+            self._position = measured
+            return False
+
+        predicted = self._position + self._velocity * dt
+        residual = measured - predicted
+        if np.linalg.norm(residual, axis=1).mean() > self._sceneCutThreshold:
+            self._snap(measured, captureTime)
+            return True
+
+        self._position = predicted + self._alpha * residual
+        self._velocity = self._velocity + (self._beta / dt) * residual
+        self._time = captureTime
+        return False
+
+
+    def has_colors(self):
+        return self._position is not None
+
+
+    def predict(self, time):
+        """
+        Returns the colors (in [0, 1]) expected at time.
+        """
+        lead = min(time - self._time, self._maxLeadS)
+        return oklab_to_rgb(self._position + self._velocity * lead)
+
+
+    def _snap(self, measured, captureTime):
+        self._position = measured
+        self._velocity = np.zeros_like(measured)
+        self._time = captureTime
+
+
+def rgb_to_oklab(rgb):
+    """
+    Converts an (N, 3) array of sRGB colors in [0, 1] to OKLab.
+    """
+    linear = np.where(rgb <= 0.04045, rgb / 12.92,
+                      np.power((np.maximum(rgb, 0.04045) + 0.055) / 1.055,
+                               2.4))
+    return np.cbrt(linear @ OKLAB_M1.T) @ OKLAB_M2.T
+
+
+def oklab_to_rgb(lab):
+    """
+    Converts an (N, 3) array of OKLab colors to sRGB in [0, 1], clipping
+    colors outside the sRGB gamut.
+    """
+    linear = np.clip(np.power(lab @ OKLAB_M2_INV.T, 3) @ OKLAB_M1_INV.T, 0, 1)
+    return np.where(linear <= 0.0031308, linear * 12.92,
+                    1.055 * np.power(linear, 1 / 2.4) - 0.055)
+
+
+def _simulate(latencyS, fps=30, numLeds=100, durationS=4, noise=1 / 255):
+    """
+    Plays a slow fade, a fast fade and a scene cut, with some sampling noise,
+    through the predictor and returns the mean color error (0-255) against
+    the screen of the delayed colors without and with prediction.
+    """
+    prefs = DEFAULT_PREDICTION_PREFS
+    predictor = ColorPredictor(prefs["alpha"], prefs["beta"],
+                               prefs["scene_cut_threshold"],
+                               prefs["max_lead_ms"] / 1000)
+    positions = np.linspace(0, 1, numLeds)[:, np.newaxis]
+    rng = np.random.default_rng(0)
+
+    def screen(time):
+        # A gradient fading slowly for the first half, then five times
+        # faster, and cutting to another scene for the last quarter
+        halfTime = durationS / 2
+        phase = 0.2 * min(time, halfTime) + max(0, time - halfTime)
+        colors = 0.5 + 0.4 * np.sin(2 * np.pi * (positions + phase
+                                                 + np.array([0, 1, 2]) / 3))
+        return colors if time < durationS * 3 / 4 else 1 - colors
+
+    delayedErrors, predictedErrors = [], []
+    for frameNb in range(int(durationS * fps)):
+        captureTime = frameNb / fps
+        colors = np.clip(screen(captureTime) \
+                            + rng.normal(0, noise, (numLeds, 3)), 0, 1)
+        predictor.update(colors, captureTime)
+        showTime = captureTime + latencyS
+        actual = screen(showTime)
+        delayedErrors.append(np.abs(colors - actual).mean() * 255)
+        predictedErrors.append(
+                np.abs(predictor.predict(showTime) - actual).mean() * 255)
+
+    return (np.mean(delayedErrors), np.mean(predictedErrors))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 2):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} [pipeline latency ms]")
+        exit(1)
+
+    latencyMs = float(sys.argv[1]) if len(sys.argv) == 2 else 60
+    delayedError, predictedError = _simulate(latencyMs / 1000)
+    print(f"Mean color error {latencyMs:.0f}ms behind the screen: "
+          f"{delayedError:.2f} without prediction, "
+          f"{predictedError:.2f} with prediction")
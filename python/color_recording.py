@@ -0,0 +1,100 @@
+from os import path
+import numpy as np
+import struct
+
+RECORDING_MAGIC = b"BLCR"
+RECORDING_VERSION = 1
+# Magic, version, header size, record size and the LED count of every side
+HEADER_FORMAT = "<4sHHI4I"
+HEADER_SIZE = 64
+RECORDING_SIDES = ("top", "bottom", "left", "right")
+
+def record_dtype(counts):
+    """
+    Returns the numpy dtype of one record: a timestamp in seconds followed by
+    the uint8 RGB colors of every side.
+    """
+    return np.dtype([("timestamp", "<f8")] + [
+        (side, np.uint8, (counts[side], 3)) for side in RECORDING_SIDES
+    ])
+
+
+class ColorRecorder:
+    """
+    Appends the sampled colors of every frame to a recording. A recording is
+    a 64 byte header holding the LED counts followed by fixed size records,
+    so it can be memory mapped as a numpy array (see read_recording) and
+    stays readable up to the last complete record if the script is killed.
+
+    Appending to an existing recording requires the same LED counts.
+    """
+    def __init__(self, recordingPath, counts):
+        self._dtype = record_dtype(counts)
+        if path.exists(recordingPath) and path.getsize(recordingPath) > 0:
+            existingCounts = _read_header(recordingPath)
+            if existingCounts != {side: counts[side] \
+                                    for side in RECORDING_SIDES}:
+                print(f"ERROR: {recordingPath} was recorded with LED counts "
+                      f"{existingCounts}, but led.json has {counts}.")
+                exit(1)
+            self._file = open(recordingPath, "ab")
+        else:
+            self._file = open(recordingPath, "wb")
+            self._file.write(_pack_header(counts, self._dtype.itemsize))
+
+        self._record = np.zeros(1, dtype=self._dtype)
+
+
+    def write(self, colors, timestamp):
+        self._record["timestamp"] = timestamp
+        for side in RECORDING_SIDES:
+            self._record[side] = colors[side]
+        self._file.write(self._record.tobytes())
+
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(recordingPath):
+    """
+    Returns (counts, records) of a recording, where records is a read-only
+    memory mapped structured array with one entry per frame.
+    """
+    counts = _read_header(recordingPath)
+    dtype = record_dtype(counts)
+    numRecords = (path.getsize(recordingPath) - HEADER_SIZE) // dtype.itemsize
+    if numRecords == 0:
+        return (counts, np.zeros(0, dtype=dtype))
+
+    records = np.memmap(recordingPath, dtype=dtype, mode="r",
+                        offset=HEADER_SIZE, shape=(numRecords,))
+    return (counts, records)
+
+
+def _pack_header(counts, recordSize):
+    header = struct.pack(HEADER_FORMAT, RECORDING_MAGIC, RECORDING_VERSION,
+                         HEADER_SIZE, recordSize,
+                         *[counts[side] for side in RECORDING_SIDES])
+    return header.ljust(HEADER_SIZE, b"\0")
+
+
+def _read_header(recordingPath):
+    with open(recordingPath, "rb") as recordingFile:
+        header = recordingFile.read(HEADER_SIZE)
+
+    if len(header) < HEADER_SIZE or not header.startswith(RECORDING_MAGIC):
+        print(f"ERROR: {recordingPath} is not a color recording.")
+        exit(1)
+
+    _, version, _, recordSize, *sideCounts = \
+        struct.unpack_from(HEADER_FORMAT, header)
+    if version != RECORDING_VERSION:
+        print(f"ERROR: {recordingPath} has unsupported version {version}.")
+        exit(1)
+
+    counts = dict(zip(RECORDING_SIDES, sideCounts))
+    if record_dtype(counts).itemsize != recordSize:
+        print(f"ERROR: {recordingPath} has inconsistent record sizes.")
+        exit(1)
+    return counts
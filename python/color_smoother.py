@@ -0,0 +1,167 @@
+from color_predictor import oklab_to_rgb, rgb_to_oklab
+from math import pi
+import numpy as np
+import sys
+
+DEFAULT_SMOOTHING_PREFS = {
+    "mode": "lerp",
+    "min_cutoff_hz": 1.0,
+    "speed_coefficient": 0.1,
+    "derivative_cutoff_hz": 2.0,
+    "converged_threshold": 0.5,
+    "scene_cut_threshold": 20,
+}
+# Same as the LED controller's fixed lerp, for the comparison below
+LERP_PARAMETER = 0.5
+MAX_ITERATIONS_SINCE_FRAME = 10
+
+class AdaptiveSmoother:
+    """
+    A One-Euro filter over the OKLab colors of every LED of one side, stepped
+    once per render iteration. Each LED's cutoff frequency grows with how
+    fast its target colors change between frames, so LEDs on a still picture
+    are smoothed heavily and don't flicker with camera noise, while LEDs on a
+    moving picture follow it closely.
+
+    Distances are in OKLab x100, where ~1 is a just noticeable difference.
+    Unlike the fixed lerp, the smoothing depends on the time between render
+    iterations rather than their number, and a side reports when it reached
+    its target so the LED controller can stop rendering.
+    """
+    def __init__(self, minCutoffHz, speedCoefficient, derivativeCutoffHz,
+                 convergedThreshold):
+        self._minCutoffHz = minCutoffHz
+        self._speedCoefficient = speedCoefficient
+        self._derivativeCutoffHz = derivativeCutoffHz
+        self._convergedThreshold = convergedThreshold
+        self._colors = None
+        # Per LED, in OKLab x100 per second
+        self._speed = None
+        self._prevTarget = None
+        self._prevTargetTime = None
+        self._prevStepTime = None
+
+
+    def observe(self, rgb, captureTime):
+        """
+        Adds the target colors (in [0, 1]) of a frame captured at
+        captureTime and returns how far each LED's target moved.
+        """
+        target = rgb_to_oklab(rgb)
+        if self._prevTarget is None:
+            distances = np.zeros(len(target))
+            self._speed = np.zeros(len(target))
+        else:
+            distances = np.linalg.norm(target - self._prevTarget, axis=1) * 100
+            dt = captureTime - self._prevTargetTime
+            if dt > 0:
+                alpha = _smoothing_factor(self._derivativeCutoffHz, dt)
+                self._speed += alpha * (distances / dt - self._speed)
+
+        self._prevTarget = target
+        self._prevTargetTime = captureTime
+        return distances
+
+
+    def step(self, rgb, time, snap=False):
+        """
+        Moves the colors towards the target colors rgb (in [0, 1]) by the
+        time passed since the last step, or right onto them with snap.
+        Returns the colors to show and whether they settled, so rendering
+        can stop until the next frame.
+        """
+        target = rgb_to_oklab(rgb)
+        prevColors = self._colors if self._colors is not None else target
+        if self._colors is None or snap:
+            self._colors = target
+        else:
+            speed = self._speed if self._speed is not None else 0
+            cutoffHz = self._minCutoffHz + self._speedCoefficient * speed
+            alpha = _smoothing_factor(np.broadcast_to(cutoffHz, len(target)),
+                                      time - self._prevStepTime)
+            self._colors = self._colors \
+                + alpha[:, np.newaxis] * (target - self._colors)
+        self._prevStepTime = time
+
+        # Once a step changes no LED noticeably, the next ones won't either,
+        # and the next step after a pause catches up on the time passed
+        converged = np.linalg.norm(self._colors - prevColors, axis=1).max() \
+                        * 100 <= self._convergedThreshold
+        return (oklab_to_rgb(self._colors), converged)
+
+
+def _smoothing_factor(cutoffHz, dt):
+    tau = 1 / (2 * pi * np.asarray(cutoffHz))
+    return dt / (dt + tau)
+
+
+def _simulate(renderS, fps=30, numLeds=100, noise=1.5 / 255, durationS=2):
+    """
+    Renders a still picture with camera noise followed by a hard cut, like
+    the LED controller does, with the fixed lerp and with the adaptive
+    smoother. Returns, for each, the flicker (standard deviation of an LED
+    channel while the picture is still, 0-255), the LED frames rendered per
+    camera frame and the LED frames until the LEDs were within 2/255 of the
+    picture after the cut.
+    """
+    prefs = DEFAULT_SMOOTHING_PREFS
+    rng = np.random.default_rng(0)
+    still = rng.uniform(0.1, 0.9, (numLeds, 3))
+    cut = 1 - still
+    numFrames = int(durationS * fps)
+    # LED frames that fit between two camera frames
+    maxIterations = min(max(1, int(1 / (fps * renderS))),
+                        MAX_ITERATIONS_SINCE_FRAME)
+
+    results = {}
+    for mode in ("lerp", "adaptive"):
+        smoother = AdaptiveSmoother(prefs["min_cutoff_hz"],
+                                    prefs["speed_coefficient"],
+                                    prefs["derivative_cutoff_hz"],
+                                    prefs["converged_threshold"])
+        shown = still
+        stillColors, stillIterations, cutIterations = [], 0, 0
+        for frameNb in range(numFrames + fps):
+            time = frameNb / fps
+            picture = still if frameNb < numFrames else cut
+            target = np.clip(picture + rng.normal(0, noise, picture.shape),
+                             0, 1)
+            snap = False
+            if mode == "adaptive":
+                distances = smoother.observe(target, time)
+                snap = distances.mean() > prefs["scene_cut_threshold"]
+
+            for iteration in range(maxIterations):
+                if mode == "lerp":
+                    shown = shown + LERP_PARAMETER * (target - shown)
+                    converged = False
+                else:
+                    shown, converged = smoother.step(
+                            target, time + iteration * renderS,
+                            snap and iteration == 0)
+                if frameNb < numFrames:
+                    stillIterations += 1
+                elif np.abs(shown - picture).mean() > 2 / 255:
+                    cutIterations += 1
+                if converged:
+                    break
+            if fps <= frameNb < numFrames:
+                stillColors.append(shown)
+
+        results[mode] = (np.std(stillColors, axis=0).mean() * 255,
+                         stillIterations / numFrames, cutIterations + 1)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 2):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} [ms per LED frame]")
+        exit(1)
+
+    renderMs = float(sys.argv[1]) if len(sys.argv) == 2 else 5
+    for mode, (flicker, iterations, cutIterations) \
+            in _simulate(renderMs / 1000).items():
+        print(f"{mode:>8}: flicker {flicker:.2f}, "
+              f"{iterations:.1f} LED frames per camera frame, "
+              f"{cutIterations} LED frames to follow a cut")
@@ -0,0 +1,205 @@
+from os import path
+from time import perf_counter
+import mmap
+import numpy as np
+import os
+import struct
+import sys
+
+SNAPSHOT_PATH = "/dev/shm/backlight_led_colors"
+SNAPSHOT_MAGIC = b"BLCS"
+SNAPSHOT_VERSION = 1
+# Magic, version, sequence, closed flag and number of sides
+HEADER_FORMAT = "<4sHHII"
+SEQUENCE_OFFSET = 8
+CLOSED_OFFSET = 12
+# Name and LED count of every side
+SIDE_FORMAT = "<32sI"
+READ_RETRIES = 3
+
+class ColorSnapshotWriter:
+    """
+    Publishes the colors the LED controller shows, per side, in a memory
+    mapped file in /dev/shm, so tools like the camera control webpage can
+    follow the LEDs without talking to the pipeline. Publishing costs one
+    copy of the LED colors per LED frame.
+
+    The file holds a header, the name and LED count of every side, and the
+    RGB colors of all sides back to back. The sequence in the header is odd
+    while the colors are written, so readers can retry torn reads.
+    """
+    def __init__(self, sideIndices, snapshotPath=SNAPSHOT_PATH):
+        self._snapshotPath = snapshotPath
+        sides = list(sideIndices)
+        header = struct.pack(HEADER_FORMAT, SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                             0, 0, len(sides))
+        for side in sides:
+            header += struct.pack(SIDE_FORMAT, side.encode(),
+                                  len(sideIndices[side]))
+        # The LEDs of every side, in side order, within the strip colors
+        self._indices = np.concatenate([sideIndices[side] for side in sides])
+
+        # Written next to the snapshot and moved over it, so a reader of a
+        # previous run's snapshot never sees a half written header
+        tmpPath = snapshotPath + ".tmp"
+        with open(tmpPath, "wb") as snapshotFile:
+            snapshotFile.write(header)
+            snapshotFile.write(bytes(len(self._indices) * 3))
+        with open(tmpPath, "r+b") as snapshotFile:
+            self._data = mmap.mmap(snapshotFile.fileno(), 0)
+        os.replace(tmpPath, snapshotPath)
+        self._inode = os.stat(snapshotPath).st_ino
+
+        self._sequence = np.frombuffer(self._data, dtype="<u4", count=1,
+                                       offset=SEQUENCE_OFFSET)
+        self._colors = np.frombuffer(self._data, dtype=np.uint8,
+                                     offset=len(header)) \
+                         .reshape(len(self._indices), 3)
+
+
+    def publish(self, stripColors):
+        self._sequence[0] += 1
+        np.take(stripColors, self._indices, axis=0, out=self._colors)
+        self._sequence[0] += 1
+
+
+    def close(self):
+        struct.pack_into("<I", self._data, CLOSED_OFFSET, 1)
+        # Another run may have replaced the snapshot already
+        try:
+            if os.stat(self._snapshotPath).st_ino == self._inode:
+                os.remove(self._snapshotPath)
+        except FileNotFoundError:
+            pass
+        del self._sequence, self._colors
+        self._data.close()
+
+
+def open_snapshot_writer(sideIndices, snapshotPath=SNAPSHOT_PATH):
+    """
+    Returns a ColorSnapshotWriter, or None if the snapshot can't be created.
+    """
+    if not path.isdir(path.dirname(snapshotPath)):
+        print(f"WARN: {path.dirname(snapshotPath)} does not exist. LED colors "
+              "won't be published.")
+        return None
+    return ColorSnapshotWriter(sideIndices, snapshotPath)
+
+
+class ColorSnapshotReader:
+    """
+    Reads the colors published by a running pipeline. Follows the pipeline
+    across restarts, and reads None while it isn't running.
+    """
+    def __init__(self, snapshotPath=SNAPSHOT_PATH):
+        self._snapshotPath = snapshotPath
+        self._data = None
+        self._inode = None
+        self.sides = None
+
+
+    def read(self):
+        """
+        Returns the RGB colors of all sides as an (N, 3) uint8 array, in the
+        order of self.sides, a list of (name, count). Returns None if the
+        pipeline isn't running.
+        """
+        if not self._is_open():
+            self._close()
+            if not self._open():
+                return None
+
+        for _ in range(READ_RETRIES):
+            sequence = self._sequence[0]
+            colors = self._colors.copy()
+            if sequence % 2 == 0 and self._sequence[0] == sequence:
+                return colors
+        # Still being written, so the last frame is as good as any
+        return colors
+
+
+    def close(self):
+        self._close()
+
+
+    def _is_open(self):
+        if self._data is None or self._data.closed \
+                or struct.unpack_from("<I", self._data, CLOSED_OFFSET)[0]:
+            return False
+        try:
+            return os.stat(self._snapshotPath).st_ino == self._inode
+        except FileNotFoundError:
+            return False
+
+
+    def _open(self):
+        try:
+            with open(self._snapshotPath, "rb") as snapshotFile:
+                self._inode = os.fstat(snapshotFile.fileno()).st_ino
+                self._data = mmap.mmap(snapshotFile.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # ValueError: the file is empty
+            return False
+
+        magic, version, _, _, numSides = \
+            struct.unpack_from(HEADER_FORMAT, self._data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            print(f"WARN: {self._snapshotPath} is not a version "
+                  f"{SNAPSHOT_VERSION} LED color snapshot.")
+            self._close()
+            return False
+
+        offset = struct.calcsize(HEADER_FORMAT)
+        self.sides = []
+        for _ in range(numSides):
+            name, count = struct.unpack_from(SIDE_FORMAT, self._data, offset)
+            self.sides.append((name.rstrip(b"\0").decode(), count))
+            offset += struct.calcsize(SIDE_FORMAT)
+
+        self._sequence = np.frombuffer(self._data, dtype="<u4", count=1,
+                                       offset=SEQUENCE_OFFSET)
+        self._colors = np.frombuffer(self._data, dtype=np.uint8,
+                                     offset=offset).reshape(-1, 3)
+        return True
+
+
+    def _close(self):
+        if self._data is not None:
+            self._sequence = None
+            self._colors = None
+            self._data.close()
+        self._data = None
+        self.sides = None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 2):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} [num LEDs]")
+        exit(1)
+
+    # Measures what publishing adds to every LED frame
+    numLeds = int(sys.argv[1]) if len(sys.argv) == 2 else 280
+    sideCount = numLeds // 4
+    sideIndices = {side: np.arange(idx * sideCount, (idx + 1) * sideCount) \
+                    for idx, side in enumerate(("top", "right", "bottom",
+                                                "left"))}
+    stripColors = np.random.default_rng(0).integers(
+            0, 256, (sideCount * 4, 3), dtype=np.uint8)
+    snapshotPath = path.join("/tmp", path.basename(SNAPSHOT_PATH))
+    writer = ColorSnapshotWriter(sideIndices, snapshotPath)
+    numFrames = 10000
+    startTime = perf_counter()
+    for _ in range(numFrames):
+        writer.publish(stripColors)
+    elapsed = perf_counter() - startTime
+
+    reader = ColorSnapshotReader(snapshotPath)
+    if not np.array_equal(reader.read(), stripColors):
+        print("ERROR: Read different colors than were published.")
+        exit(1)
+    reader.close()
+    writer.close()
+    print(f"Published {sideCount * 4} LEDs in "
+          f"{elapsed / numFrames * 1e6:.1f}us per frame")
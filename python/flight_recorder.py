@@ -0,0 +1,412 @@
+from color_recording import record_dtype, RECORDING_SIDES
+from multiprocessing import active_children
+from os import path
+from time import monotonic, perf_counter, strftime
+import glob
+import json
+import mmap
+import numpy as np
+import os
+import signal
+import struct
+import sys
+import threading
+import user_pref
+
+DEFAULT_FLIGHT_RECORDER_PREFS = {
+    "enabled": True,
+    # Frames older than this are left out of dumps
+    "seconds": 10,
+    # Memory for the JPEG frames. Fewer seconds are kept if it fills up.
+    "arena_mb": 16,
+    # Dump when a frame took longer than this from capture until its colors
+    # were sent. 0 only dumps on FLIGHT_RECORDER_SIGNAL.
+    "latency_threshold_ms": 250,
+    "min_dump_interval_s": 60,
+    "dump_dir": "flight_recordings",
+    # Older dumps are deleted
+    "max_dumps": 10,
+}
+# SIGUSR1 and SIGUSR2 write profiles and traces
+FLIGHT_RECORDER_SIGNAL = signal.SIGRTMIN
+MAX_CAMERA_FPS = 60
+DUMP_MAGIC = b"BLFR"
+DUMP_VERSION = 1
+# Magic, version, header size, metadata size, number of frames and JPEG bytes
+HEADER_FORMAT = "<4sHHIIQ"
+HEADER_SIZE = 64
+# Timings are NaN for frames that weren't processed, ex. dropped for a newer
+# frame or while idle
+FRAME_DTYPE = np.dtype([
+    ("frame_nb", "<i8"),
+    ("capture_time", "<f8"),
+    # Position in the arena, and in a dump, from the start of the JPEG data
+    ("offset", "<i8"),
+    ("length", "<i8"),
+    ("frame_age_s", "<f4"),
+    ("decode_s", "<f4"),
+    ("process_s", "<f4"),
+    ("latency_s", "<f4"),
+])
+
+class FlightRecorder:
+    """
+    Keeps the JPEG frames, stage timings and sampled colors of the last
+    frames of one camera, and writes them to one file when a frame's latency
+    exceeds latency_threshold_ms or on FLIGHT_RECORDER_SIGNAL, to find what
+    caused a stutter after the fact.
+
+    Frames are copied once, by the camera thread, into a fixed arena used as
+    a ring, so memory stays at arena_mb whatever the frame sizes. Timings and
+    colors live in preallocated arrays with one entry per frame. Dumps are
+    written by a background thread, and can be played by RecordedCamera
+    (frames at their recorded capture times) and replay.py (colors).
+    """
+    def __init__(self, name, counts, resolution, prefs):
+        self._name = name
+        self._counts = {side: counts[side] for side in RECORDING_SIDES}
+        self._resolution = resolution
+        self._prefs = prefs
+        self._arenaSize = int(prefs["arena_mb"] * (1 << 20))
+        self._arena = np.frombuffer(mmap.mmap(-1, self._arenaSize),
+                                    dtype=np.uint8)
+        capacity = int(prefs["seconds"] * MAX_CAMERA_FPS)
+        self._frames = np.zeros(capacity, dtype=FRAME_DTYPE)
+        self._colors = np.zeros(capacity, dtype=record_dtype(self._counts))
+        # Frames added so far, and where in the never wrapping arena
+        # positions the next one goes
+        self._count = 0
+        self._arenaEnd = 0
+        # Held by the camera thread while adding a frame, and by dump()
+        self._lock = threading.Lock()
+        self._dumpReason = None
+        self._lastDumpTime = None
+        self._writeThread = None
+
+
+    def add_frame(self, frameNb, captureTime, data):
+        """
+        Copies a JPEG frame into the arena, overwriting the oldest frames,
+        and returns its sequence number for finish_frame().
+        """
+        length = len(data)
+        if length > self._arenaSize:
+            return -1
+
+        with self._lock:
+            position = self._arenaEnd
+            # Frames never wrap around the end of the arena
+            if position % self._arenaSize + length > self._arenaSize:
+                position += self._arenaSize - position % self._arenaSize
+            start = position % self._arenaSize
+            self._arena[start:start + length] = np.frombuffer(data, np.uint8)
+            self._arenaEnd = position + length
+
+            slot = self._count % len(self._frames)
+            self._frames[slot] = (frameNb, captureTime, position, length,
+                                  np.nan, np.nan, np.nan, np.nan)
+            self._colors["timestamp"][slot] = captureTime
+            self._count += 1
+            return self._count - 1
+
+
+    def finish_frame(self, sequence, frameAge, decodeS, processS, colors):
+        """
+        Records the timings and sampled colors of a processed frame, and asks
+        for a dump if it exceeded the latency threshold.
+        """
+        if sequence < 0 or sequence < self._count - len(self._frames):
+            return
+
+        slot = sequence % len(self._frames)
+        frames = self._frames
+        latency = monotonic() - frames["capture_time"][slot]
+        frames["frame_age_s"][slot] = frameAge
+        frames["decode_s"][slot] = decodeS
+        frames["process_s"][slot] = processS
+        frames["latency_s"][slot] = latency
+        for side in RECORDING_SIDES:
+            self._colors[side][slot] = colors[side]
+
+        thresholdMs = self._prefs["latency_threshold_ms"]
+        if thresholdMs > 0 and latency * 1000 > thresholdMs:
+            self.request_dump(f"frame {frames['frame_nb'][slot]} took "
+                              f"{latency * 1000:.0f}ms")
+
+
+    def request_dump(self, reason):
+        """
+        Asks for a dump by the next dump_if_requested(). Safe to call from a
+        signal handler.
+        """
+        if self._dumpReason is None:
+            self._dumpReason = reason
+
+
+    def dump_if_requested(self):
+        """
+        Dumps if asked to, unless the last automatic dump was less than
+        min_dump_interval_s ago. Called regularly by the decode loop.
+        """
+        reason = self._dumpReason
+        if reason is None:
+            return
+        self._dumpReason = None
+
+        now = monotonic()
+        minIntervalS = self._prefs["min_dump_interval_s"]
+        if reason != "signal" and self._lastDumpTime is not None \
+                and now - self._lastDumpTime < minIntervalS:
+            return
+        self._lastDumpTime = now
+        self.dump(reason)
+
+
+    def dump(self, reason):
+        """
+        Copies the last seconds of frames out of the ring and writes them in
+        the background. Returns the path of the dump.
+        """
+        with self._lock:
+            first = max(0, self._count - len(self._frames))
+            slots = np.arange(first, self._count) % len(self._frames)
+            frames = self._frames[slots]
+            colors = self._colors[slots]
+            # Frames overwritten in the arena, or older than the kept seconds
+            keep = frames["offset"] >= self._arenaEnd - self._arenaSize
+            if len(frames) > 0:
+                keep &= frames["capture_time"] >= frames["capture_time"][-1] \
+                                                    - self._prefs["seconds"]
+            frames, colors = frames[keep], colors[keep]
+            starts = frames["offset"] % self._arenaSize
+            frames["offset"] = np.cumsum(frames["length"]) - frames["length"]
+            data = np.empty(int(frames["length"].sum()), dtype=np.uint8)
+            for start, offset, length in zip(starts, frames["offset"],
+                                             frames["length"]):
+                data[offset:offset + length] = \
+                    self._arena[start:start + length]
+
+        # Relative to this directory, like the config files
+        dumpDir = path.join(path.dirname(__file__), self._prefs["dump_dir"])
+        os.makedirs(dumpDir, exist_ok=True)
+        dumpPath = path.join(dumpDir,
+                             f"{self._name}-{strftime('%Y%m%d-%H%M%S')}.blfr")
+        metadata = {
+            "name": self._name,
+            "reason": reason,
+            "counts": self._counts,
+            "resolution": list(self._resolution),
+        }
+        # Only one dump is written at a time
+        self.close()
+        self._writeThread = threading.Thread(
+                target=self._write_dump,
+                args=[dumpPath, metadata, frames, colors, data])
+        self._writeThread.start()
+        return dumpPath
+
+
+    def close(self):
+        """
+        Waits for the dump being written, if any.
+        """
+        if self._writeThread is not None:
+            self._writeThread.join()
+            self._writeThread = None
+
+
+    def _write_dump(self, dumpPath, metadata, frames, colors, data):
+        metadataBytes = json.dumps(metadata).encode()
+        header = struct.pack(HEADER_FORMAT, DUMP_MAGIC, DUMP_VERSION,
+                             HEADER_SIZE, len(metadataBytes), len(frames),
+                             len(data))
+        with open(dumpPath, "wb") as dumpFile:
+            dumpFile.write(header.ljust(HEADER_SIZE, b"\0"))
+            dumpFile.write(metadataBytes)
+            dumpFile.write(frames.tobytes())
+            dumpFile.write(colors.tobytes())
+            dumpFile.write(data)
+
+        durationS = frames["capture_time"][-1] - frames["capture_time"][0] \
+                        if len(frames) > 0 else 0
+        print(f"Wrote flight recording of {len(frames)} frames "
+              f"({durationS:.1f}s) to {dumpPath}: {metadata['reason']}")
+
+        dumps = sorted(glob.glob(path.join(path.dirname(dumpPath),
+                                           f"{self._name}-*.blfr")))
+        for oldPath in dumps[:-self._prefs["max_dumps"]]:
+            os.remove(oldPath)
+
+
+class NullFlightRecorder:
+    """
+    Stands in for FlightRecorder when it is disabled.
+    """
+    def add_frame(self, frameNb, captureTime, data):
+        return -1
+
+
+    def finish_frame(self, sequence, frameAge, decodeS, processS, colors):
+        pass
+
+
+    def request_dump(self, reason):
+        pass
+
+
+    def dump_if_requested(self):
+        pass
+
+
+    def close(self):
+        pass
+
+
+def open_flight_recorder(name, counts, resolution):
+    """
+    Returns the FlightRecorder of one camera, or a NullFlightRecorder if it
+    is disabled in pipeline.json. Dumps are requested on
+    FLIGHT_RECORDER_SIGNAL, so this must be called from the main thread.
+    """
+    prefs = user_pref.read_pipeline_prefs("flight_recorder",
+                                          DEFAULT_FLIGHT_RECORDER_PREFS)
+    if not prefs["enabled"]:
+        # The default action of the signal terminates the process
+        signal.signal(FLIGHT_RECORDER_SIGNAL, signal.SIG_IGN)
+        return NullFlightRecorder()
+
+    flightRecorder = FlightRecorder(name, counts, resolution, prefs)
+    signal.signal(FLIGHT_RECORDER_SIGNAL,
+                  lambda signum, frame: flightRecorder.request_dump("signal"))
+    return flightRecorder
+
+
+def forward_dump_signal():
+    """
+    Passes FLIGHT_RECORDER_SIGNAL on to the camera worker processes, for the
+    main process of a multiple display setup.
+    """
+    def on_signal(signum, frame):
+        for child in active_children():
+            if child.name.startswith("camera_"):
+                os.kill(child.pid, signum)
+
+    signal.signal(FLIGHT_RECORDER_SIGNAL, on_signal)
+
+
+def is_flight_recording(dumpPath):
+    with open(dumpPath, "rb") as dumpFile:
+        return dumpFile.read(len(DUMP_MAGIC)) == DUMP_MAGIC
+
+
+def parse_flight_recording(data, dumpPath):
+    """
+    Returns (metadata, frames, colors, dataOffset) of a dump read or memory
+    mapped into data. frames and colors are copies, and each frame's JPEG
+    bytes start at dataOffset + its offset in data.
+    """
+    if len(data) < HEADER_SIZE or data[:len(DUMP_MAGIC)] != DUMP_MAGIC:
+        print(f"ERROR: {dumpPath} is not a flight recording.")
+        exit(1)
+
+    _, version, headerSize, metadataSize, numFrames, _ = \
+        struct.unpack_from(HEADER_FORMAT, data)
+    if version != DUMP_VERSION:
+        print(f"ERROR: {dumpPath} has unsupported version {version}.")
+        exit(1)
+
+    offset = headerSize
+    metadata = json.loads(bytes(data[offset:offset + metadataSize]))
+    offset += metadataSize
+    frames = np.frombuffer(data, dtype=FRAME_DTYPE, count=numFrames,
+                           offset=offset).copy()
+    offset += FRAME_DTYPE.itemsize * numFrames
+    colorDtype = record_dtype(metadata["counts"])
+    colors = np.frombuffer(data, dtype=colorDtype, count=numFrames,
+                           offset=offset).copy()
+    offset += colorDtype.itemsize * numFrames
+    return (metadata, frames, colors, offset)
+
+
+def read_flight_colors(dumpPath):
+    """
+    Returns (counts, records) of the processed frames of a dump, like
+    color_recording.read_recording.
+    """
+    with open(dumpPath, "rb") as dumpFile:
+        metadata, frames, colors, _ = \
+            parse_flight_recording(dumpFile.read(), dumpPath)
+    return (metadata["counts"], colors[~np.isnan(frames["latency_s"])])
+
+
+def _show(dumpPath):
+    """
+    Prints the timings of every frame of a dump, marking the ones over the
+    latency threshold.
+    """
+    with open(dumpPath, "rb") as dumpFile:
+        metadata, frames, _, _ = \
+            parse_flight_recording(dumpFile.read(), dumpPath)
+    prefs = user_pref.read_pipeline_prefs("flight_recorder",
+                                          DEFAULT_FLIGHT_RECORDER_PREFS)
+    print(f"{metadata['name']}, {metadata['resolution'][0]}x"
+          f"{metadata['resolution'][1]}: {metadata['reason']}")
+    print("   frame      time  interval      size       age    decode"
+          "   process   latency")
+    prevTime = None
+    for entry in frames:
+        interval = "" if prevTime is None \
+                    else f"{(entry['capture_time'] - prevTime) * 1000:.1f}ms"
+        prevTime = entry["capture_time"]
+        time = entry["capture_time"] - frames["capture_time"][0]
+        if np.isnan(entry["latency_s"]):
+            timings = f"{'not processed':>39}"
+        else:
+            timings = "".join(f"{entry[field] * 1000:>8.1f}ms" for field in (
+                "frame_age_s", "decode_s", "process_s", "latency_s"))
+        slow = prefs["latency_threshold_ms"] > 0 \
+                and entry["latency_s"] * 1000 > prefs["latency_threshold_ms"]
+        print(f"{entry['frame_nb']:>8} {time:>8.3f}s {interval:>9} "
+              f"{entry['length'] / 1024:>7.1f}kB {timings}"
+              f"{'  <-' if slow else ''}")
+
+
+def _decode(dumpPath, repeats):
+    """
+    Decodes every frame of a dump again, to tell frames that are slow to
+    decode by their content from stutters caused by the rest of the system.
+    """
+    # Only needed to replay dumps, not by the pipeline
+    from pooled_decoder import PooledTurboJPEG
+    from turbojpeg import TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, TJPF_RGB
+
+    with open(dumpPath, "rb") as dumpFile:
+        data = dumpFile.read()
+    _, frames, _, dataOffset = parse_flight_recording(data, dumpPath)
+    decoder = PooledTurboJPEG()
+    print("   frame  recorded    replay")
+    for entry in frames:
+        start = dataOffset + entry["offset"]
+        frame = data[start:start + entry["length"]]
+        startTime = perf_counter()
+        for _ in range(repeats):
+            decoder.decode(frame, pixel_format=TJPF_RGB,
+                           flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+        decodeS = (perf_counter() - startTime) / repeats
+        recorded = "" if np.isnan(entry["decode_s"]) \
+                    else f"{entry['decode_s'] * 1000:.2f}ms"
+        print(f"{entry['frame_nb']:>8} {recorded:>9} {decodeS * 1000:>7.2f}ms")
+    decoder.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ("show", "decode"):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} show <dump>")
+        print(f"    python {sys.argv[0]} decode <dump> [repeats]")
+        exit(1)
+
+    if sys.argv[1] == "show":
+        _show(sys.argv[2])
+    else:
+        _decode(sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 5)
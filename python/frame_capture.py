@@ -0,0 +1,108 @@
+from collections import deque
+from time import perf_counter
+from turbojpeg import TurboJPEG, TJFLAG_FASTUPSAMPLE, TJFLAG_FASTDCT, TJPF_BGR, \
+    TJPF_GRAY
+import numpy as np
+import warnings
+
+SETTLE_SCALING_FACTOR = (1, 8)
+SETTLE_DIFF_THRESHOLD = 1.5
+SETTLE_WINDOW_FRAMES = 5
+SETTLE_TIMEOUT_S = 10
+
+def capture_settled_frame(cam, jpegDecoder=None, numMedianFrames=1,
+                          pixelFormat=TJPF_BGR,
+                          diffThreshold=SETTLE_DIFF_THRESHOLD,
+                          windowFrames=SETTLE_WINDOW_FRAMES,
+                          timeoutSec=SETTLE_TIMEOUT_S):
+    """
+    Streams frames from an open MJPEG camera until the exposure has settled
+    and returns a decoded frame.
+
+    Every frame is decoded as a heavily downscaled grayscale image, and the
+    camera is considered settled once the mean absolute difference between
+    consecutive frames stays below diffThreshold for windowFrames frames in a
+    row. If the camera never settles, the frame captured at timeoutSec is
+    used instead.
+
+    If numMedianFrames > 1, the per-pixel temporal median of the last
+    numMedianFrames frames is returned to reduce sensor noise. Only the JPEG
+    bytes of those frames are held while streaming, so memory stays bounded
+    to numMedianFrames compressed frames.
+    """
+    if jpegDecoder is None:
+        jpegDecoder = TurboJPEG()
+
+    recentJpegs = deque(maxlen=max(numMedianFrames, 1))
+    prevSmall = None
+    stableFrames = 0
+    numFrames = 0
+    settled = False
+    startTime = perf_counter()
+    for frame in cam:
+        jpeg = bytes(frame)
+        recentJpegs.append(jpeg)
+        numFrames += 1
+        small = _try_decode(jpegDecoder, jpeg, pixel_format=TJPF_GRAY,
+                            scaling_factor=SETTLE_SCALING_FACTOR,
+                            flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+        if small is None:
+            # Partial frames are common while the camera starts streaming
+            stableFrames = 0
+            prevSmall = None
+            if perf_counter() - startTime >= timeoutSec:
+                break
+            continue
+
+        if prevSmall is not None:
+            diff = np.mean(np.abs(np.subtract(small, prevSmall,
+                                              dtype=np.int16)))
+            stableFrames = stableFrames + 1 if diff < diffThreshold else 0
+        prevSmall = small
+
+        if stableFrames >= windowFrames \
+                and len(recentJpegs) == recentJpegs.maxlen:
+            settled = True
+            break
+        if perf_counter() - startTime >= timeoutSec:
+            break
+
+    elapsed = perf_counter() - startTime
+    if settled:
+        print(f"Camera settled after {numFrames} frames ({elapsed:.2f}s).")
+    else:
+        print(f"WARN: Camera did not settle within {timeoutSec}s. Using the "
+              "latest frame.")
+
+    return _median_of_jpegs(jpegDecoder, recentJpegs, pixelFormat)
+
+
+def _try_decode(jpegDecoder, jpeg, **kwargs):
+    """
+    Returns the decoded frame, or None if the JPEG is broken. Depending on
+    the damage, TurboJPEG raises, or only warns and returns an empty frame.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            frame = jpegDecoder.decode(jpeg, **kwargs)
+    except (OSError, ValueError):
+        return None
+    return frame if frame.size > 0 else None
+
+
+def _median_of_jpegs(jpegDecoder, jpegs, pixelFormat):
+    frames = [_try_decode(jpegDecoder, jpeg, pixel_format=pixelFormat,
+                          flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT) \
+                for jpeg in jpegs]
+    frames = [frame for frame in frames if frame is not None]
+
+    if len(frames) == 0:
+        print("ERROR: None of the last frames from the camera could be "
+              "decoded. Check that it streams MJPEG.")
+        exit(1)
+    if len(frames) == 1:
+        return frames[0]
+
+    return np.median(np.stack(frames), axis=0,
+                     overwrite_input=True).astype(np.uint8)
@@ -0,0 +1,108 @@
+from time import perf_counter, process_time
+import numpy as np
+
+DEFAULT_IDLE_PREFS = {
+    "enabled": True,
+    # Seconds the screen must stay dark or unchanged before idling
+    "idle_after_s": 10,
+    # Largest change of any LED channel (0-255) that counts as unchanged
+    "static_threshold": 6,
+    # LED channels at or below this value count as dark
+    "dark_threshold": 12,
+    "idle_fps": 10,
+    # JPEG decode scale while idle, one of the scales libjpeg-turbo supports
+    "idle_decode_scale": [1, 4],
+}
+
+class IdleMonitor:
+    """
+    Tracks how long the sampled colors have been quiet, i.e. within
+    staticThreshold of the colors at the start of the quiet period, or dark.
+    Comparing against the start of the period rather than the previous frame
+    means slow fades still count as changes.
+    """
+    def __init__(self, staticThreshold, darkThreshold):
+        self._staticThreshold = staticThreshold
+        self._darkThreshold = darkThreshold
+        self._anchor = None
+        self._quietSince = None
+
+
+    def observe(self, colors, now):
+        """
+        Returns True if colors differ from the start of the quiet period,
+        which then starts over.
+        """
+        colors = np.concatenate([colors[side] for side in sorted(colors)]) \
+                    .astype(np.int16)
+        if self._anchor is None:
+            self._anchor, self._quietSince = colors, now
+            return False
+        if not self._changed(colors):
+            return False
+
+        self._anchor, self._quietSince = colors, now
+        return True
+
+
+    def quiet_time(self, now):
+        return 0 if self._quietSince is None else now - self._quietSince
+
+
+    def reset(self):
+        """
+        Forgets the quiet period, ex. when colors are about to be sampled
+        differently.
+        """
+        self._anchor = None
+        self._quietSince = None
+
+
+    def _changed(self, colors):
+        if colors.max() <= self._darkThreshold \
+                and self._anchor.max() <= self._darkThreshold:
+            return False
+        return np.abs(colors - self._anchor).max() > self._staticThreshold
+
+
+class ModeClock:
+    """
+    Accumulates the wall time and the CPU time of this process (all threads)
+    spent in each mode.
+    """
+    def __init__(self, modes, initialMode):
+        self.wallTimes = {mode: 0.0 for mode in modes}
+        self.cpuTimes = {mode: 0.0 for mode in modes}
+        self.mode = initialMode
+        self._lastWall = perf_counter()
+        self._lastCpu = process_time()
+
+
+    def update(self):
+        """
+        Adds the time since the last update to the current mode and returns
+        the (wall, cpu) time added.
+        """
+        wall, cpu = perf_counter(), process_time()
+        wallDelta, cpuDelta = wall - self._lastWall, cpu - self._lastCpu
+        self.wallTimes[self.mode] += wallDelta
+        self.cpuTimes[self.mode] += cpuDelta
+        self._lastWall, self._lastCpu = wall, cpu
+        return (wallDelta, cpuDelta)
+
+
+    def restart(self):
+        """
+        Starts measuring from now, without counting the time since the last
+        update.
+        """
+        self._lastWall = perf_counter()
+        self._lastCpu = process_time()
+
+
+    def summary(self):
+        parts = []
+        for mode, wallTime in self.wallTimes.items():
+            cpuLoad = self.cpuTimes[mode] / wallTime if wallTime > 0 else 0
+            parts.append(f"{mode} {wallTime:.1f}s at {cpuLoad * 100:.0f}% CPU")
+        return ", ".join(parts)
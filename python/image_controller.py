@@ -1,37 +1,181 @@
+from color_recording import ColorRecorder
 from copy import deepcopy
+from flight_recorder import NullFlightRecorder, open_flight_recorder
+from idle_monitor import IdleMonitor, ModeClock, DEFAULT_IDLE_PREFS
 from led_controller import LEDInterface
-from turbojpeg import TurboJPEG, TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, TJPF_RGB
+from metrics import MetricsRegistry
+from os import path
+from pooled_decoder import PooledTurboJPEG
+from recorded_camera import RecordedCamera
+from letterbox import LetterboxSampler, DEFAULT_CHECK_INTERVAL, \
+    DEFAULT_CONFIRM_CHECKS, DEFAULT_BLACK_THRESHOLD, DEFAULT_MAX_BAR, \
+    DEFAULT_BAR_LEVELS
+from region_sampler import RegionSampler, DEFAULT_INSET_DEPTH_PX, \
+    DEFAULT_EDGE_OFFSET_PX
+from supervisor import Backoff, Heartbeat, StageRecovery, \
+    DEFAULT_SUPERVISOR_PREFS
+from turbojpeg import TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, TJPF_RGB
+from time import monotonic, perf_counter, sleep
 from utils import get_led_sample_points
-from v4l2py import Device
-from v4l2py.device import BufferType
-import cv2
+from v4l2py import Device, raw
+from v4l2py.device import BufferType, VideoCapture
 import numpy as np
-import queue, threading
+import queue, select, threading, traceback
+import tracer
 import user_pref
 
 FRAME_GET_TIMEOUT_S = 0.1
-BLUR_WINDOW_SIZE = 9
-BLUR_WINDOW_OFFSET = BLUR_WINDOW_SIZE // 2
+CAMERA_THREAD_JOIN_TIMEOUT_S = 1
+CAMERA_FPS = 30
+ACTIVE_MODE = "active"
+IDLE_MODE = "idle"
+FRAME_AGE_BUCKETS_S = (0.01, 0.02, 0.033, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3,
+                       0.5)
+DEFAULT_SAMPLING_PREFS = {
+    "inset_depth": DEFAULT_INSET_DEPTH_PX,
+    "edge_offset": DEFAULT_EDGE_OFFSET_PX,
+    "letterbox": True,
+    "letterbox_check_interval": DEFAULT_CHECK_INTERVAL,
+    "letterbox_confirm_checks": DEFAULT_CONFIRM_CHECKS,
+    "letterbox_black_threshold": DEFAULT_BLACK_THRESHOLD,
+    "letterbox_max_bar": DEFAULT_MAX_BAR,
+    "letterbox_levels": DEFAULT_BAR_LEVELS,
+}
+
+DEFAULT_CAPTURE_PREFS = {
+    # V4L2 buffers queued in the driver. Fewer buffers mean older frames
+    # can't pile up, but too few make the camera drop frames.
+    "buffer_count": 2,
+    # Measure frame age from the driver's timestamp of each buffer instead of
+    # the time it is dequeued
+    "driver_timestamps": True,
+    # Frames older than this when they are about to be decoded are dropped.
+    # 0 turns dropping off.
+    "max_frame_age_ms": 0,
+    # Skip to the newest buffer whenever several are ready
+    "drain_to_newest": False,
+}
 
 class ImageController:
-    def __init__(self):
-        pass
+    def __init__(self, metricsRegistry=None, recordingPath=None,
+                 display=None):
+        # Appends the sampled colors of every frame here, for replay.py
+        self._recordingPath = recordingPath
+        self._recorder = None
+        # One of user_pref.read_displays() when running several cameras,
+        # otherwise the camera and calibration come from the single camera
+        # config files
+        self._display = display
+        labels = None if display is None else {"display": display["name"]}
+        if metricsRegistry is None:
+            metricsRegistry = MetricsRegistry()
+        self._cameraFramesMetric = metricsRegistry.counter(
+                "backlight_camera_frames", "Frames received from the camera",
+                labels=labels)
+        self._droppedFramesMetric = metricsRegistry.counter(
+                "backlight_camera_frames_dropped",
+                "Camera frames replaced before they were processed",
+                labels=labels)
+        self._processedFramesMetric = metricsRegistry.counter(
+                "backlight_frames_processed",
+                "Camera frames decoded and sampled",
+                labels=labels)
+        self._decodeErrorsMetric = metricsRegistry.counter(
+                "backlight_decode_errors", "Camera frames that failed to decode",
+                labels=labels)
+        self._decodeTimeMetric = metricsRegistry.histogram(
+                "backlight_decode_seconds", "Time to decode one camera frame",
+                labels=labels)
+        self._processTimeMetric = metricsRegistry.histogram(
+                "backlight_frame_processing_seconds",
+                "Time to sample one decoded frame and hand it to the LEDs",
+                labels=labels)
+        self._frameAgeMetric = metricsRegistry.histogram(
+                "backlight_frame_age_seconds",
+                "Age of camera frames when they are about to be decoded",
+                labels=labels, buckets=FRAME_AGE_BUCKETS_S)
+        self._staleFramesMetric = metricsRegistry.counter(
+                "backlight_stale_frames",
+                "Camera frames dropped for being older than max_frame_age_ms",
+                labels=labels)
+        self._modeTimeMetrics = {}
+        self._modeCpuMetrics = {}
+        for mode in (ACTIVE_MODE, IDLE_MODE):
+            self._modeTimeMetrics[mode] = metricsRegistry.counter(
+                    "backlight_mode_seconds",
+                    "Time spent capturing in each mode",
+                    labels={"mode": mode, **(labels or {})})
+            self._modeCpuMetrics[mode] = metricsRegistry.counter(
+                    "backlight_mode_cpu_seconds",
+                    "CPU time of the capturing process in each mode",
+                    labels={"mode": mode, **(labels or {})})
+        self._cameraRecovery = StageRecovery(metricsRegistry, "camera", labels)
+        self._decodeRecovery = StageRecovery(metricsRegistry, "decode", labels)
+        # Decoder restarts since the last frame that was handled
+        self._decoderRestarts = 0
+        # Beaten for every received frame by the camera thread, and for every
+        # iteration of the decode loop, so a supervisor in another process can
+        # notice a hung camera worker
+        self._captureHeartbeat = Heartbeat()
+        self.decodeHeartbeat = Heartbeat()
 
 
     def __enter__(self):
-        self._setup_sample_points()
-        self.jpegDecoder = TurboJPEG()
+        # Frames are sampled before the next one is decoded, so they can be
+        # decoded into reused buffers
+        self.jpegDecoder = PooledTurboJPEG()
         self._frameQueue = queue.Queue(1)
-        self._stopThread = threading.Event()
+        self._stopThread = None
         self._cameraThread = None
+        self._cameraError = None
         self._frameThread = None
 
-        self._open_camera()
+        resolution = self._open_camera()
+        self._setup(tracer.get_tracer(
+                "main" if self._display is None \
+                    else f"camera_{self._display['name']}"), resolution)
         return self
 
 
+    def _setup(self, imageTracer, resolution, recordFlights=True):
+        """
+        Gets everything but the camera ready to process frames of the given
+        resolution. The benchmarks also use it to drive the controller
+        without a camera.
+        """
+        self._tracer = imageTracer
+        self._captureEvent = self._tracer.event("capture")
+        self._enqueueEvent = self._tracer.event("enqueue")
+        self._decodeEvent = self._tracer.event("decode")
+        self._sampleEvent = self._tracer.event("sample")
+        self._setColorsEvent = self._tracer.event("set_colors")
+
+        self._capturePrefs = user_pref.read_pipeline_prefs(
+                "capture", DEFAULT_CAPTURE_PREFS)
+        self._supervisorPrefs = user_pref.read_pipeline_prefs(
+                "supervisor", DEFAULT_SUPERVISOR_PREFS)
+        self._useDriverTimestamps = self._capturePrefs["driver_timestamps"]
+        self._idlePrefs = user_pref.read_pipeline_prefs("idle",
+                                                        DEFAULT_IDLE_PREFS)
+        self._idleMonitor = None
+        if self._idlePrefs["enabled"]:
+            self._idleMonitor = IdleMonitor(
+                    self._idlePrefs["static_threshold"],
+                    self._idlePrefs["dark_threshold"])
+        self._idle = False
+        self._canSetFps = True
+        self._modeClock = ModeClock([ACTIVE_MODE, IDLE_MODE], ACTIVE_MODE)
+
+        self._resolution = resolution
+        self._setup_sample_points(recordFlights)
+
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop_capture_and_processing()
+        self.jpegDecoder.close()
+        self._flightRecorder.close()
+        if self._recorder is not None:
+            self._recorder.close()
 
 
     def set_led_interface(self, ledInterface: LEDInterface):
@@ -39,24 +183,42 @@ class ImageController:
 
 
     def start_capture_and_processing(self):
-        self._stopThread.clear()
-        self._cameraThread = threading.Thread(
-                target=ImageController._camera_thread_loop, args=[self])
-        self._cameraThread.start()
+        self._start_camera_thread()
+
+        self._modeClock.restart()
+        if self._idle:
+            self._set_idle(False)
 
         # self.start_timer = perf_counter()
         # self.num_frames_processed = 0
         while self._ledInterface.update_and_get_power_state():
+            self.decodeHeartbeat.beat()
+            self._account_mode_time()
+            self._check_camera()
+            self._flightRecorder.dump_if_requested()
             try:
-                frame = self._frameQueue.get(timeout=FRAME_GET_TIMEOUT_S)
+                frameNb, captureTime, frame, recorderSequence = \
+                    self._frameQueue.get(timeout=FRAME_GET_TIMEOUT_S)
+                if self._cameraRecovery.recovering():
+                    self._cameraRecovery.recovered()
                 try:
-                    rgbFrame = self.jpegDecoder.decode(frame,
-                                                    pixel_format=TJPF_RGB,
-                                                    flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
-                    self._process_one_frame(rgbFrame)
+                    self._handle_frame(frameNb, captureTime, frame,
+                                       recorderSequence)
                 except OSError as e:
+                    self._decodeErrorsMetric.inc()
                     print("WARN: OSError while decoding JPEG. Skipping.")
                     print(e)
+                except Exception as e:
+                    # The same error on every frame is a bug rather than a
+                    # broken decoder, and takes the camera process down
+                    if self._decoderRestarts \
+                            >= self._supervisorPrefs["max_decoder_restarts"]:
+                        raise
+                    self._restart_decoder(e)
+                else:
+                    self._decoderRestarts = 0
+                    if self._decodeRecovery.recovering():
+                        self._decodeRecovery.recovered()
 
                 # self.num_frames_processed += 1
                 # if self.num_frames_processed % 10 == 0:
@@ -70,101 +232,347 @@ class ImageController:
                 pass
 
     def stop_capture_and_processing(self):
-        self._stopThread.set()
         if self._cameraThread is not None:
-            self._cameraThread.join()
+            self._stop_camera_thread()
+            self._account_mode_time()
+            print(f"Time per mode: {self._modeClock.summary()}")
+
 
+    def _start_camera_thread(self):
+        # Every thread gets its own stop event, so a thread stuck on a hung
+        # camera can be abandoned without being restarted by the next one
+        self._stopThread = threading.Event()
+        self._cameraError = None
+        self._captureHeartbeat.beat()
+        self._cameraThread = threading.Thread(
+                target=ImageController._camera_thread_loop,
+                args=[self, self._stopThread], daemon=True)
+        self._cameraThread.start()
 
-    def _camera_thread_loop(self):
+
+    def _stop_camera_thread(self):
+        self._stopThread.set()
+        self._cameraThread.join(CAMERA_THREAD_JOIN_TIMEOUT_S)
+        if self._cameraThread.is_alive():
+            print("WARN: The camera thread is stuck. Abandoning it.")
+        self._cameraThread = None
+
+
+    def _check_camera(self):
+        """
+        Restarts the camera if the camera thread stopped, or if no frames came
+        for capture_timeout_s, as when the camera is unplugged.
+        """
+        if self._cameraThread.is_alive():
+            frameAge = self._captureHeartbeat.age()
+            if frameAge < self._supervisorPrefs["capture_timeout_s"]:
+                return
+            reason = f"no frames for {frameAge:.1f}s"
+        else:
+            reason = self._cameraError or "the camera stream ended"
+        self._cameraRecovery.failed(reason)
+        self._restart_camera()
+
+
+    def _restart_camera(self):
+        """
+        Closes the camera and reopens it, retrying with a growing delay for as
+        long as it can't be opened and the power is on. The LED controller
+        keeps its state, and fades to black while no colors come.
+        """
+        self._stopThread.set()
+        # Also wakes a camera thread waiting for frames on some drivers
+        try:
+            self._cam.close()
+        except OSError:
+            pass
+        self._stop_camera_thread()
+
+        backoff = Backoff(self._supervisorPrefs["reopen_min_backoff_s"],
+                          self._supervisorPrefs["reopen_max_backoff_s"])
+        while self._ledInterface.update_and_get_power_state():
+            self.decodeHeartbeat.beat()
+            try:
+                self._open_camera()
+                break
+            except OSError as e:
+                delay = backoff.next_delay()
+                print(f"WARN: Could not reopen the camera: {e}. Retrying in "
+                      f"{delay:.1f}s.")
+                sleep(delay)
+
+        # The camera was reopened at the full frame rate
+        if self._idle:
+            self._set_idle(False)
+        self._start_camera_thread()
+
+
+    def _restart_decoder(self, error):
+        """
+        Recovers from an unexpected error while decoding or sampling a frame
+        with a new decoder, without restarting the camera.
+        """
+        traceback.print_exception(type(error), error, error.__traceback__)
+        self._decodeRecovery.failed(repr(error))
+        self._decoderRestarts += 1
+        self.jpegDecoder.close()
+        self.jpegDecoder = PooledTurboJPEG()
+
+
+    def _handle_frame(self, frameNb, captureTime, frame, recorderSequence=-1):
+        frameAge = monotonic() - captureTime
+        self._frameAgeMetric.observe(frameAge)
+        maxFrameAgeMs = self._capturePrefs["max_frame_age_ms"]
+        if maxFrameAgeMs > 0 and frameAge * 1000 > maxFrameAgeMs:
+            self._staleFramesMetric.inc()
+            return
+
+        if self._idle:
+            if not self._idle_frame_changed(frame):
+                return
+            # Content changed, so this very frame is processed in full
+            self._set_idle(False)
+
+        start = self._tracer.now()
+        startTime = perf_counter()
+        rgbFrame = self.jpegDecoder.decode(frame,
+                                        pixel_format=TJPF_RGB,
+                                        flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+        self._tracer.record(self._decodeEvent, start, frameNb)
+        decodedTime = perf_counter()
+        self._decodeTimeMetric.observe(decodedTime - startTime)
+
+        colors = self._process_one_frame(rgbFrame, frameNb, captureTime)
+        processedTime = perf_counter()
+        self._processTimeMetric.observe(processedTime - decodedTime)
+        self._processedFramesMetric.inc()
+        self._flightRecorder.finish_frame(recorderSequence, frameAge,
+                                          decodedTime - startTime,
+                                          processedTime - decodedTime, colors)
+
+        if self._idleMonitor is not None:
+            now = perf_counter()
+            self._idleMonitor.observe(colors, now)
+            if self._idleMonitor.quiet_time(now) \
+                    >= self._idlePrefs["idle_after_s"]:
+                self._set_idle(True)
+
+
+    def _idle_frame_changed(self, frame):
+        """
+        Samples a frame decoded at the idle scale and returns True if it
+        differs from the frames seen since idling started.
+        """
+        scaledFrame = self.jpegDecoder.decode(
+                frame, pixel_format=TJPF_RGB,
+                scaling_factor=tuple(self._idlePrefs["idle_decode_scale"]),
+                flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+        colors = self._idleSampler.sample(scaledFrame)
+        return self._idleMonitor.observe(colors, perf_counter())
+
+
+    def _set_idle(self, idle):
+        """
+        Switches between idle and active mode. While idle, the camera runs at
+        a lower frame rate (if it allows changing it while streaming), frames
+        are decoded at a lower scale and no colors are sent, so the LED
+        controller stops writing to the strips once its last transition is
+        done.
+        """
+        self._account_mode_time()
+        self._modeClock.mode = IDLE_MODE if idle else ACTIVE_MODE
+        self._idle = idle
+        # Idle colors are sampled at a different scale, so they can't be
+        # compared with the full scale colors
+        self._idleMonitor.reset()
+        self._set_camera_fps(self._idlePrefs["idle_fps"] if idle \
+                                else CAMERA_FPS)
+        print("Entering idle mode" if idle else "Leaving idle mode")
+
+
+    def _set_camera_fps(self, fps):
+        if not self._canSetFps:
+            return
+
+        try:
+            self._cam.set_fps(BufferType.VIDEO_CAPTURE, fps)
+        except OSError as e:
+            print("WARN: The camera can't change its frame rate while "
+                  "streaming. Idling at the full frame rate.")
+            print(e)
+            self._canSetFps = False
+
+
+    def _account_mode_time(self):
+        mode = self._modeClock.mode
+        wallTime, cpuTime = self._modeClock.update()
+        self._modeTimeMetrics[mode].inc(wallTime)
+        self._modeCpuMetrics[mode].inc(cpuTime)
+
+
+    def _camera_thread_loop(self, stopThread):
         """
         Immediately consumes the available camera frame. Makes the latest frame
         available to _frameQueue and drops any previously saved frames.
         """
-        for frame in self._cam:
-            if self._stopThread.is_set():
+        frames = self._camera_frames()
+        try:
+            self._read_camera_frames(frames, stopThread)
+        except Exception as e:
+            # Ex. the camera was unplugged. Left to _check_camera().
+            if not stopThread.is_set():
+                self._cameraError = repr(e)
+        # Stops the camera stream
+        try:
+            frames.close()
+        except Exception:
+            pass
+
+
+    def _read_camera_frames(self, frames, stopThread):
+        start = self._tracer.now()
+        for frame in frames:
+            self._tracer.record(self._captureEvent, start, frame.frame_nb)
+            if stopThread.is_set():
                 break
 
+            self._captureHeartbeat.beat()
+            self._cameraFramesMetric.inc()
+            start = self._tracer.now()
+            captureTime = self._capture_time(frame)
+            data = deepcopy(bytes(frame))
+            recorderSequence = self._flightRecorder.add_frame(
+                    frame.frame_nb, captureTime, data)
             try:
                 self._frameQueue.get_nowait()
+                self._droppedFramesMetric.inc()
             except queue.Empty:
                 pass
-            self._frameQueue.put(deepcopy(bytes(frame)))
-
-
-    def _process_one_frame(self, frame):
-        frame = self._smooth_frame(frame)
-
-        topColors = frame[self._topIdx[0], self._topIdx[1]]
-        bottomColors = frame[self._bottomIdx[0], self._bottomIdx[1]]
-        leftColors = frame[self._leftIdx[0], self._leftIdx[1]]
-        rightColors = frame[self._rightIdx[0], self._rightIdx[1]]
-        colors = {
-            "top": topColors,
-            "bottom": bottomColors,
-            "left": leftColors,
-            "right": rightColors
-        }
-
-        self._ledInterface.set_colors(colors)
-
-
-    def _smooth_frame(self, frame):
-
-        for poi in self._topIdx.T:
-            rows = (poi[0] - BLUR_WINDOW_OFFSET, poi[0] + BLUR_WINDOW_OFFSET)
-            cols = (poi[1] - BLUR_WINDOW_OFFSET, poi[1] + BLUR_WINDOW_OFFSET)
-            frame[rows[0]:rows[1], cols[0]:cols[1]] = \
-                cv2.GaussianBlur(frame[rows[0]:rows[1], cols[0]:cols[1]],
-                                 (BLUR_WINDOW_SIZE, BLUR_WINDOW_SIZE), 3)
-
-        for poi in self._bottomIdx.T:
-            rows = (poi[0] - BLUR_WINDOW_OFFSET, poi[0] + BLUR_WINDOW_OFFSET)
-            cols = (poi[1] - BLUR_WINDOW_OFFSET, poi[1] + BLUR_WINDOW_OFFSET)
-            frame[rows[0]:rows[1], cols[0]:cols[1]] = \
-                cv2.GaussianBlur(frame[rows[0]:rows[1], cols[0]:cols[1]],
-                                 (BLUR_WINDOW_SIZE, BLUR_WINDOW_SIZE), 3)
-
-        for poi in self._leftIdx.T:
-            rows = (poi[0] - BLUR_WINDOW_OFFSET, poi[0] + BLUR_WINDOW_OFFSET)
-            cols = (poi[1] - BLUR_WINDOW_OFFSET, poi[1] + BLUR_WINDOW_OFFSET)
-            frame[rows[0]:rows[1], cols[0]:cols[1]] = \
-                cv2.GaussianBlur(frame[rows[0]:rows[1], cols[0]:cols[1]],
-                                 (BLUR_WINDOW_SIZE, BLUR_WINDOW_SIZE), 3)
-
-        for poi in self._rightIdx.T:
-            rows = (poi[0] - BLUR_WINDOW_OFFSET, poi[0] + BLUR_WINDOW_OFFSET)
-            cols = (poi[1] - BLUR_WINDOW_OFFSET, poi[1] + BLUR_WINDOW_OFFSET)
-            frame[rows[0]:rows[1], cols[0]:cols[1]] = \
-                cv2.GaussianBlur(frame[rows[0]:rows[1], cols[0]:cols[1]],
-                                 (BLUR_WINDOW_SIZE, BLUR_WINDOW_SIZE), 3)
+            self._frameQueue.put((frame.frame_nb, captureTime, data,
+                                  recorderSequence))
+            self._tracer.record(self._enqueueEvent, start, frame.frame_nb)
+            start = self._tracer.now()
 
-        return frame
 
+    def _camera_frames(self):
+        if isinstance(self._cam, RecordedCamera):
+            yield from self._cam
+            return
 
-    def _setup_sample_points(self):
-        controlPoints = user_pref.read_calibration_data()
-        pointCounts = user_pref.read_led_counts()
+        with VideoCapture(self._cam,
+                          size=self._capturePrefs["buffer_count"]) as stream:
+            for frame in stream:
+                if self._capturePrefs["drain_to_newest"]:
+                    frame = self._drain_to_newest(stream, frame)
+                yield frame
 
-        sampledPoints = get_led_sample_points(controlPoints, pointCounts)
-        topPoints = sampledPoints["top"]
-        self._topIdx = [[v[1], v[0]] for v in topPoints]
-        self._topIdx = np.transpose(self._topIdx)
 
-        bottomPoints = sampledPoints["bottom"]
-        self._bottomIdx = [[v[1], v[0]] for v in bottomPoints]
-        self._bottomIdx = np.transpose(self._bottomIdx)
+    def _drain_to_newest(self, stream, frame):
+        """
+        Dequeues buffers for as long as more are ready and returns the newest
+        frame. The older ones are dropped without being copied.
+        """
+        while select.select((self._cam,), (), (), 0)[0]:
+            self._cameraFramesMetric.inc()
+            self._droppedFramesMetric.inc()
+            frame = stream.buffer.raw_read()
+        return frame
+
 
-        leftPoints = sampledPoints["left"]
-        self._leftIdx = [[v[1], v[0]] for v in leftPoints]
-        self._leftIdx = np.transpose(self._leftIdx)
+    def _capture_time(self, frame):
+        """
+        Returns when the frame was captured, on the monotonic() clock.
+        """
+        if self._useDriverTimestamps:
+            timestampType = frame.buff.flags & raw.V4L2_BUF_FLAG_TIMESTAMP_MASK
+            if timestampType == raw.V4L2_BUF_FLAG_TIMESTAMP_MONOTONIC:
+                return frame.timestamp
+            print("WARN: The camera driver doesn't timestamp frames with the "
+                  "monotonic clock. Measuring frame age from dequeue time.")
+            self._useDriverTimestamps = False
+        return monotonic()
+
+
+    def _process_one_frame(self, frame, frameNb=-1, captureTime=None):
+        start = self._tracer.now()
+        colors = self._sampler.sample(frame)
+        self._tracer.record(self._sampleEvent, start, frameNb)
+
+        start = self._tracer.now()
+        self._ledInterface.set_colors(colors, frameNb, captureTime)
+        self._tracer.record(self._setColorsEvent, start, frameNb)
+
+        if self._recorder is not None:
+            self._recorder.write(colors, monotonic())
+        return colors
+
+
+    def _setup_sample_points(self, recordFlights=True):
+        if self._display is None:
+            controlPoints = user_pref.read_calibration_data()
+            pointCounts = user_pref.read_led_counts()
+        else:
+            controlPoints = self._display["control_points"]
+            pointCounts = self._display["counts"]
+        if self._recordingPath is not None:
+            self._recorder = ColorRecorder(self._recordingPath, pointCounts)
+        self._flightRecorder = NullFlightRecorder()
+        if recordFlights:
+            self._flightRecorder = open_flight_recorder(
+                    "main" if self._display is None \
+                        else self._display["name"],
+                    pointCounts, self._resolution)
+        samplingPrefs = user_pref.read_pipeline_prefs("sampling",
+                                                      DEFAULT_SAMPLING_PREFS)
 
-        rightPoints = sampledPoints["right"]
-        self._rightIdx = [[v[1], v[0]] for v in rightPoints]
-        self._rightIdx = np.transpose(self._rightIdx)
+        sampledPoints = get_led_sample_points(controlPoints, pointCounts)
+        frameShape = (self._resolution[1], self._resolution[0])
+
+        # Only used to notice when the screen changes while idle
+        numerator, denominator = self._idlePrefs["idle_decode_scale"]
+        scale = numerator / denominator
+        self._idleSampler = RegionSampler(
+                {side: np.array(points) * scale \
+                    for side, points in sampledPoints.items()},
+                (-(-frameShape[0] * numerator // denominator),
+                 -(-frameShape[1] * numerator // denominator)),
+                insetDepth=max(1, round(samplingPrefs["inset_depth"] * scale)),
+                edgeOffset=round(samplingPrefs["edge_offset"] * scale))
+        if not samplingPrefs["letterbox"]:
+            self._sampler = RegionSampler(
+                    sampledPoints, frameShape,
+                    insetDepth=samplingPrefs["inset_depth"],
+                    edgeOffset=samplingPrefs["edge_offset"])
+            return
+
+        self._sampler = LetterboxSampler(
+                sampledPoints, frameShape,
+                insetDepth=samplingPrefs["inset_depth"],
+                edgeOffset=samplingPrefs["edge_offset"],
+                checkInterval=samplingPrefs["letterbox_check_interval"],
+                confirmChecks=samplingPrefs["letterbox_confirm_checks"],
+                blackThreshold=samplingPrefs["letterbox_black_threshold"],
+                maxBar=samplingPrefs["letterbox_max_bar"],
+                levels=samplingPrefs["letterbox_levels"])
 
 
     def _open_camera(self):
-        (cameraPath, resolution) = user_pref.read_device_prefs()
+        """
+        Opens the camera and returns the resolution it streams at.
+        """
+        if self._display is None:
+            (cameraPath, resolution) = user_pref.read_device_prefs()
+        else:
+            cameraPath = self._display["device"]
+            resolution = self._display["resolution"]
+
+        # A recorded MJPEG stream stands in for the camera
+        if path.isfile(cameraPath):
+            self._cam = RecordedCamera(cameraPath)
+            self._cam.open()
+            self._cam.set_fps(BufferType.VIDEO_CAPTURE, CAMERA_FPS)
+            return resolution
+
         self._cam = Device(cameraPath)
         self._cam.open()
         self._cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1], "MJPG")
@@ -176,7 +584,7 @@ class ImageController:
         # setting exposure_time_absolute value
         self._cam.open()
         self._cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1], "MJPG")
-        self._cam.set_fps(BufferType.VIDEO_CAPTURE, 30)
+        self._cam.set_fps(BufferType.VIDEO_CAPTURE, CAMERA_FPS)
         self._cam.controls.auto_exposure.value = 1
         self._cam.controls.white_balance_automatic.value = False
         self._cam.controls.brightness.value = -64
@@ -187,3 +595,4 @@ class ImageController:
         self._cam.controls.gain.value = 100
         self._cam.controls.white_balance_temperature.value = 4100
         self._cam.controls.exposure_time_absolute.value = 128
+        return resolution
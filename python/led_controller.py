@@ -1,84 +1,233 @@
-from adafruit_debouncer import Debouncer
+from color_correction import DEFAULT_COLOR_PREFS, read_color_corrector
+from color_predictor import ColorPredictor, DEFAULT_PREDICTION_PREFS
+from color_smoother import AdaptiveSmoother, DEFAULT_SMOOTHING_PREFS
+from color_snapshot import open_snapshot_writer
 from copy import deepcopy
 from math import pi, cos
-from matplotlib.colors import rgb_to_hsv, hsv_to_rgb
-from multiprocessing import Process, Queue, Value
-from neopixel import NeoPixel
-from pin_to_pin import AVAILABLE_PINS
-from time import sleep
-import digitalio
+from led_output import StripOutputs
+from metrics import MetricsRegistry, register_process_memory
+from multiprocessing import get_context
+from supervisor import Heartbeat, StageRecovery, DEFAULT_SUPERVISOR_PREFS
+from time import monotonic, perf_counter, sleep
 import numpy as np
+import os
+import process_signals
+import profiler
 import queue
+import tracer
 import user_pref
 
 COS_120_DEG = cos((pi / 180) * 120)
 LERP_PARAMETER = 0.5
 MAX_ITERATIONS_SINCE_FRAME = 10
 QUEUE_WAIT_TIMEOUT_S = 0.1
+COLORS_READ_POLL_S = 0.0002
+LED_PROCESS_JOIN_TIMEOUT_S = 1
+# The LED process starts from a clean interpreter that only imports
+# led_process, rather than a fork of the parent with OpenCV, SciPy and the
+# camera libraries loaded. "forkserver" also works, but keeps an extra
+# process around.
+LED_PROCESS_START_METHOD = "spawn"
+# Channels of (v, q, p, t) making up r, g, b in each hue sector
+HSV_SECTOR_CHANNELS = np.array([[0, 3, 2], [1, 0, 2], [2, 0, 3],
+                                [2, 1, 0], [3, 2, 0], [0, 2, 1]])
 
 class LEDController:
-    def __init__(self, shouldExit: Value, colorQueue: Queue, power: Value):
+    def __init__(self, shouldExit, colorQueue, power, ledConfig=None,
+                 metricsRegistry=None):
         self._colorQueue = colorQueue
         self._shouldExit = shouldExit
         self._power = power
+        # Overrides led.json, ex. to run the controller on virtual strips
+        self._ledConfig = ledConfig
+
+        # Registered here, in the parent process, and updated from run()
+        if metricsRegistry is None:
+            metricsRegistry = MetricsRegistry()
+        self.receivedColors = metricsRegistry.counter(
+                "backlight_led_colors_received",
+                "Sets of colors received by the LED controller")
+        self._ledFramesMetric = metricsRegistry.counter(
+                "backlight_led_frames",
+                "Frames written to the LED strips")
+        self._showTimeMetric = metricsRegistry.histogram(
+                "backlight_led_show_seconds",
+                "Time to color correct and write one frame to the strips")
+        self._startupTimeMetric = metricsRegistry.gauge(
+                "backlight_led_startup_seconds",
+                "Time from starting the LED process until it was ready")
+        self._latencyMetric = metricsRegistry.histogram(
+                "backlight_led_latency_seconds",
+                "Time from capturing a frame until its colors were written "
+                "to the strips")
+        self._sceneCutsMetric = metricsRegistry.counter(
+                "backlight_led_scene_cuts",
+                "Sets of colors shown right away as a scene cut")
+        # Beaten every iteration of run(), so LEDInterface can notice a hung
+        # LED process
+        self.heartbeat = Heartbeat()
+        # Set by LEDInterface right before the process is started
+        self.startTime = None
 
 
     def run(self):
         print("Starting LED Controller Process...")
+        profiler.start_if_enabled("led_controller")
+        self._setup(tracer.get_tracer("led_controller"))
+        # The profiler and tracer handlers are installed by now
+        process_signals.handlers_ready()
+
+        if self.startTime is not None:
+            startupTime = monotonic() - self.startTime
+            self._startupTimeMetric.set(startupTime)
+            print(f"LED Controller Process ready in {startupTime * 1000:.0f}ms")
+
+        # Also stops if the main process died without telling it to, rather
+        # than keeping the LEDs lit
+        parentPid = os.getppid()
+        try:
+            while self._shouldExit.value == 0 and os.getppid() == parentPid:
+                self.heartbeat.beat()
+                self._shutoff = not self._power.value
+                self._process_colors()
+        except KeyboardInterrupt:
+            # Ctrl-C reaches the whole process group, and the main process
+            # stops on it too
+            pass
+        finally:
+            self._teardown_leds()
+            profiler.stop()
+            self._tracer.write()
+
+
+    def _setup(self, ledTracer, publishColors=True):
+        """
+        Gets everything ready for the run() loop. The benchmarks also use it
+        to drive the controller without starting its process.
+        """
+        self._tracer = ledTracer
+        self._queueGetEvent = self._tracer.event("queue_get")
+        self._transitionEvent = self._tracer.event("transition")
+        self._showEvent = self._tracer.event("show")
+        self._frameNb = -1
         self._read_user_prefs()
-        self._setup_leds()
+        self._setup_leds(publishColors)
         self._isOff = False
         self._shutoff = False
         # Stored in HSV
         self._prevColors = {
-            "top": np.array([[0, 0, 0] for _ in range(0, len(self._ledIndices["top"]))]),
-            "bottom": np.array([[0, 0, 0] for _ in range(0, len(self._ledIndices["bottom"]))]),
-            "left": np.array([[0, 0, 0] for _ in range(0, len(self._ledIndices["left"]))]),
-            "right": np.array([[0, 0, 0] for _ in range(0, len(self._ledIndices["right"]))]),
+            side: np.array([[0, 0, 0] for _ in range(0, count)]) \
+                for side, count in self._sideCounts.items()
         }
         self._targetColors = deepcopy(self._prevColors)
+        # Sides shown at their new colors right away, without a transition
+        self._cutSides = set()
+        self._settled = False
         self._iterationsSinceFrame = MAX_ITERATIONS_SINCE_FRAME + 1
 
-        while self._shouldExit.value == 0:
-            self._shutoff = not self._power.value
-            self._process_colors()
 
-        self._teardown_leds()
+    def set_color_queue(self, colorQueue):
+        """
+        Replaces the queue colors are read from, before the process is
+        restarted.
+        """
+        self._colorQueue = colorQueue
 
 
     def _process_colors(self):
         try:
             # Don't block if we can iterate on the color
             shouldBlock = self._iterationsSinceFrame > MAX_ITERATIONS_SINCE_FRAME
-            imgColors = self._colorQueue.get(block=shouldBlock,
-                                             timeout=QUEUE_WAIT_TIMEOUT_S)
+            start = self._tracer.now()
+            frameNb, captureTime, imgColors = self._colorQueue.get(
+                    block=shouldBlock, timeout=QUEUE_WAIT_TIMEOUT_S)
+            self.receivedColors.inc()
+            # With several displays, each one sends the colors of its own
+            # sides without dropping any, so read everything queued and keep
+            # the newest colors of every side
+            imgColors = dict(imgColors)
+            captureTimes = dict.fromkeys(imgColors, captureTime)
+            while True:
+                try:
+                    frameNb, captureTime, moreColors = \
+                        self._colorQueue.get_nowait()
+                except queue.Empty:
+                    break
+                self.receivedColors.inc()
+                imgColors.update(moreColors)
+                captureTimes.update(dict.fromkeys(moreColors, captureTime))
+            self._frameNb = frameNb
+            self._tracer.record(self._queueGetEvent, start, frameNb)
 
             # Frame found, process new frame!
-            self._targetColors = {
-                side: rgb_to_hsv(np.divide(imgColor, 255)) \
-                    for side, imgColor in imgColors.items()
-            }
+            targetDistances = []
+            for side, imgColor in imgColors.items():
+                imgRgb = np.divide(imgColor, 255)
+                if self._predictors is not None \
+                        and self._predictors[side].update(imgRgb,
+                                                          captureTimes[side]):
+                    self._cutSides.add(side)
+                if self._smoothers is not None:
+                    targetDistances.append(self._smoothers[side].observe(
+                            imgRgb, captureTimes[side]))
+                self._targetColors[side] = _rgb_to_hsv(imgRgb)
+            # A cut changes the whole picture, so it is detected over every
+            # LED rather than per LED, which noise or motion can also move
+            if targetDistances and np.concatenate(targetDistances).mean() \
+                    > self._sceneCutThreshold:
+                self._cutSides.update(imgColors)
+            if self._cutSides:
+                self._sceneCutsMetric.inc()
             self._iterationsSinceFrame = 1
             self._transition_to_target_colors()
+            if not self._isOff:
+                self._latencyMetric.observe(
+                        monotonic() - max(captureTimes.values()))
 
         except queue.Empty:
             if (self._iterationsSinceFrame < MAX_ITERATIONS_SINCE_FRAME):
                 self._iterationsSinceFrame += 1
                 self._transition_to_target_colors()
 
+        if self._settled:
+            # Nothing left to transition until the next frame
+            self._iterationsSinceFrame = MAX_ITERATIONS_SINCE_FRAME + 1
+
         if self._shutoff and not self._isOff:
-            for ledIndices in self._ledIndices.values():
-                for ledIdx in ledIndices:
-                    self._leds[ledIdx] = [0, 0, 0]
-            self._leds.show()
+            self._leds.clear()
+            if self._colorSnapshot is not None:
+                self._colorSnapshot.publish(np.zeros_like(self._stripColors))
         self._isOff = self._shutoff
 
 
     def _transition_to_target_colors(self):
+        self._settled = False
         if self._isOff:
             return
 
+        start = self._tracer.now()
+        if self._predictors is not None:
+            # Show the colors the screen is expected to have by the time the
+            # LEDs light up, rather than when the frame was captured
+            showTime = monotonic() + self._outputLatencyS
+            for side, predictor in self._predictors.items():
+                if predictor.has_colors():
+                    self._targetColors[side] = \
+                        _rgb_to_hsv(predictor.predict(showTime))
+
+        if self._smoothers is not None:
+            self._smooth_to_target_colors()
+        else:
+            self._lerp_to_target_colors()
+        self._cutSides.clear()
+        self._tracer.record(self._transitionEvent, start, self._frameNb)
+
+        self._show_strip_colors()
+
+
+    def _lerp_to_target_colors(self):
         for side, imgHsv in self._targetColors.items():
+            lerpParameter = 1 if side in self._cutSides else LERP_PARAMETER
             prevHsv = self._prevColors[side]
             hueDiff = np.subtract(imgHsv[:, 0], prevHsv[:, 0])
             goingCCW = np.greater(hueDiff, 0.5)
@@ -87,87 +236,374 @@ class LEDController:
             prevHsv[:, 0] = np.where(goingCW, prevHsv[:, 0], prevHsv[:, 0] - 1)
 
             newHsv = np.add(
-                np.multiply(prevHsv, 1 - LERP_PARAMETER),
-                np.multiply(imgHsv, LERP_PARAMETER)
+                np.multiply(prevHsv, 1 - lerpParameter),
+                np.multiply(imgHsv, lerpParameter)
             )
             newHsv[:, 0] = np.mod(newHsv[:, 0], 1)
-            newRgb = np.rint(np.multiply(hsv_to_rgb(newHsv), 255)).astype(np.uint8)
+            newRgb = np.rint(np.multiply(_hsv_to_rgb(newHsv), 255)).astype(np.uint8)
             self._prevColors[side] = newHsv
+            self._stripColors[self._ledIndices[side]] = newRgb
 
-            for colorIdx, ledIdx in enumerate(self._ledIndices[side]):
-                self._leds[ledIdx] = newRgb[colorIdx]
 
-        self._leds.show()
+    def _smooth_to_target_colors(self):
+        now = monotonic()
+        settled = True
+        for side, imgHsv in self._targetColors.items():
+            newRgb, sideSettled = self._smoothers[side].step(
+                    _hsv_to_rgb(imgHsv), now, side in self._cutSides)
+            settled = settled and sideSettled
+            self._stripColors[self._ledIndices[side]] = \
+                np.rint(np.multiply(newRgb, 255)).astype(np.uint8)
+        self._settled = settled
+
+
+    def _show_strip_colors(self):
+        start = self._tracer.now()
+        startTime = perf_counter()
+        stripColors = self._stripColors
+        if self._colorCorrector is not None:
+            stripColors = self._colorCorrector.apply(stripColors)
+
+        self._leds.write(stripColors)
+        if self._colorSnapshot is not None:
+            # Before color correction, so it can be compared with the screen
+            self._colorSnapshot.publish(self._stripColors)
+        self._tracer.record(self._showEvent, start, self._frameNb)
+        self._showTimeMetric.observe(perf_counter() - startTime)
+        self._ledFramesMetric.inc()
 
 
     def _read_user_prefs(self):
-        ledConfig = user_pref.read_led_info()
-        self._controlPin = AVAILABLE_PINS[ledConfig["pin"]]
-        self._powerPin = AVAILABLE_PINS[ledConfig["power_pin"]]
-
-        order = ledConfig["order"]
+        ledConfig = self._ledConfig
+        if ledConfig is None:
+            ledConfig = user_pref.read_led_info()
         counts = ledConfig["counts"]
+        # Without "strips", the whole setup is a single strip described by
+        # the top level "pin", "order" and "orientation"
+        self._stripConfigs = ledConfig.get("strips", [ledConfig])
+
+        # A side may be shown by more than one strip, ex. a networked strip
+        # mirroring the local one, so every side maps to a list of index
+        # ranges
         ledIndices = {}
+        self._stripSizes = []
         totalLedsSeen = 0
-        for side in order:
-            sideCount = counts[side]
-            ledIndices[side] = list(range(totalLedsSeen,
-                                          totalLedsSeen + sideCount))
-            totalLedsSeen += sideCount
-
-        for side, naturalOrientation in ledConfig["orientation"].items():
-            if not naturalOrientation:
-                ledIndices[side] = ledIndices[side][::-1]
+        for stripConfig in self._stripConfigs:
+            stripStart = totalLedsSeen
+            for side in stripConfig["order"]:
+                sideCount = counts[side]
+                sideIndices = list(range(totalLedsSeen,
+                                         totalLedsSeen + sideCount))
+                if not stripConfig["orientation"][side]:
+                    sideIndices = sideIndices[::-1]
+                ledIndices.setdefault(side, []).append(sideIndices)
+                totalLedsSeen += sideCount
+            self._stripSizes.append(totalLedsSeen - stripStart)
+
+        unmappedSides = [side for side in counts if side not in ledIndices]
+        if unmappedSides:
+            print(f"ERROR: The sides {unmappedSides} counted in "
+                  f"{user_pref.LED_INFO_FILE} are not in the \"order\" of "
+                  "any strip.")
+            exit(1)
 
         self._numLeds = totalLedsSeen
-        self._ledIndices = ledIndices
+        self._sideCounts = counts
+        self._ledIndices = {side: np.array(indices) \
+                                for side, indices in ledIndices.items()}
+        self._stripColors = np.zeros((self._numLeds, 3), dtype=np.uint8)
+
+        colorPrefs = user_pref.read_pipeline_prefs("color", DEFAULT_COLOR_PREFS)
+        self._brightness = colorPrefs["brightness"]
+        self._colorCorrector = read_color_corrector()
+
+        predictionPrefs = user_pref.read_pipeline_prefs(
+                "prediction", DEFAULT_PREDICTION_PREFS)
+        self._predictors = None
+        if predictionPrefs["enabled"]:
+            self._predictors = {
+                side: ColorPredictor(predictionPrefs["alpha"],
+                                     predictionPrefs["beta"],
+                                     predictionPrefs["scene_cut_threshold"],
+                                     predictionPrefs["max_lead_ms"] / 1000) \
+                    for side in counts
+            }
+        self._outputLatencyS = predictionPrefs["output_latency_ms"] / 1000
+
+        smoothingPrefs = user_pref.read_pipeline_prefs(
+                "smoothing", DEFAULT_SMOOTHING_PREFS)
+        self._smoothers = None
+        if smoothingPrefs["mode"] == "adaptive":
+            self._smoothers = {
+                side: AdaptiveSmoother(smoothingPrefs["min_cutoff_hz"],
+                                       smoothingPrefs["speed_coefficient"],
+                                       smoothingPrefs["derivative_cutoff_hz"],
+                                       smoothingPrefs["converged_threshold"]) \
+                    for side in counts
+            }
+        elif smoothingPrefs["mode"] != "lerp":
+            print(f"ERROR: Unknown smoothing mode: {smoothingPrefs['mode']}. "
+                  "Use \"lerp\" or \"adaptive\".")
+            exit(1)
+        self._sceneCutThreshold = smoothingPrefs["scene_cut_threshold"]
 
 
-    def _setup_leds(self):
-        self._leds = NeoPixel(self._controlPin, self._numLeds, auto_write=False, brightness=0.5)
+    def _setup_leds(self, publishColors=True):
+        self._leds = StripOutputs(self._stripConfigs, self._stripSizes,
+                                  self._brightness)
+        self._colorSnapshot = None
+        if publishColors:
+            # Mirrored sides are published once
+            self._colorSnapshot = open_snapshot_writer({
+                side: indices[0] for side, indices in self._ledIndices.items()
+            })
 
 
     def _teardown_leds(self):
-        self._leds.deinit()
+        self._leds.close()
+        if self._colorSnapshot is not None:
+            self._colorSnapshot.close()
 
 
 class LEDInterface():
-    def __init__(self):
-        self._shouldExit = Value('b', 0, lock=False)
-        self._power = Value('b', 0, lock=False)
-        self._colorQueue = Queue()
-
-        self._ledController = LEDController(self._shouldExit, self._colorQueue, self._power)
+    def __init__(self, ledConfig=None, metricsRegistry=None):
+        self._context = get_context(LED_PROCESS_START_METHOD)
+        if LED_PROCESS_START_METHOD == "forkserver":
+            self._context.set_forkserver_preload(["led_process"])
+        self._shouldExit = self._context.Value('b', 0, lock=False)
+        self._power = self._context.Value('b', 0, lock=False)
+        self._colorQueue = self._context.Queue()
+        self._ledConfig = ledConfig
+
+        if metricsRegistry is None:
+            metricsRegistry = MetricsRegistry()
+        self._metricsRegistry = metricsRegistry
+        self._powerMetric = metricsRegistry.gauge(
+                "backlight_power", "1 if the backlight is turned on")
+        self._droppedColorsMetric = metricsRegistry.counter(
+                "backlight_led_colors_dropped",
+                "Sets of colors replaced before the LED controller read them")
+        # The queue is replaced when the LED process is restarted
+        metricsRegistry.gauge("backlight_color_queue_depth",
+                              "Sets of colors waiting for the LED controller",
+                              callback=lambda: self._colorQueue.qsize())
+        self._ledRecovery = StageRecovery(metricsRegistry, "led_controller")
+        self._supervisorPrefs = user_pref.read_pipeline_prefs(
+                "supervisor", DEFAULT_SUPERVISOR_PREFS)
+        # Times the LED process was restarted. Camera workers hold the color
+        # queue of the previous process, so they must be restarted too.
+        self.restarts = 0
+
+        self._sentColors = 0
+
+        self._ledController = LEDController(self._shouldExit, self._colorQueue,
+                                            self._power, ledConfig,
+                                            metricsRegistry)
 
     def __enter__(self):
         self._setup_power_pin()
-        self._ledControllerProcess = Process(target=LEDController.run,
-                                             args=[self._ledController])
-        self._ledControllerProcess.start()
-
+        self._start_led_process()
+        register_process_memory(self._metricsRegistry, "led_controller",
+                                lambda: self._ledControllerProcess.pid)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._power.value = False
         self._shouldExit.value = True
         self._ledControllerProcess.join()
+        # Colors the LED controller didn't read don't matter anymore, so
+        # don't wait at exit for them to be flushed into the pipe
+        self._colorQueue.cancel_join_thread()
         self._colorQueue.close()
 
-    def set_colors(self, colors):
+    def set_colors(self, colors, frameNb=-1, captureTime=None):
+        """
+        Sends the colors sampled from a frame captured at captureTime, on the
+        monotonic() clock, or now if not given.
+        """
         try:
             self._colorQueue.get_nowait()
+            self._droppedColorsMetric.inc()
         except queue.Empty:
             pass
 
-        self._colorQueue.put(colors)
+        if captureTime is None:
+            captureTime = monotonic()
+        self._colorQueue.put((frameNb, captureTime, colors))
+        self._sentColors += 1
+
+
+    def wait_until_colors_read(self, timeoutS=1):
+        """
+        Waits until the LED controller has read (or set_colors has dropped)
+        every set of colors sent so far.
+        """
+        deadline = perf_counter() + timeoutS
+        while self._ledController.receivedColors.value() \
+                + self._droppedColorsMetric.value() < self._sentColors \
+                and perf_counter() < deadline:
+            sleep(COLORS_READ_POLL_S)
+
+
+    def display_colors(self, displayName, stop):
+        """
+        Returns what the camera worker process of one display sends its
+        colors through. Setting the shared value stop turns the worker's
+        power off for good.
+        """
+        return DisplayColors(displayName, self._colorQueue, self._power, stop)
 
 
     def _setup_power_pin(self):
-        ledConfig = user_pref.read_led_info();
+        ledConfig = self._ledConfig
+        if ledConfig is None:
+            ledConfig = user_pref.read_led_info()
+
+        # Without a power pin, the LEDs are always on
+        if ledConfig.get("power_pin") is None:
+            self._powerPin = None
+            return
+
+        import digitalio
+        from pin_to_pin import AVAILABLE_PINS
         self._powerPin = AVAILABLE_PINS[ledConfig["power_pin"]]
         self._powerPin = digitalio.DigitalInOut(self._powerPin)
         self._powerPin.direction = digitalio.Direction.INPUT
 
+    def _start_led_process(self):
+        # Imported here so the LED process doesn't import it when loading
+        # this module
+        import led_process
+
+        self._ledController.startTime = monotonic()
+        self._ledControllerProcess = self._context.Process(
+                target=led_process.run, args=[self._ledController],
+                name="led_controller")
+        process_signals.start_process(self._ledControllerProcess)
+
+
+    def _check_led_process(self):
+        """
+        Restarts the LED process if it died or stopped beating its heartbeat
+        for led_timeout_s.
+        """
+        process = self._ledControllerProcess
+        startTime = self._ledController.startTime
+        heartbeatTime = self._ledController.heartbeat.time()
+        if self._ledRecovery.recovering() and heartbeatTime > startTime:
+            self._ledRecovery.recovered(heartbeatTime)
+
+        # The new process gets the timeout to start up too
+        silentS = monotonic() - max(heartbeatTime, startTime)
+        if not process.is_alive():
+            reason = f"the process exited with code {process.exitcode}"
+        elif silentS > self._supervisorPrefs["led_timeout_s"]:
+            reason = f"no heartbeat for {silentS:.1f}s"
+        else:
+            return
+        self._ledRecovery.failed(reason)
+        self.restart_led_process()
+
+
+    def restart_led_process(self):
+        """
+        Restarts the LED process with a new color queue. Whoever sends colors
+        through display_colors() must be restarted with the new queue, which
+        self.restarts tells.
+        """
+        process = self._ledControllerProcess
+        process.terminate()
+        process.join(LED_PROCESS_JOIN_TIMEOUT_S)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+        # A process killed while reading the queue may still hold its lock,
+        # so the new process gets a new queue
+        self._colorQueue.cancel_join_thread()
+        self._colorQueue.close()
+        self._colorQueue = self._context.Queue()
+        self._ledController.set_color_queue(self._colorQueue)
+        self._start_led_process()
+        self.restarts += 1
+
+
+    def update_and_get_power_state(self):
+        self._check_led_process()
+        power = True if self._powerPin is None else self._powerPin.value
+        self._power.value = power
+        self._powerMetric.set(power)
+        return power
+
+
+class DisplayColors:
+    """
+    Stands in for LEDInterface in the camera worker process of one display.
+    Sides are sent as "<display>.<side>", like they are named in led.json.
+    Unlike LEDInterface.set_colors, colors already queued are never dropped,
+    since they may belong to another display. The LED controller reads
+    everything queued at once instead.
+    """
+    def __init__(self, displayName, colorQueue, power, stop):
+        self._displayName = displayName
+        self._colorQueue = colorQueue
+        self._power = power
+        self._stop = stop
+
+
+    def set_colors(self, colors, frameNb=-1, captureTime=None):
+        if captureTime is None:
+            captureTime = monotonic()
+        self._colorQueue.put((frameNb, captureTime, {
+            f"{self._displayName}.{side}": sideColors \
+                for side, sideColors in colors.items()
+        }))
+
+
     def update_and_get_power_state(self):
-        self._power.value = self._powerPin.value
-        return self._powerPin.value
+        # The power pin is read by the main process
+        return bool(self._power.value) and not self._stop.value
+
+
+    def should_stop(self):
+        return bool(self._stop.value)
+
+
+    def close(self):
+        # Like LEDInterface, don't wait for unread colors at exit
+        self._colorQueue.cancel_join_thread()
+
+
+def _rgb_to_hsv(rgb):
+    """
+    Converts an (N, 3) array of RGB colors in [0, 1] to HSV in [0, 1].
+    """
+    maxChannel = rgb.max(axis=1)
+    delta = maxChannel - rgb.min(axis=1)
+    safeMax = np.where(maxChannel > 0, maxChannel, 1)
+    safeDelta = np.where(delta > 0, delta, 1)
+
+    red, green, blue = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    hue = np.where(red == maxChannel, (green - blue) / safeDelta, 0)
+    hue = np.where(green == maxChannel, 2 + (blue - red) / safeDelta, hue)
+    hue = np.where(blue == maxChannel, 4 + (red - green) / safeDelta, hue)
+    hue = np.where(delta > 0, np.mod(hue / 6, 1), 0)
+
+    return np.stack([hue, delta / safeMax, maxChannel], axis=1)
+
+
+def _hsv_to_rgb(hsv):
+    """
+    Converts an (N, 3) array of HSV colors in [0, 1] to RGB in [0, 1].
+    """
+    hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+    sector = np.floor(hue * 6)
+    fraction = hue * 6 - sector
+    p = value * (1 - saturation)
+    q = value * (1 - saturation * fraction)
+    t = value * (1 - saturation * (1 - fraction))
+
+    channels = np.stack([value, q, p, t])
+    sector = sector.astype(np.int32) % 6
+    return channels[HSV_SECTOR_CHANNELS[sector],
+                    np.arange(len(hsv))[:, np.newaxis]]
@@ -0,0 +1,180 @@
+from turbojpeg import TJFLAG_FASTUPSAMPLE, TJFLAG_FASTDCT, TJPF_GRAY
+from scipy.interpolate import CubicSpline
+import cv2
+import numpy as np
+
+DISCOVERY_COLOR = (64, 64, 64)
+DISCOVERY_SCALING_FACTOR = (1, 2)
+DISCOVERY_SETTLE_FRAMES = 3
+DISCOVERY_SAMPLES_PER_SIDE = 64
+DISCOVERY_EDGE_OFFSET_PX = 20
+DISCOVERY_BLUR_SIZE = 9
+MIN_PATTERN_CONTRAST = 12
+SIDE_CORNER_MARGIN = 0.15
+
+def build_gray_code_patterns(numLeds):
+    """
+    Returns a (numBits, numLeds) boolean array where column i holds the Gray
+    code of LED i, MSB first. Codes start at 1 so an unlit part of the frame
+    (code 0) never decodes to a valid LED.
+    """
+    numBits = max(1, int(numLeds).bit_length())
+    codes = np.arange(1, numLeds + 1)
+    gray = codes ^ (codes >> 1)
+    shifts = np.arange(numBits - 1, -1, -1)
+    return ((gray[np.newaxis, :] >> shifts[:, np.newaxis]) & 1).astype(bool)
+
+
+def capture_pattern_frames(strip, cam, jpegDecoder, numLeds):
+    """
+    Shows every pattern on the strip and grabs one grayscale frame of each.
+    Returns (offFrame, onFrame, patternFrames).
+    """
+    patterns = build_gray_code_patterns(numLeds)
+    allOff = np.zeros(numLeds, dtype=bool)
+    allOn = np.ones(numLeds, dtype=bool)
+
+    frames = iter(cam)
+    try:
+        captured = [_show_and_capture(strip, frames, jpegDecoder, pattern) \
+                        for pattern in [allOff, allOn, *patterns]]
+    finally:
+        frames.close()
+        strip.fill((0, 0, 0))
+        strip.show()
+
+    return (captured[0], captured[1], np.stack(captured[2:]))
+
+
+def discovery_sample_points(controlPoints, scale=1.0):
+    """
+    Returns evenly spaced points just outside each calibrated screen edge,
+    where the glow of the LEDs behind the screen is visible. Points are
+    (x, y), ordered left to right for top/bottom and top to bottom for
+    left/right.
+    """
+    samplePoints = {}
+    for side in ["top", "bottom"]:
+        xs = [v[0] for v in controlPoints[side]]
+        ys = [v[1] for v in controlPoints[side]]
+        spline = CubicSpline(xs, ys)
+        sampleXs = np.linspace(xs[0], xs[-1], DISCOVERY_SAMPLES_PER_SIDE)
+        samplePoints[side] = np.stack([sampleXs, spline(sampleXs)], axis=1)
+    for side in ["left", "right"]:
+        xs = [v[0] for v in controlPoints[side]]
+        ys = [v[1] for v in controlPoints[side]]
+        spline = CubicSpline(ys, xs)
+        sampleYs = np.linspace(ys[0], ys[-1], DISCOVERY_SAMPLES_PER_SIDE)
+        samplePoints[side] = np.stack([spline(sampleYs), sampleYs], axis=1)
+
+    offsets = {
+        "top": (0, -DISCOVERY_EDGE_OFFSET_PX),
+        "bottom": (0, DISCOVERY_EDGE_OFFSET_PX),
+        "left": (-DISCOVERY_EDGE_OFFSET_PX, 0),
+        "right": (DISCOVERY_EDGE_OFFSET_PX, 0),
+    }
+    return {
+        side: np.rint((points + offsets[side]) * scale).astype(np.int32) \
+            for side, points in samplePoints.items()
+    }
+
+
+def decode_led_indices(offFrame, onFrame, patternFrames, samplePoints):
+    """
+    Decodes the LED index visible at every sample point. Returns a dict of
+    side -> int array with the LED index at each point, or -1 where no LED
+    could be decoded.
+    """
+    decoded = {}
+    for side, points in samplePoints.items():
+        height, width = offFrame.shape[:2]
+        xs = np.clip(points[:, 0], 0, width - 1)
+        ys = np.clip(points[:, 1], 0, height - 1)
+        off = offFrame[ys, xs].astype(np.int16)
+        on = onFrame[ys, xs].astype(np.int16)
+        values = patternFrames[:, ys, xs].astype(np.int16)
+
+        bits = (2 * (values - off)) > (on - off)
+        # Gray to binary: every binary bit is the XOR of all gray bits above it
+        binary = np.bitwise_xor.accumulate(bits, axis=0)
+        weights = 1 << np.arange(len(bits) - 1, -1, -1)
+        codes = np.sum(binary * weights[:, np.newaxis], axis=0)
+
+        valid = ((on - off) >= MIN_PATTERN_CONTRAST) & (codes > 0)
+        decoded[side] = np.where(valid, codes - 1, -1)
+
+    return decoded
+
+
+def infer_led_layout(decodedIndices, numLeds):
+    """
+    Turns decoded LED indices along each side into the "order", "orientation"
+    and "counts" entries of led.json. Returns None if a side could not be
+    decoded.
+    """
+    sideRanges = {}
+    orientation = {}
+    for side, indices in decodedIndices.items():
+        # Glow from the neighbouring sides bleeds into the corners, so only
+        # the middle of each side is trusted. LEDs are evenly spaced, so a
+        # line through the middle extrapolates to the first and last LED.
+        numPoints = len(indices)
+        margin = int(numPoints * SIDE_CORNER_MARGIN)
+        positions = np.arange(margin, numPoints - margin)
+        values = indices[margin:numPoints - margin]
+        valid = (values >= 0) & (values < numLeds)
+        if np.count_nonzero(valid) < 2:
+            print(f"ERROR: Could not find the LEDs on the {side} edge.")
+            return None
+
+        slope, intercept = np.polyfit(positions[valid], values[valid], 1)
+        ends = np.sort([intercept, intercept + slope * (numPoints - 1)])
+        # left to right for top/bottom and top to bottom for left/right
+        orientation[side] = bool(slope > 0)
+        sideRanges[side] = (ends[0], ends[1])
+
+    order = sorted(sideRanges.keys(), key=lambda s: sum(sideRanges[s]))
+
+    starts = [0]
+    for prevSide, side in zip(order[:-1], order[1:]):
+        boundary = (sideRanges[prevSide][1] + sideRanges[side][0] + 1) / 2
+        starts.append(int(round(boundary)))
+    starts.append(numLeds)
+
+    counts = {side: starts[idx + 1] - starts[idx] \
+                for idx, side in enumerate(order)}
+    if any(count < 2 for count in counts.values()):
+        print("ERROR: Decoded LED ranges overlap. Please set up the LEDs "
+              "manually.")
+        return None
+
+    return {
+        "order": order,
+        "orientation": orientation,
+        "counts": counts,
+    }
+
+
+def discover_led_layout(strip, cam, jpegDecoder, numLeds, controlPoints):
+    (offFrame, onFrame, patternFrames) = \
+        capture_pattern_frames(strip, cam, jpegDecoder, numLeds)
+    scale = DISCOVERY_SCALING_FACTOR[0] / DISCOVERY_SCALING_FACTOR[1]
+    samplePoints = discovery_sample_points(controlPoints, scale)
+    decoded = decode_led_indices(offFrame, onFrame, patternFrames,
+                                 samplePoints)
+    return infer_led_layout(decoded, numLeds)
+
+
+def _show_and_capture(strip, frames, jpegDecoder, pattern):
+    strip[:] = [DISCOVERY_COLOR if lit else (0, 0, 0) for lit in pattern]
+    strip.show()
+
+    # Let the strip latch and flush frames exposed before the pattern changed
+    for _ in range(DISCOVERY_SETTLE_FRAMES):
+        next(frames)
+
+    frame = jpegDecoder.decode(bytes(next(frames)), pixel_format=TJPF_GRAY,
+                               scaling_factor=DISCOVERY_SCALING_FACTOR,
+                               flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+    frame = frame.reshape(frame.shape[0], frame.shape[1])
+    return cv2.blur(frame, (DISCOVERY_BLUR_SIZE, DISCOVERY_BLUR_SIZE))
@@ -0,0 +1,233 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+import importlib
+import numpy as np
+import sys
+
+WS2812_LED_TIME_US = 30
+DEFAULT_VIRTUAL_HISTORY = 256
+
+class LEDOutput(ABC):
+    """
+    Interface implemented by every LED output backend. Backends are created
+    with the strip's entry from led.json, the number of LEDs on the strip and
+    the global brightness, and receive colors as an (N, 3) uint8 array. A
+    backend without write() can't be created.
+    """
+    # Whether writes to this strip can overlap with writes to the other
+    # strips, on their own thread
+    concurrent = True
+
+    def __init__(self, stripConfig, numLeds, brightness):
+        self._numLeds = numLeds
+
+
+    @abstractmethod
+    def write(self, colors):
+        pass
+
+
+    def clear(self):
+        self.write(np.zeros((self._numLeds, 3), dtype=np.uint8))
+
+
+    def close(self):
+        pass
+
+
+class NeoPixelOutput(LEDOutput):
+    # Blinka drives every GPIO strip through one global ws2811 instance,
+    # which it reinitializes whenever another strip is written, so strips
+    # must be written one after another
+    concurrent = False
+
+    def __init__(self, stripConfig, numLeds, brightness):
+        super().__init__(stripConfig, numLeds, brightness)
+        # Only import the hardware libraries when a real strip is used, so
+        # everything else can run on machines without GPIO pins.
+        from neopixel import NeoPixel
+        from pin_to_pin import AVAILABLE_PINS
+
+        pin = AVAILABLE_PINS[stripConfig["pin"]]
+        self._leds = NeoPixel(pin, numLeds, auto_write=False,
+                              brightness=brightness)
+
+
+    def write(self, colors):
+        self._leds[:] = colors.tolist()
+        self._leds.show()
+
+
+    def clear(self):
+        self._leds.fill((0, 0, 0))
+        self._leds.show()
+
+
+    def close(self):
+        self._leds.deinit()
+
+
+class VirtualOutput(LEDOutput):
+    """
+    Stands in for a strip without any hardware. The last "history" frames are
+    recorded with their timestamps in a preallocated ring buffer. If
+    "led_time_us" is set (ex. 30 for WS2812), every write sleeps for as long
+    as the data would take on the wire; otherwise writes run at full speed.
+    If "save_path" is set, the recorded frames are saved there on close(), so
+    the frames of the LED process can be checked from another process.
+    """
+    def __init__(self, stripConfig, numLeds, brightness):
+        super().__init__(stripConfig, numLeds, brightness)
+        self._writeTimeS = numLeds * stripConfig.get("led_time_us", 0) * 1e-6
+        self._savePath = stripConfig.get("save_path")
+        history = stripConfig.get("history", DEFAULT_VIRTUAL_HISTORY)
+        self._frames = np.zeros((history, numLeds, 3), dtype=np.uint8)
+        self._timestamps = np.zeros(history, dtype=np.float64)
+        self.frameCount = 0
+
+
+    def write(self, colors):
+        idx = self.frameCount % len(self._frames)
+        self._frames[idx] = colors
+        self._timestamps[idx] = perf_counter()
+        self.frameCount += 1
+        if self._writeTimeS > 0:
+            sleep(self._writeTimeS)
+
+
+    def recent_frames(self, numFrames=None):
+        """
+        Returns (frames, timestamps) of up to numFrames most recent frames,
+        oldest first.
+        """
+        available = min(self.frameCount, len(self._frames))
+        numFrames = available if numFrames is None \
+            else min(numFrames, available)
+        idx = np.arange(self.frameCount - numFrames, self.frameCount) \
+            % len(self._frames)
+        return (self._frames[idx], self._timestamps[idx])
+
+
+    def refresh_rate(self):
+        """
+        Returns the average refresh rate over the recorded frames, in Hz.
+        """
+        _, timestamps = self.recent_frames()
+        if len(timestamps) < 2 or timestamps[-1] == timestamps[0]:
+            return 0
+        return (len(timestamps) - 1) / (timestamps[-1] - timestamps[0])
+
+
+    def close(self):
+        if self._savePath is not None:
+            frames, timestamps = self.recent_frames()
+            np.savez(self._savePath, frames=frames, timestamps=timestamps)
+
+
+# Backends are imported only when a strip uses them
+OUTPUT_TYPES = {
+    "neopixel": "led_output.NeoPixelOutput",
+    "virtual": "led_output.VirtualOutput",
+    "ddp": "network_output.DDPOutput",
+    "e131": "network_output.E131Output",
+}
+
+def get_output_class(outputType):
+    if outputType not in OUTPUT_TYPES:
+        print(f"ERROR: Unknown LED output type '{outputType}'. "
+              f"Valid types are {list(OUTPUT_TYPES.keys())}.")
+        exit(1)
+
+    moduleName, className = OUTPUT_TYPES[outputType].rsplit(".", 1)
+    return getattr(importlib.import_module(moduleName), className)
+
+
+class StripOutputs:
+    """
+    Drives every configured strip from one array holding the colors of all
+    LEDs. Each strip owns a contiguous slice of that array. With more than
+    one strip, strips whose backend allows it (network and virtual strips)
+    are written concurrently on their own threads, while the others are
+    written one after another on the calling thread.
+    """
+    def __init__(self, stripConfigs, stripSizes, brightness):
+        self._outputs = []
+        offset = 0
+        for stripConfig, numLeds in zip(stripConfigs, stripSizes):
+            outputClass = get_output_class(stripConfig.get("type",
+                                                           "neopixel"))
+            output = outputClass(stripConfig, numLeds, brightness)
+            self._outputs.append((output, slice(offset, offset + numLeds)))
+            offset += numLeds
+        self.outputs = [output for output, _ in self._outputs]
+        self._concurrentOutputs = [(output, ledSlice) \
+            for output, ledSlice in self._outputs if output.concurrent]
+        self._serialOutputs = [(output, ledSlice) \
+            for output, ledSlice in self._outputs if not output.concurrent]
+
+        self._executor = None
+        if len(self._outputs) > 1 and len(self._concurrentOutputs) > 0:
+            self._executor = ThreadPoolExecutor(
+                    max_workers=len(self._concurrentOutputs),
+                    thread_name_prefix="led_output")
+
+
+    def write(self, colors):
+        if self._executor is None:
+            for output, ledSlice in self._outputs:
+                output.write(colors[ledSlice])
+            return
+
+        futures = [self._executor.submit(output.write, colors[ledSlice]) \
+                    for output, ledSlice in self._concurrentOutputs]
+        for output, ledSlice in self._serialOutputs:
+            output.write(colors[ledSlice])
+        for future in futures:
+            future.result()
+
+
+    def clear(self):
+        for output, _ in self._outputs:
+            output.clear()
+
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        for output, _ in self._outputs:
+            output.close()
+
+
+def measure_frame_time(stripSizes, numFrames=100,
+                       ledTimeUs=WS2812_LED_TIME_US):
+    """
+    Returns the average time to write one frame to virtual strips of the
+    given sizes, emulating WS2812 wire timing.
+    """
+    stripConfigs = [{"type": "virtual", "led_time_us": ledTimeUs} \
+                        for _ in stripSizes]
+    outputs = StripOutputs(stripConfigs, stripSizes, 1.0)
+    colors = np.zeros((sum(stripSizes), 3), dtype=np.uint8)
+    try:
+        startTime = perf_counter()
+        for _ in range(numFrames):
+            outputs.write(colors)
+        return (perf_counter() - startTime) / numFrames
+    finally:
+        outputs.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} <leds on strip 1> [<leds on strip 2> ...]")
+        exit(1)
+
+    stripSizes = [int(arg) for arg in sys.argv[1:]]
+    serialTime = measure_frame_time([sum(stripSizes)])
+    parallelTime = measure_frame_time(stripSizes)
+    print(f"One strip of {sum(stripSizes)} LEDs: "
+          f"{serialTime * 1000:.2f} ms/frame ({1 / serialTime:.1f} fps)")
+    print(f"{len(stripSizes)} parallel strips {stripSizes}: "
+          f"{parallelTime * 1000:.2f} ms/frame ({1 / parallelTime:.1f} fps)")
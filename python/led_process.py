@@ -0,0 +1,14 @@
+import led_controller
+
+def run(ledController: led_controller.LEDController):
+    """
+    Entry point of the LED controller process.
+
+    The process is started in a fresh interpreter (see
+    LED_PROCESS_START_METHOD) that only imports this module and the main
+    script, so it only loads what driving the LEDs needs: NumPy and the LED
+    output backends. Keep this module, everything led_controller imports at
+    the top level and the top level of main.py free of the camera and image
+    processing libraries.
+    """
+    ledController.run()
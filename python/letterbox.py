@@ -0,0 +1,217 @@
+from region_sampler import RegionSampler, DEFAULT_INSET_DEPTH_PX, \
+    DEFAULT_EDGE_OFFSET_PX
+import numpy as np
+
+DEFAULT_CHECK_INTERVAL = 10
+DEFAULT_CONFIRM_CHECKS = 3
+DEFAULT_BLACK_THRESHOLD = 24
+DEFAULT_MAX_BAR = 0.25
+DEFAULT_BAR_LEVELS = 16
+NUM_SCAN_LINES = 8
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+class LetterboxSampler:
+    """
+    Drop-in replacement for RegionSampler that follows black bars.
+
+    Every checkInterval frames, a few scan lines crossing each edge of the
+    screen are checked for the first bright pixel, which gives the size of
+    the bars in steps of maxBar / levels of the screen size. Once the same
+    size has been seen confirmChecks times in a row, sampling moves to the
+    edge of the active picture: the top and bottom LEDs sample its top and
+    bottom edge, and the left and right LEDs are spread over its height (and
+    the other way around for pillarboxing).
+
+    A RegionSampler is precomputed for every letterbox and pillarbox size, so
+    switching only swaps the sampler and frames in between cost the same as
+    with a plain RegionSampler. Samplers for bars on all four sides are
+    built the first time they are needed.
+    """
+    def __init__(self, samplePoints, frameShape,
+                 insetDepth=DEFAULT_INSET_DEPTH_PX,
+                 edgeOffset=DEFAULT_EDGE_OFFSET_PX,
+                 checkInterval=DEFAULT_CHECK_INTERVAL,
+                 confirmChecks=DEFAULT_CONFIRM_CHECKS,
+                 blackThreshold=DEFAULT_BLACK_THRESHOLD,
+                 maxBar=DEFAULT_MAX_BAR, levels=DEFAULT_BAR_LEVELS):
+        height, width = frameShape[:2]
+        self._checkInterval = checkInterval
+        self._confirmChecks = confirmChecks
+        self._blackThreshold = blackThreshold
+        self._framesSinceCheck = 0
+
+        self._frameShape = frameShape
+        self._insetDepth = insetDepth
+        self._edgeOffset = edgeOffset
+        self._patch = _ScreenPatch(samplePoints)
+        barSizes = np.arange(levels + 1) * (maxBar / levels)
+        self._barSizes = barSizes
+
+        self._samplers = {
+            (0, 0): RegionSampler(samplePoints, frameShape, insetDepth,
+                                  edgeOffset)
+        }
+        for level in range(1, levels + 1):
+            self._add_sampler((level, 0))
+            self._add_sampler((0, level))
+
+        # Pixels scanned for bars, as (scan line, bar level) index arrays per
+        # edge. Top and bottom are scanned along vertical lines, left and
+        # right along horizontal ones.
+        across = np.linspace(0.2, 0.8, NUM_SCAN_LINES)
+        self._scanPixels = {}
+        for side in ("top", "bottom", "left", "right"):
+            depth = barSizes if side in ("top", "left") else 1 - barSizes
+            if side in ("top", "bottom"):
+                u, v = np.meshgrid(across, depth, indexing="ij")
+            else:
+                v, u = np.meshgrid(across, depth, indexing="ij")
+            xs, ys = self._patch.point(u, v)
+            self._scanPixels[side] = (
+                np.clip(np.rint(ys), 0, height - 1).astype(np.intp),
+                np.clip(np.rint(xs), 0, width - 1).astype(np.intp)
+            )
+
+        self.barLevels = (0, 0)
+        self._candidate = (0, 0)
+        self._candidateChecks = 0
+        self._sampler = self._samplers[self.barLevels]
+
+
+    def sample(self, frame):
+        self._framesSinceCheck += 1
+        if self._framesSinceCheck >= self._checkInterval:
+            self._framesSinceCheck = 0
+            self._update_bar_levels(self.detect_bar_levels(frame))
+
+        return self._sampler.sample(frame)
+
+
+    def detect_bar_levels(self, frame):
+        """
+        Returns the (vertical, horizontal) bar levels seen in the frame. A
+        level is None if no edge of that direction has any bright pixel
+        within the scanned depth, ex. in a dark scene.
+        """
+        levels = {}
+        for side, (rows, cols) in self._scanPixels.items():
+            luma = frame[rows, cols] @ LUMA_WEIGHTS
+            # First level at which any scan line is bright
+            bright = np.any(luma > self._blackThreshold, axis=0)
+            levels[side] = np.argmax(bright) if bright.any() else None
+
+        return (_bar_level(levels["top"], levels["bottom"]),
+                _bar_level(levels["left"], levels["right"]))
+
+
+    def _update_bar_levels(self, detected):
+        # Keep the current level in a direction that can't be measured
+        detected = tuple(current if level is None else level \
+                            for level, current in zip(detected,
+                                                      self.barLevels))
+        if detected != self._candidate:
+            self._candidate = detected
+            self._candidateChecks = 0
+        self._candidateChecks += 1
+
+        if self._candidateChecks >= self._confirmChecks \
+                and detected != self.barLevels:
+            if detected not in self._samplers:
+                self._add_sampler(detected)
+            self.barLevels = detected
+            self._sampler = self._samplers[detected]
+
+
+    def _add_sampler(self, barLevels):
+        vertical, horizontal = barLevels
+        points = self._patch.inset_points(self._barSizes[vertical],
+                                          self._barSizes[horizontal])
+        self._samplers[barLevels] = RegionSampler(points, self._frameShape,
+                                                  self._insetDepth,
+                                                  self._edgeOffset)
+
+
+def _bar_level(first, second):
+    """
+    Returns the bar level for two opposite edges. Bars are symmetric, so
+    the smaller one wins, ex. when subtitles are shown in the bottom bar.
+    """
+    if first is None or second is None:
+        return None
+    return int(min(first, second))
+
+
+class _ScreenPatch:
+    """
+    Maps normalized screen coordinates (u from left to right, v from top to
+    bottom) to frame pixels with a Coons patch spanned by the sample points
+    of the four sides, so the mapping follows the curvature of every edge.
+    """
+    def __init__(self, samplePoints):
+        self._points = {side: np.array(points, dtype=np.float64).reshape(-1, 2)
+                            for side, points in samplePoints.items()}
+        self._params = {}
+        for side, points in self._points.items():
+            along = points[:, 0] if side in ("top", "bottom") else points[:, 1]
+            span = along[-1] - along[0]
+            self._params[side] = (along - along[0]) / span if span != 0 \
+                else np.linspace(0, 1, len(along))
+
+        self._corners = {
+            "topLeft": self._edge("top", 0),
+            "topRight": self._edge("top", 1),
+            "bottomLeft": self._edge("bottom", 0),
+            "bottomRight": self._edge("bottom", 1),
+        }
+
+
+    def point(self, u, v):
+        """
+        Returns the (x, y) frame coordinates of the screen coordinates u, v.
+        """
+        u = np.asarray(u, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        top, bottom = self._edge("top", u), self._edge("bottom", u)
+        left, right = self._edge("left", v), self._edge("right", v)
+        corners = self._corners
+
+        result = []
+        for axis in range(2):
+            result.append(
+                (1 - v) * top[axis] + v * bottom[axis]
+                + (1 - u) * left[axis] + u * right[axis]
+                - (1 - u) * (1 - v) * corners["topLeft"][axis]
+                - u * (1 - v) * corners["topRight"][axis]
+                - (1 - u) * v * corners["bottomLeft"][axis]
+                - u * v * corners["bottomRight"][axis]
+            )
+        return tuple(result)
+
+
+    def inset_points(self, verticalBar, horizontalBar):
+        """
+        Returns the sample points moved onto the edges of the active picture
+        left by bars of the given size, as fractions of the screen size.
+        """
+        insetPoints = {}
+        for side, params in self._params.items():
+            if side in ("top", "bottom"):
+                u = horizontalBar + params * (1 - 2 * horizontalBar)
+                v = np.full_like(u, verticalBar if side == "top" \
+                                    else 1 - verticalBar)
+            else:
+                v = verticalBar + params * (1 - 2 * verticalBar)
+                u = np.full_like(v, horizontalBar if side == "left" \
+                                    else 1 - horizontalBar)
+            xs, ys = self.point(u, v)
+            insetPoints[side] = np.rint(np.stack([xs, ys], axis=1)) \
+                                    .astype(np.int32)
+
+        return insetPoints
+
+
+    def _edge(self, side, param):
+        points = self._points[side]
+        params = self._params[side]
+        return (np.interp(param, params, points[:, 0]),
+                np.interp(param, params, points[:, 1]))
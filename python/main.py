@@ -1,24 +1,113 @@
-from image_controller import ImageController
 from led_controller import LEDInterface
+from metrics import MetricsRegistry, MetricsServer, register_process_memory
 from time import sleep
+import argparse
+import flight_recorder
+import profiler
+import tracer
+import user_pref
+
+POWER_POLL_S = 0.3
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", metavar="DIR",
+                        help="Sample every thread and process of the "
+                             "pipeline and write flamegraph-ready profiles "
+                             "to DIR on exit or SIGUSR1")
+    parser.add_argument("--trace", metavar="DIR",
+                        help="Record a timeline of every frame's pipeline "
+                             "stages and write it to DIR as a Chrome trace "
+                             "on exit or SIGUSR2")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Append the sampled colors of every frame to "
+                             "FILE, for replay.py")
+    parser.add_argument("--metrics-port", metavar="PORT", type=int,
+                        help="Serve Prometheus metrics at "
+                             "http://<pi>:PORT/metrics")
+    return parser.parse_args()
+
+
+def _run_single_camera(imageController, ledInterface):
+    imageController.set_led_interface(ledInterface)
+
+    prevPower = False
+    while True:
+        power = ledInterface.update_and_get_power_state()
+        if power and not prevPower:
+            imageController.start_capture_and_processing()
+            prevPower = power
+        elif not power and prevPower:
+            imageController.stop_capture_and_processing()
+            prevPower = power
+        else:
+            prevPower = power
+            sleep(POWER_POLL_S)
+
+
+def _run_displays(ledInterface, cameraWorkers):
+    # Every display is captured by its own worker process, which follows
+    # the power state read here
+    while True:
+        ledInterface.update_and_get_power_state()
+        cameraWorkers.supervise()
+        sleep(POWER_POLL_S)
+
 
 if __name__ == "__main__":
-    with ImageController() as imageController, \
-        LEDInterface() as ledInterface:
-        try:
-            imageController.set_led_interface(ledInterface)
-
-            prevPower = False
-            while True:
-                power = ledInterface.update_and_get_power_state()
-                if power and not prevPower:
-                    imageController.start_capture_and_processing()
-                    prevPower = power
-                elif not power and prevPower:
-                    imageController.stop_capture_and_processing()
-                    prevPower = power
-                else:
-                    prevPower = power
-                    sleep(0.3)
-        except KeyboardInterrupt:
-            pass
+    args = _parse_args()
+    if args.profile is not None:
+        profiler.enable(args.profile)
+        profiler.start_if_enabled("main")
+    if args.trace is not None:
+        tracer.enable(args.trace)
+
+    # Imported here, as the LED process also loads this module as
+    # __mp_main__ and must not pull in the camera and image libraries
+    from image_controller import ImageController
+
+    displays = user_pref.read_displays()
+    if displays is not None and args.record is not None:
+        print("ERROR: --record only supports a single camera. Remove "
+              f"{user_pref.DISPLAYS_FILE} to record.")
+        exit(1)
+
+    metricsRegistry = MetricsRegistry()
+    register_process_memory(metricsRegistry, "main")
+    metricsServer = None
+    if args.metrics_port is not None:
+        metricsServer = MetricsServer(metricsRegistry, args.metrics_port)
+        metricsServer.start()
+
+    if displays is None:
+        with ImageController(metricsRegistry, args.record) as imageController, \
+            LEDInterface(metricsRegistry=metricsRegistry) as ledInterface:
+            try:
+                _run_single_camera(imageController, ledInterface)
+            except KeyboardInterrupt:
+                pass
+    else:
+        from camera_worker import CameraWorkers
+        # Every camera worker keeps its own flight recorder
+        flight_recorder.forward_dump_signal()
+        imageControllers = {
+            display["name"]: ImageController(metricsRegistry,
+                                             display=display) \
+                for display in displays
+        }
+        with LEDInterface(metricsRegistry=metricsRegistry) as ledInterface, \
+            CameraWorkers(imageControllers, ledInterface,
+                          metricsRegistry) as cameraWorkers:
+            try:
+                _run_displays(ledInterface, cameraWorkers)
+            except KeyboardInterrupt:
+                pass
+
+    if metricsServer is not None:
+        metricsServer.stop()
+    if args.profile is not None:
+        profiler.stop()
+        print(f"Wrote merged profile to {profiler.merge_profiles(args.profile)}")
+    if args.trace is not None:
+        tracer.get_tracer("main").write()
+        print(f"Wrote merged trace to {tracer.merge_traces(args.trace)}")
@@ -0,0 +1,286 @@
+from bisect import bisect_left
+from multiprocessing.sharedctypes import RawArray
+import os
+import sys
+import threading
+
+DEFAULT_METRICS_PORT = 9100
+DEFAULT_REGISTRY_CAPACITY = 1024
+DEFAULT_LATENCY_BUCKETS_S = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                             0.1, 0.2, 0.5)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsRegistry:
+    """
+    Holds the values of all metrics in one shared memory array, so metrics
+    updated in a child process are visible to the exporter in the main
+    process without locks or messages.
+
+    Every metric must have exactly one writer (a thread or process) and must
+    be registered in the main process before the processes that update it
+    are started; the metric objects are then passed to them. Callback gauges
+    are computed by the exporter when scraped and can be added any time.
+    """
+    def __init__(self, capacity=DEFAULT_REGISTRY_CAPACITY):
+        self._values = RawArray("d", capacity)
+        self._used = 0
+        self._metrics = []
+
+
+    def counter(self, name, help, labels=None):
+        metric = Counter(self._values, self._allocate(1))
+        self._metrics.append((name, "counter", help, labels, metric))
+        return metric
+
+
+    def gauge(self, name, help, labels=None, callback=None):
+        if callback is not None:
+            metric = CallbackGauge(callback)
+        else:
+            metric = Gauge(self._values, self._allocate(1))
+        self._metrics.append((name, "gauge", help, labels, metric))
+        return metric
+
+
+    def histogram(self, name, help, labels=None,
+                  buckets=DEFAULT_LATENCY_BUCKETS_S):
+        # One slot per bucket plus the +Inf bucket, the sum and the count
+        metric = Histogram(self._values, self._allocate(len(buckets) + 3),
+                           buckets)
+        self._metrics.append((name, "histogram", help, labels, metric))
+        return metric
+
+
+    def exposition(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        # Samples of one name must be listed together, whatever order the
+        # metrics were registered in
+        families = {}
+        for name, metricType, help, labels, metric in self._metrics:
+            families.setdefault(name, (metricType, help, []))[2] \
+                .append((labels, metric))
+
+        lines = []
+        for name, (metricType, help, members) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metricType}")
+            for labels, metric in members:
+                for suffix, sampleLabels, value in metric.samples():
+                    allLabels = dict(labels or {})
+                    allLabels.update(sampleLabels)
+                    lines.append(f"{name}{suffix}{_format_labels(allLabels)} "
+                                 f"{_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+    def sample_value(self, sampleName, labels=None):
+        """
+        Returns the current value of one sample, ex.
+        "backlight_led_frames_total", or None if there is no such sample.
+        """
+        for name, _, _, metricLabels, metric in self._metrics:
+            if not sampleName.startswith(name):
+                continue
+            for suffix, sampleLabels, value in metric.samples():
+                allLabels = dict(metricLabels or {})
+                allLabels.update(sampleLabels)
+                if name + suffix == sampleName and allLabels == (labels or {}):
+                    return value
+        return None
+
+
+    def _allocate(self, numSlots):
+        if self._used + numSlots > len(self._values):
+            print("ERROR: Out of metric slots. Increase the registry "
+                  "capacity.")
+            exit(1)
+
+        offset = self._used
+        self._used += numSlots
+        return offset
+
+
+class Counter:
+    def __init__(self, values, offset):
+        self._values = values
+        self._offset = offset
+
+
+    def inc(self, amount=1):
+        self._values[self._offset] += amount
+
+
+    def value(self):
+        return self._values[self._offset]
+
+
+    def samples(self):
+        return [("_total", {}, self._values[self._offset])]
+
+
+class Gauge:
+    def __init__(self, values, offset):
+        self._values = values
+        self._offset = offset
+
+
+    def set(self, value):
+        self._values[self._offset] = value
+
+
+    def samples(self):
+        return [("", {}, self._values[self._offset])]
+
+
+class CallbackGauge:
+    def __init__(self, callback):
+        self._callback = callback
+
+
+    def samples(self):
+        value = self._callback()
+        if value is None:
+            return []
+        return [("", {}, value)]
+
+
+class Histogram:
+    """
+    Buckets are stored non-cumulatively so an observation only touches one
+    bucket, and are summed up when exported.
+    """
+    def __init__(self, values, offset, buckets):
+        self._values = values
+        self._offset = offset
+        self._buckets = list(buckets)
+        self._sumOffset = offset + len(buckets) + 1
+        self._countOffset = offset + len(buckets) + 2
+
+
+    def observe(self, value):
+        self._values[self._offset + bisect_left(self._buckets, value)] += 1
+        self._values[self._sumOffset] += value
+        self._values[self._countOffset] += 1
+
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        bounds = self._buckets + [float("inf")]
+        for idx, bound in enumerate(bounds):
+            cumulative += self._values[self._offset + idx]
+            samples.append(("_bucket", {"le": _format_value(bound)},
+                            cumulative))
+        samples.append(("_sum", {}, self._values[self._sumOffset]))
+        samples.append(("_count", {}, self._values[self._countOffset]))
+        return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def process_memory(pid=None):
+    """
+    Returns the (rss, pss, uss) of a process in bytes, or None if it is gone.
+    PSS splits shared pages evenly between the processes sharing them and
+    USS only counts the pages private to the process.
+    """
+    try:
+        with open(f"/proc/{pid or os.getpid()}/smaps_rollup", "r") as smapsFile:
+            fields = {}
+            for line in smapsFile:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    return (fields["Rss"], fields["Pss"],
+            fields["Private_Clean"] + fields["Private_Dirty"])
+
+
+def register_process_memory(registry, processName, pid=None):
+    """
+    Adds RSS, PSS and USS gauges for a pipeline process to the registry. For
+    a process that may be restarted, pid can be a function returning the pid
+    of the current one.
+    """
+    def current_pid():
+        return pid() if callable(pid) else pid
+
+    for idx, (kind, help) in enumerate([
+            ("resident", "Resident set size of each pipeline process"),
+            ("proportional", "Proportional set size of each pipeline process"),
+            ("unique", "Unique set size of each pipeline process")]):
+        registry.gauge(
+                f"backlight_process_{kind}_bytes", help,
+                labels={"process": processName},
+                callback=lambda idx=idx: (process_memory(current_pid()) or
+                                          [None] * 3)[idx])
+
+
+class MetricsServer:
+    """
+    Serves the registry at /metrics from a daemon thread.
+    """
+    def __init__(self, registry, port=DEFAULT_METRICS_PORT, host="0.0.0.0"):
+        # Only the process serving metrics needs http.server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="metrics", daemon=True)
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (1, 2):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} [port]")
+        exit(1)
+
+    # Prints one scrape of a running pipeline
+    from urllib.request import urlopen
+    port = int(sys.argv[1]) if len(sys.argv) == 2 else DEFAULT_METRICS_PORT
+    with urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+        print(response.read().decode(), end="")
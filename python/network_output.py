@@ -0,0 +1,342 @@
+from led_output import LEDOutput
+from time import monotonic_ns, perf_counter, sleep
+import numpy as np
+import socket
+import struct
+import sys
+import threading
+import uuid
+
+DDP_PORT = 4048
+DDP_HEADER_SIZE = 10
+DDP_TIMECODE_SIZE = 4
+DDP_MAX_DATA_SIZE = 1440
+DDP_FLAG_VERSION_1 = 0x40
+DDP_FLAG_TIMECODE = 0x10
+DDP_FLAG_PUSH = 0x01
+DDP_DATA_TYPE_RGB8 = 0x0B
+DDP_DEFAULT_DESTINATION = 0x01
+
+E131_PORT = 5568
+E131_HEADER_SIZE = 126
+E131_PIXELS_PER_UNIVERSE = 170
+E131_DEFAULT_PRIORITY = 100
+E131_SOURCE_NAME = b"backlight-pi"
+
+SOCKET_SEND_BUFFER_BYTES = 1 << 18
+
+class _UDPOutput(LEDOutput):
+    """
+    Common base for the network outputs. Packets for a whole frame are
+    preallocated once, and each frame only copies the pixel data and
+    sequence numbers into them before sending them to every receiver on a
+    non-blocking socket. Packets that do not fit in the socket buffer are
+    dropped rather than delaying the render loop.
+    """
+    def __init__(self, stripConfig, numLeds, brightness, defaultPort):
+        super().__init__(stripConfig, numLeds, brightness)
+        port = stripConfig.get("port", defaultPort)
+        self._receivers = [(host, port) for host in stripConfig["hosts"]]
+        self._brightnessTable = np.rint(np.arange(256) * brightness) \
+                                    .astype(np.uint8)
+        self._sequence = 0
+        self.droppedPackets = 0
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                SOCKET_SEND_BUFFER_BYTES)
+        if stripConfig.get("multicast", False):
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                    stripConfig.get("multicast_ttl", 1))
+        self._socket.setblocking(False)
+
+
+    def write(self, colors):
+        pixels = memoryview(self._brightnessTable[colors].tobytes())
+        self._sequence += 1
+        for packet, dataView, start, end in self._packets:
+            dataView[:] = pixels[start:end]
+        self._prepare_packets()
+        self._send_packets()
+
+
+    def close(self):
+        self._socket.close()
+
+
+    def _prepare_packets(self):
+        pass
+
+
+    def _send_packets(self):
+        for receiver in self._receivers:
+            for packet, _, _, _ in self._packets:
+                try:
+                    self._socket.sendto(packet, receiver)
+                except (BlockingIOError, InterruptedError):
+                    self.droppedPackets += 1
+
+
+class DDPOutput(_UDPOutput):
+    """
+    Sends colors with the Distributed Display Protocol, as accepted by
+    WLED and most ESP based LED controllers. The frame is split into packets
+    of at most 480 pixels and the last packet carries the PUSH flag.
+    """
+    def __init__(self, stripConfig, numLeds, brightness):
+        super().__init__(stripConfig, numLeds, brightness, DDP_PORT)
+        self._timecode = stripConfig.get("timecode", False)
+        headerSize = DDP_HEADER_SIZE + \
+            (DDP_TIMECODE_SIZE if self._timecode else 0)
+        destination = stripConfig.get("destination", DDP_DEFAULT_DESTINATION)
+
+        self._packets = []
+        frameSize = numLeds * 3
+        for start in range(0, frameSize, DDP_MAX_DATA_SIZE):
+            end = min(start + DDP_MAX_DATA_SIZE, frameSize)
+            flags = DDP_FLAG_VERSION_1
+            if self._timecode:
+                flags |= DDP_FLAG_TIMECODE
+            if end == frameSize:
+                flags |= DDP_FLAG_PUSH
+            packet = bytearray(headerSize + end - start)
+            struct.pack_into(">BBBBIH", packet, 0, flags, 0,
+                             DDP_DATA_TYPE_RGB8, destination, start,
+                             end - start)
+            dataView = memoryview(packet)[headerSize:]
+            self._packets.append((packet, dataView, start, end))
+
+
+    def _prepare_packets(self):
+        # DDP sequence numbers run from 1 to 15
+        sequence = (self._sequence - 1) % 15 + 1
+        timecode = (monotonic_ns() // 1000) & 0xFFFFFFFF
+        for packet, _, _, _ in self._packets:
+            packet[1] = sequence
+            if self._timecode:
+                struct.pack_into(">I", packet, DDP_HEADER_SIZE, timecode)
+
+
+class E131Output(_UDPOutput):
+    """
+    Sends colors with sACN (E1.31). Every universe carries 170 whole pixels,
+    starting at the configured universe. With "multicast", packets go to the
+    standard multicast group of each universe instead of "hosts".
+    """
+    def __init__(self, stripConfig, numLeds, brightness):
+        firstUniverse = stripConfig.get("universe", 1)
+        if stripConfig.get("multicast", False):
+            stripConfig = dict(stripConfig)
+            stripConfig["hosts"] = []
+        super().__init__(stripConfig, numLeds, brightness, E131_PORT)
+        self._multicast = stripConfig.get("multicast", False)
+        self._port = stripConfig.get("port", E131_PORT)
+        priority = stripConfig.get("priority", E131_DEFAULT_PRIORITY)
+        cid = uuid.uuid4().bytes
+
+        self._packets = []
+        self._universes = []
+        frameSize = numLeds * 3
+        universeSize = E131_PIXELS_PER_UNIVERSE * 3
+        for universeIdx, start in enumerate(range(0, frameSize,
+                                                  universeSize)):
+            end = min(start + universeSize, frameSize)
+            universe = firstUniverse + universeIdx
+            packet = _e131_packet(cid, priority, universe, end - start)
+            dataView = memoryview(packet)[E131_HEADER_SIZE:]
+            self._packets.append((packet, dataView, start, end))
+            self._universes.append(universe)
+
+
+    def _prepare_packets(self):
+        sequence = self._sequence & 0xFF
+        for packet, _, _, _ in self._packets:
+            packet[111] = sequence
+
+
+    def _send_packets(self):
+        if not self._multicast:
+            super()._send_packets()
+            return
+
+        for (packet, _, _, _), universe in zip(self._packets,
+                                               self._universes):
+            group = f"239.255.{universe >> 8}.{universe & 0xFF}"
+            try:
+                self._socket.sendto(packet, (group, self._port))
+            except (BlockingIOError, InterruptedError):
+                self.droppedPackets += 1
+
+
+def _e131_packet(cid, priority, universe, dataSize):
+    packet = bytearray(E131_HEADER_SIZE + dataSize)
+    packetSize = len(packet)
+    # Root layer
+    struct.pack_into(">HH12sHI16s", packet, 0, 0x0010, 0x0000,
+                     b"ASC-E1.17\x00\x00\x00",
+                     0x7000 | (packetSize - 16), 0x00000004, cid)
+    # Framing layer
+    struct.pack_into(">HI64sBHBBH", packet, 38,
+                     0x7000 | (packetSize - 38), 0x00000002,
+                     E131_SOURCE_NAME, priority, 0, 0, 0, universe)
+    # DMP layer
+    struct.pack_into(">HBBHHHB", packet, 115,
+                     0x7000 | (packetSize - 115), 0x02, 0xA1, 0x0000,
+                     0x0001, dataSize + 1, 0x00)
+    return packet
+
+
+class UDPReceiver:
+    """
+    Minimal stand-in for a networked LED controller. Counts received frames,
+    detects lost packets from sequence gaps and, for DDP packets with a
+    timecode, measures the latency from send to receive. The pixel data of
+    every frame is reassembled into frameData: a DDP frame is complete on
+    its PUSH packet, and an E1.31 frame once the first universe of the next
+    frame comes or the receiver stops. With port 0, a free port is picked.
+    """
+    def __init__(self, protocol, port, host="127.0.0.1", firstUniverse=1):
+        self._protocol = protocol
+        self._firstUniverse = firstUniverse
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self._socket.settimeout(0.1)
+        self.port = self._socket.getsockname()[1]
+        self._stop = threading.Event()
+        self._thread = None
+        self.packets = 0
+        self.frames = 0
+        self.lostPackets = 0
+        self.latenciesUs = []
+        self.frameData = []
+        self._lastSequence = {}
+        self._pixels = bytearray()
+        self._framePending = False
+
+
+    def start(self):
+        self._thread = threading.Thread(target=self._receive_loop,
+                                        daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._socket.close()
+        if self._framePending:
+            self._finish_frame()
+
+
+    def _receive_loop(self):
+        while not self._stop.is_set():
+            try:
+                packet = self._socket.recv(2048)
+            except socket.timeout:
+                continue
+            self.packets += 1
+            if self._protocol == "ddp":
+                self._on_ddp_packet(packet)
+            else:
+                self._on_e131_packet(packet)
+
+
+    def _on_ddp_packet(self, packet):
+        flags, sequence, _, _, offset, length = \
+            struct.unpack_from(">BBBBIH", packet, 0)
+        self._check_sequence(offset, sequence, 15, 1)
+        headerSize = DDP_HEADER_SIZE + \
+            (DDP_TIMECODE_SIZE if flags & DDP_FLAG_TIMECODE else 0)
+        self._add_pixels(offset, packet[headerSize:headerSize + length])
+        if flags & DDP_FLAG_PUSH:
+            self.frames += 1
+            self._finish_frame()
+            if flags & DDP_FLAG_TIMECODE:
+                sentUs = struct.unpack_from(">I", packet, DDP_HEADER_SIZE)[0]
+                nowUs = (monotonic_ns() // 1000) & 0xFFFFFFFF
+                self.latenciesUs.append((nowUs - sentUs) & 0xFFFFFFFF)
+
+
+    def _on_e131_packet(self, packet):
+        sequence = packet[111]
+        universe = struct.unpack_from(">H", packet, 113)[0]
+        self._check_sequence(universe, sequence, 256, 0)
+        if universe == self._firstUniverse:
+            self.frames += 1
+            if self._framePending:
+                self._finish_frame()
+        # The property count includes the DMX start code
+        dataSize = struct.unpack_from(">H", packet, 123)[0] - 1
+        self._add_pixels(
+                (universe - self._firstUniverse) * E131_PIXELS_PER_UNIVERSE * 3,
+                packet[E131_HEADER_SIZE:E131_HEADER_SIZE + dataSize])
+
+
+    def _add_pixels(self, offset, data):
+        end = offset + len(data)
+        if len(self._pixels) < end:
+            self._pixels.extend(bytes(end - len(self._pixels)))
+        self._pixels[offset:end] = data
+        self._framePending = True
+
+
+    def _finish_frame(self):
+        self.frameData.append(bytes(self._pixels))
+        self._framePending = False
+
+
+    def _check_sequence(self, key, sequence, modulo, first):
+        if key in self._lastSequence:
+            expected = (self._lastSequence[key] - first + 1) % modulo + first
+            self.lostPackets += (sequence - expected) % modulo
+        self._lastSequence[key] = sequence
+
+
+OUTPUT_CLASSES = {
+    "ddp": DDPOutput,
+    "e131": E131Output,
+}
+
+def run_loopback(protocol, numLeds, fps, numFrames):
+    """
+    Streams numFrames frames to a local UDPReceiver at the given rate and
+    reports frame rate, packet loss and (for DDP) latency.
+    """
+    port = DDP_PORT if protocol == "ddp" else E131_PORT
+    receiver = UDPReceiver(protocol, port)
+    receiver.start()
+    stripConfig = {"hosts": ["127.0.0.1"], "port": port, "timecode": True}
+    output = OUTPUT_CLASSES[protocol](stripConfig, numLeds, 1.0)
+
+    colors = np.zeros((numLeds, 3), dtype=np.uint8)
+    frameTime = 1 / fps
+    startTime = perf_counter()
+    for frameIdx in range(numFrames):
+        colors[:] = frameIdx & 0xFF
+        output.write(colors)
+        sleep(max(0, startTime + (frameIdx + 1) * frameTime - perf_counter()))
+    elapsed = perf_counter() - startTime
+    sleep(0.2)
+    output.close()
+    receiver.stop()
+
+    print(f"Sent {numFrames} frames of {numLeds} LEDs over {protocol} in "
+          f"{elapsed:.2f}s ({numFrames / elapsed:.1f} fps)")
+    print(f"Received {receiver.frames} frames, {receiver.packets} packets, "
+          f"{receiver.lostPackets} lost, {output.droppedPackets} dropped by "
+          "the sender")
+    if receiver.latenciesUs:
+        latencies = np.array(receiver.latenciesUs)
+        print(f"Latency: median {np.median(latencies):.0f}us, "
+              f"p99 {np.percentile(latencies, 99):.0f}us")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] != "loopback" \
+            or sys.argv[2] not in OUTPUT_CLASSES:
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} loopback [ddp|e131] <num leds> <fps>")
+        exit(1)
+
+    fps = int(sys.argv[4])
+    run_loopback(sys.argv[2], int(sys.argv[3]), fps, fps * 5)
@@ -0,0 +1,266 @@
+from ctypes import POINTER, byref, c_char_p, c_int, c_ubyte, c_ulong, \
+    c_void_p, cdll, Structure
+from ctypes.util import find_library
+from os import path
+from statistics import median
+from time import perf_counter
+from turbojpeg import DEFAULT_LIB_PATHS, TurboJPEG, TJERR_WARNING, TJPF_BGR, \
+    TJPF_RGB, TJSAMP_422, TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, tjPixelSize
+import mmap
+import numpy as np
+import platform
+import resource
+import sys
+import tracemalloc
+import warnings
+
+DEFAULT_POOL_SIZE = 2
+# Compress into the given buffer instead of letting libturbojpeg reallocate
+# it. Not exported by PyTurboJPEG.
+TJFLAG_NOREALLOC = 1024
+
+class FramePool:
+    """
+    A few preallocated frame buffers per frame shape, handed out round robin.
+    Buffers are anonymous memory maps, so they are page aligned, and every
+    page is touched when a buffer is created so the first frames don't
+    page fault.
+
+    A buffer is handed out again poolSize acquisitions of the same shape
+    later, so a frame must not be used after that.
+    """
+    def __init__(self, poolSize=DEFAULT_POOL_SIZE):
+        self._poolSize = poolSize
+        self._buffers = {}
+        self._nextIdx = {}
+        self.numAllocations = 0
+
+
+    def acquire(self, shape):
+        buffers = self._buffers.setdefault(shape, [])
+        idx = self._nextIdx.get(shape, 0)
+        if idx == len(buffers):
+            buffers.append(_allocate_page_aligned(shape))
+            self.numAllocations += 1
+        self._nextIdx[shape] = (idx + 1) % self._poolSize
+        return buffers[idx]
+
+
+def _allocate_page_aligned(shape):
+    numBytes = int(np.prod(shape))
+    memory = mmap.mmap(-1, max(numBytes, 1))
+    frame = np.frombuffer(memory, dtype=np.uint8, count=numBytes).reshape(shape)
+    frame.fill(0)
+    return frame
+
+
+class _ScalingFactor(Structure):
+    _fields_ = [("num", c_int), ("denom", c_int)]
+
+
+class PooledTurboJPEG:
+    """
+    Stands in for TurboJPEG's decode() and encode(), but keeps one
+    libturbojpeg handle for its lifetime and decodes into a FramePool instead
+    of allocating a new frame every call.
+
+    Decoded frames are views into the pool: they are overwritten poolSize
+    decodes of the same shape later, so callers must be done with a frame by
+    then (or copy it). Not thread safe.
+    """
+    def __init__(self, poolSize=DEFAULT_POOL_SIZE, libPath=None):
+        turboJpeg = cdll.LoadLibrary(libPath or _find_turbojpeg())
+
+        self._initDecompress = turboJpeg.tjInitDecompress
+        self._initDecompress.restype = c_void_p
+        self._initCompress = turboJpeg.tjInitCompress
+        self._initCompress.restype = c_void_p
+        self._destroy = turboJpeg.tjDestroy
+        self._destroy.argtypes = [c_void_p]
+        self._destroy.restype = c_int
+        self._decompressHeader = turboJpeg.tjDecompressHeader3
+        self._decompressHeader.argtypes = [
+            c_void_p, POINTER(c_ubyte), c_ulong, POINTER(c_int),
+            POINTER(c_int), POINTER(c_int), POINTER(c_int)]
+        self._decompressHeader.restype = c_int
+        self._decompress = turboJpeg.tjDecompress2
+        self._decompress.argtypes = [
+            c_void_p, POINTER(c_ubyte), c_ulong, POINTER(c_ubyte),
+            c_int, c_int, c_int, c_int, c_int]
+        self._decompress.restype = c_int
+        self._compress = turboJpeg.tjCompress2
+        self._compress.argtypes = [
+            c_void_p, POINTER(c_ubyte), c_int, c_int, c_int, c_int,
+            POINTER(POINTER(c_ubyte)), POINTER(c_ulong), c_int, c_int, c_int]
+        self._compress.restype = c_int
+        self._bufSize = turboJpeg.tjBufSize
+        self._bufSize.argtypes = [c_int, c_int, c_int]
+        self._bufSize.restype = c_ulong
+        self._getErrorStr = turboJpeg.tjGetErrorStr2
+        self._getErrorStr.argtypes = [c_void_p]
+        self._getErrorStr.restype = c_char_p
+        self._getErrorCode = turboJpeg.tjGetErrorCode
+        self._getErrorCode.argtypes = [c_void_p]
+        self._getErrorCode.restype = c_int
+
+        getScalingFactors = turboJpeg.tjGetScalingFactors
+        getScalingFactors.argtypes = [POINTER(c_int)]
+        getScalingFactors.restype = POINTER(_ScalingFactor)
+        numFactors = c_int()
+        factors = getScalingFactors(byref(numFactors))
+        self._scalingFactors = {(factors[idx].num, factors[idx].denom) \
+                                    for idx in range(numFactors.value)}
+
+        self._decompressor = self._initDecompress()
+        self._compressor = None
+        self._pool = FramePool(poolSize)
+        self._jpegBuffers = {}
+
+
+    def decode(self, jpeg_buf, pixel_format=TJPF_BGR, scaling_factor=None,
+               flags=0):
+        jpegArray = np.frombuffer(jpeg_buf, dtype=np.uint8)
+        jpegAddr = jpegArray.ctypes.data_as(POINTER(c_ubyte))
+        width, height = c_int(), c_int()
+        subsample, colorspace = c_int(), c_int()
+        status = self._decompressHeader(
+                self._decompressor, jpegAddr, jpegArray.size, byref(width),
+                byref(height), byref(subsample), byref(colorspace))
+        # Without a valid header there is nothing to decode into, even if
+        # libturbojpeg only reports a warning
+        if status != 0:
+            raise OSError(self._getErrorStr(self._decompressor).decode())
+
+        width, height = width.value, height.value
+        if scaling_factor is not None:
+            if tuple(scaling_factor) not in self._scalingFactors:
+                raise ValueError(f"Supported scaling factors are "
+                                 f"{sorted(self._scalingFactors)}")
+            num, denom = scaling_factor
+            width = (width * num + denom - 1) // denom
+            height = (height * num + denom - 1) // denom
+
+        frame = self._pool.acquire((height, width, tjPixelSize[pixel_format]))
+        status = self._decompress(
+                self._decompressor, jpegAddr, jpegArray.size,
+                frame.ctypes.data_as(POINTER(c_ubyte)), width, 0, height,
+                pixel_format, flags)
+        if status != 0:
+            self._report_error(self._decompressor)
+        return frame
+
+
+    def encode(self, img_array, quality=85, pixel_format=TJPF_BGR,
+               jpeg_subsample=TJSAMP_422, flags=0):
+        """
+        Compresses into a buffer kept per frame shape and returns a copy of
+        the used part of it.
+        """
+        if self._compressor is None:
+            self._compressor = self._initCompress()
+
+        height, width = img_array.shape[:2]
+        key = (width, height, jpeg_subsample)
+        if key not in self._jpegBuffers:
+            self._jpegBuffers[key] = _allocate_page_aligned(
+                    (self._bufSize(width, height, jpeg_subsample),))
+        jpegBuffer = self._jpegBuffers[key]
+
+        imgArray = np.ascontiguousarray(img_array)
+        jpegAddr = jpegBuffer.ctypes.data_as(POINTER(c_ubyte))
+        jpegSize = c_ulong(jpegBuffer.size)
+        status = self._compress(
+                self._compressor, imgArray.ctypes.data_as(POINTER(c_ubyte)),
+                width, imgArray.strides[0], height, pixel_format,
+                byref(jpegAddr), byref(jpegSize), jpeg_subsample, quality,
+                flags | TJFLAG_NOREALLOC)
+        if status != 0:
+            self._report_error(self._compressor)
+        return jpegBuffer[:jpegSize.value].tobytes()
+
+
+    def close(self):
+        for handle in (self._decompressor, self._compressor):
+            if handle is not None:
+                self._destroy(handle)
+        self._decompressor = None
+        self._compressor = None
+
+
+    def _report_error(self, handle):
+        # Same as TurboJPEG: warnings (ex. a truncated frame) still produce
+        # an image
+        message = self._getErrorStr(handle).decode()
+        if self._getErrorCode(handle) == TJERR_WARNING:
+            warnings.warn(message)
+            return
+        raise OSError(message)
+
+
+def _find_turbojpeg():
+    libPath = find_library("turbojpeg")
+    if libPath is not None:
+        return libPath
+    for libPath in DEFAULT_LIB_PATHS.get(platform.system(), []):
+        if path.exists(libPath):
+            return libPath
+
+    print("ERROR: Could not find libturbojpeg. Install libturbojpeg0.")
+    exit(1)
+
+
+def _measure(decode, jpeg, numFrames):
+    """
+    Returns the median decode time in ms, and the bytes allocated and minor
+    page faults per frame. Allocations are measured in a separate pass since
+    tracing them slows decoding down.
+    """
+    # Let the pool (or the allocator) reach its steady state first
+    for _ in range(DEFAULT_POOL_SIZE + 1):
+        decode(jpeg)
+    faultsBefore = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    decodeTimes = []
+    for _ in range(numFrames):
+        start = perf_counter()
+        decode(jpeg)
+        decodeTimes.append(perf_counter() - start)
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faultsBefore
+
+    allocatedBytes = 0
+    tracemalloc.start()
+    for _ in range(numFrames):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        decode(jpeg)
+        allocatedBytes += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    return (median(decodeTimes) * 1000, allocatedBytes / numFrames,
+            faults / numFrames)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} <jpeg file> [num frames]")
+        exit(1)
+
+    # Compares the pipeline's decode with and without the pool, ex. on a
+    # frame saved by setup_camera.py and converted to JPEG
+    with open(sys.argv[1], "rb") as jpegFile:
+        jpeg = jpegFile.read()
+    numFrames = int(sys.argv[2]) if len(sys.argv) == 3 else 200
+    flags = TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT
+
+    turboJpeg = TurboJPEG()
+    pooledTurboJpeg = PooledTurboJPEG()
+    for name, decoder in (("TurboJPEG", turboJpeg),
+                          ("PooledTurboJPEG", pooledTurboJpeg)):
+        decodeMs, allocatedBytes, faults = _measure(
+                lambda jpeg: decoder.decode(jpeg, pixel_format=TJPF_RGB,
+                                            flags=flags),
+                jpeg, numFrames)
+        print(f"{name:>16}: {decodeMs:.2f} ms per frame, "
+              f"{allocatedBytes / 1024:.0f} KiB allocated per frame, "
+              f"{faults:.1f} page faults per frame")
+    pooledTurboJpeg.close()
@@ -0,0 +1,28 @@
+import signal
+
+# Passed on by the main process to its children, which only install their
+# handlers once they are up: SIGUSR1 by the profiler, SIGUSR2 by the tracer
+# and SIGRTMIN by the flight recorder
+FORWARDED_SIGNALS = (signal.SIGUSR1, signal.SIGUSR2, signal.SIGRTMIN)
+
+def start_process(process):
+    """
+    Starts a child process with FORWARDED_SIGNALS blocked. The blocked mask
+    survives spawning the new interpreter, so a signal forwarded while the
+    child is still starting up waits until it calls handlers_ready()
+    instead of killing it. Signals sent to this process meanwhile are
+    delivered right after the child started.
+    """
+    prevMask = signal.pthread_sigmask(signal.SIG_BLOCK, FORWARDED_SIGNALS)
+    try:
+        process.start()
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, prevMask)
+
+
+def handlers_ready():
+    """
+    Called by a child process started with start_process() once it installed
+    its handlers for FORWARDED_SIGNALS, which delivers the ones it missed.
+    """
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, FORWARDED_SIGNALS)
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from multiprocessing import active_children, current_process
+from os import path
+import glob
+import os
+import signal
+import sys
+import threading
+
+PROFILE_DIR_ENV = "BACKLIGHT_PROFILE_DIR"
+DEFAULT_SAMPLE_INTERVAL_S = 0.005
+MERGED_PROFILE_FILE = "merged.folded"
+
+_profiler = None
+
+class SamplingProfiler:
+    """
+    Statistical profiler for every thread of the current process. A daemon
+    thread wakes up every intervalS seconds and records the stack of every
+    other thread. Stacks are kept as tuples of code objects and only turned
+    into text when the profile is written, so each sample costs a dictionary
+    update per thread.
+
+    Profiles are written in the collapsed stack format ("frame;frame;frame
+    count" per line) understood by flamegraph.pl and speedscope.
+    """
+    def __init__(self, name, outputDir, intervalS=DEFAULT_SAMPLE_INTERVAL_S):
+        self._name = name
+        self.pid = os.getpid()
+        self._outputPath = path.join(outputDir,
+                                     f"{name}-{os.getpid()}.folded")
+        self._intervalS = intervalS
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        name="profiler", daemon=True)
+        self.numSamples = 0
+
+
+    def start(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+
+    def write(self):
+        with self._lock:
+            counts = dict(self._counts)
+
+        lines = defaultdict(int)
+        for (threadName, codes), count in counts.items():
+            frames = [threadName] + [_frame_name(code) for code in codes]
+            lines[";".join(frames)] += count
+
+        with open(self._outputPath, "w") as profileFile:
+            for stack, count in lines.items():
+                profileFile.write(f"{stack} {count}\n")
+        return self._outputPath
+
+
+    def _sample_loop(self):
+        ownId = threading.get_ident()
+        while not self._stop.wait(self._intervalS):
+            threadNames = {thread.ident: thread.name \
+                                for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self._lock:
+                for threadId, frame in frames.items():
+                    if threadId == ownId:
+                        continue
+                    codes = []
+                    while frame is not None:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    threadName = threadNames.get(threadId, str(threadId))
+                    self._counts[(threadName, tuple(reversed(codes)))] += 1
+                self.numSamples += 1
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({path.basename(code.co_filename)}:" \
+           f"{code.co_firstlineno})"
+
+
+def enable(outputDir):
+    """
+    Turns on profiling for this process and every process it starts
+    afterwards. Child processes pick it up through start_if_enabled().
+    """
+    os.makedirs(outputDir, exist_ok=True)
+    os.environ[PROFILE_DIR_ENV] = path.abspath(outputDir)
+
+
+def start_if_enabled(name):
+    """
+    Starts profiling the current process if profiling is enabled. Must be
+    called from the main thread of the process, which then also writes the
+    profile on SIGUSR1.
+    """
+    global _profiler
+    outputDir = os.environ.get(PROFILE_DIR_ENV)
+    # A forked child inherits the parent's profiler, but not its thread
+    if outputDir is None or _owns_profiler():
+        return
+
+    _profiler = SamplingProfiler(name, outputDir)
+    _profiler.start()
+    signal.signal(signal.SIGUSR1, _on_sigusr1)
+    print(f"Profiling {name} ({current_process().name}) into {outputDir}")
+
+
+def stop():
+    """
+    Stops profiling the current process and writes its profile.
+    """
+    global _profiler
+    if not _owns_profiler():
+        return
+
+    _profiler.stop()
+    _profiler = None
+
+
+def merge_profiles(outputDir):
+    """
+    Merges the profiles of all processes in outputDir into one file, with
+    every stack rooted at the process that recorded it.
+    """
+    merged = defaultdict(int)
+    for profilePath in sorted(glob.glob(path.join(outputDir, "*.folded"))):
+        processName = path.splitext(path.basename(profilePath))[0]
+        if processName + ".folded" == MERGED_PROFILE_FILE:
+            continue
+        with open(profilePath, "r") as profileFile:
+            for line in profileFile:
+                stack, count = line.rstrip("\n").rsplit(" ", 1)
+                merged[f"{processName};{stack}"] += int(count)
+
+    mergedPath = path.join(outputDir, MERGED_PROFILE_FILE)
+    with open(mergedPath, "w") as mergedFile:
+        for stack, count in merged.items():
+            mergedFile.write(f"{stack} {count}\n")
+    return mergedPath
+
+
+def _owns_profiler():
+    return _profiler is not None and _profiler.pid == os.getpid()
+
+
+def _on_sigusr1(signum, frame):
+    # Children have their own handlers, so one signal to the main process
+    # snapshots the whole pipeline
+    for child in active_children():
+        os.kill(child.pid, signal.SIGUSR1)
+    if not _owns_profiler():
+        return
+    profilePath = _profiler.write()
+    print(f"Wrote profile to {profilePath}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "merge":
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} merge <profile dir>")
+        exit(1)
+
+    print(f"Wrote merged profile to {merge_profiles(sys.argv[2])}")
@@ -0,0 +1,150 @@
+from flight_recorder import DUMP_MAGIC, parse_flight_recording
+from time import monotonic, sleep
+from types import SimpleNamespace
+from v4l2py import raw
+import mmap
+import numpy as np
+import sys
+
+JPEG_SOI = b"\xff\xd8\xff"
+DEFAULT_RECORDED_FPS = 30
+
+class RecordedFrame:
+    """
+    The parts of a v4l2py Frame that ImageController uses.
+    """
+    # Like UVC cameras, frames are timestamped with the monotonic clock
+    buff = SimpleNamespace(flags=raw.V4L2_BUF_FLAG_TIMESTAMP_MONOTONIC)
+
+    def __init__(self, frameNb, timestamp, data):
+        self.frame_nb = frameNb
+        self.timestamp = timestamp
+        self._data = data
+
+
+    def __bytes__(self):
+        return self._data
+
+
+class RecordedCamera:
+    """
+    Stands in for a v4l2py Device by looping over a recorded MJPEG stream:
+    JPEG frames stored back to back, as written by "ffmpeg -f mjpeg" or by
+    running this module. Frames are streamed at the frame rate set with
+    set_fps(). If the reader falls behind, frames are skipped rather than
+    sent in a burst, like a camera would.
+
+    A flight recording can be streamed too, in which case its frames come at
+    the intervals they were captured at, to replay a stutter.
+    """
+    def __init__(self, recordingPath):
+        self._recordingPath = recordingPath
+        self._fps = DEFAULT_RECORDED_FPS
+        self._file = None
+        self._data = None
+        self._frameOffsets = None
+        # Time from each frame to the next, if recorded
+        self._frameIntervals = None
+
+
+    def open(self):
+        self._file = open(self._recordingPath, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(DUMP_MAGIC)] == DUMP_MAGIC:
+            self._open_flight_recording()
+            return
+
+        starts = []
+        start = self._data.find(JPEG_SOI)
+        while start != -1:
+            starts.append(start)
+            start = self._data.find(JPEG_SOI, start + 1)
+        if len(starts) == 0:
+            print(f"ERROR: {self._recordingPath} holds no JPEG frames.")
+            exit(1)
+        self._frameOffsets = list(zip(starts, starts[1:] + [len(self._data)]))
+
+
+    def _open_flight_recording(self):
+        _, frames, _, dataOffset = parse_flight_recording(self._data,
+                                                          self._recordingPath)
+        if len(frames) == 0:
+            print(f"ERROR: {self._recordingPath} holds no frames.")
+            exit(1)
+        starts = dataOffset + frames["offset"]
+        self._frameOffsets = list(zip(starts.tolist(),
+                                      (starts + frames["length"]).tolist()))
+        # The last frame is followed by the first one at the set frame rate
+        self._frameIntervals = np.diff(frames["capture_time"]).tolist()
+
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._file.close()
+        self._data = None
+        self._file = None
+
+
+    def set_format(self, bufferType, width, height, pixelFormat):
+        # The recorded frames keep the size they were recorded at
+        pass
+
+
+    def set_fps(self, bufferType, fps):
+        self._fps = fps
+
+
+    def __iter__(self):
+        frameNb = 0
+        nextFrameTime = monotonic()
+        while True:
+            now = monotonic()
+            if now < nextFrameTime:
+                sleep(nextFrameTime - now)
+            else:
+                nextFrameTime = now
+
+            start, end = self._frameOffsets[frameNb % len(self._frameOffsets)]
+            yield RecordedFrame(frameNb, monotonic(), self._data[start:end])
+            nextFrameTime += self._frame_interval(frameNb)
+            frameNb += 1
+
+
+    def _frame_interval(self, frameNb):
+        idx = frameNb % len(self._frameOffsets)
+        if self._frameIntervals is None or idx == len(self._frameIntervals):
+            return 1 / self._fps
+        return self._frameIntervals[idx]
+
+
+def record(devicePath, resolution, durationS, recordingPath):
+    """
+    Writes durationS seconds of a camera's MJPEG stream to recordingPath.
+    """
+    from v4l2py import Device
+    from v4l2py.device import BufferType
+
+    numFrames = 0
+    with Device(devicePath) as cam, open(recordingPath, "wb") as recording:
+        cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1],
+                       "MJPG")
+        startTime = monotonic()
+        for frame in cam:
+            recording.write(bytes(frame))
+            numFrames += 1
+            if monotonic() - startTime >= durationS:
+                break
+    return numFrames
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 6:
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} <v4l2 device> <width> <height> "
+              "<seconds> <output file>")
+        exit(1)
+
+    numFrames = record(sys.argv[1], (int(sys.argv[2]), int(sys.argv[3])),
+                       float(sys.argv[4]), sys.argv[5])
+    print(f"Wrote {numFrames} frames to {sys.argv[5]}")
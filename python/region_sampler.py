@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+
+DEFAULT_INSET_DEPTH_PX = 32
+DEFAULT_EDGE_OFFSET_PX = 0
+
+class RegionSampler:
+    """
+    Averages one region per LED, reaching inwards from the calibrated screen
+    edge.
+
+    Regions are axis aligned rectangles. Along the edge, each region spans
+    halfway to its neighbouring sample points. Across the edge, it starts
+    edgeOffset pixels outside the sample point and ends insetDepth pixels
+    inside it. Because every region follows its own sample point, the regions
+    of one side trace the curvature of the edge.
+
+    Every frame, an integral image is built over the bounding box of each
+    side's regions only, so each region costs four lookups regardless of its
+    size.
+    """
+    def __init__(self, samplePoints, frameShape,
+                 insetDepth=DEFAULT_INSET_DEPTH_PX,
+                 edgeOffset=DEFAULT_EDGE_OFFSET_PX):
+        height, width = frameShape[:2]
+        self._sides = {}
+        for side, points in samplePoints.items():
+            points = np.array(points, dtype=np.int32).reshape(-1, 2)
+            rects = _side_rects(side, points, insetDepth, edgeOffset)
+            # Clip to the frame, but never let a region collapse to nothing
+            rects[:, 0] = np.clip(rects[:, 0], 0, height - 1)
+            rects[:, 1] = np.clip(rects[:, 1], rects[:, 0] + 1, height)
+            rects[:, 2] = np.clip(rects[:, 2], 0, width - 1)
+            rects[:, 3] = np.clip(rects[:, 3], rects[:, 2] + 1, width)
+
+            rowStart, rowEnd = rects[:, 0].min(), rects[:, 1].max()
+            colStart, colEnd = rects[:, 2].min(), rects[:, 3].max()
+            top = rects[:, 0] - rowStart
+            bottom = rects[:, 1] - rowStart
+            left = rects[:, 2] - colStart
+            right = rects[:, 3] - colStart
+            areas = ((bottom - top) * (right - left)).astype(np.float32)
+
+            self._sides[side] = (
+                (slice(rowStart, rowEnd), slice(colStart, colEnd)),
+                (bottom, right), (top, right), (bottom, left), (top, left),
+                areas[:, np.newaxis]
+            )
+
+
+    def sample(self, frame):
+        colors = {}
+        for side, (strip, br, tr, bl, tl, areas) in self._sides.items():
+            integral = cv2.integral(frame[strip], sdepth=cv2.CV_32S)
+            sums = integral[br] - integral[tr] - integral[bl] + integral[tl]
+            colors[side] = np.rint(sums / areas).astype(np.uint8)
+
+        return colors
+
+
+def _side_rects(side, points, insetDepth, edgeOffset):
+    """
+    Returns an (N, 4) array of [rowStart, rowEnd, colStart, colEnd] for the
+    sample points of a side.
+    """
+    horizontal = side in ("top", "bottom")
+    along = points[:, 0] if horizontal else points[:, 1]
+    across = points[:, 1] if horizontal else points[:, 0]
+
+    bounds = _midpoints(along)
+    alongStart = bounds[:-1]
+    alongEnd = np.maximum(bounds[1:], alongStart + 1)
+
+    if side in ("top", "left"):
+        acrossStart = across - edgeOffset
+        acrossEnd = across + insetDepth + 1
+    else:
+        acrossStart = across - insetDepth
+        acrossEnd = across + edgeOffset + 1
+
+    if horizontal:
+        return np.stack([acrossStart, acrossEnd, alongStart, alongEnd], axis=1)
+    return np.stack([alongStart, alongEnd, acrossStart, acrossEnd], axis=1)
+
+
+def _midpoints(along):
+    """
+    Returns N + 1 boundaries halfway between consecutive points, with the
+    outer boundaries mirrored around the first and last point.
+    """
+    along = along.astype(np.int32)
+    if len(along) == 1:
+        return np.array([along[0], along[0] + 1])
+
+    mids = (along[:-1] + along[1:]) // 2
+    first = along[0] - (mids[0] - along[0])
+    last = along[-1] + (along[-1] - mids[-1])
+    return np.concatenate([[first], mids, [last]])
@@ -0,0 +1,92 @@
+from color_recording import read_recording, RECORDING_SIDES
+from flight_recorder import is_flight_recording, read_flight_colors
+from led_controller import LEDInterface
+from metrics import MetricsRegistry
+from time import perf_counter, sleep
+import argparse
+import numpy as np
+import user_pref
+
+LED_STARTUP_TIMEOUT_S = 10
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+            description="Stream a color recording made with "
+                        "main.py --record, or the colors of a flight "
+                        "recording, to the LEDs, without the camera")
+    parser.add_argument("recording")
+    parser.add_argument("--fast", action="store_true",
+                        help="Send every frame as soon as the LED controller "
+                             "has taken the previous one, instead of at the "
+                             "recorded rate")
+    parser.add_argument("--loops", type=int, default=1,
+                        help="Number of times to play the recording")
+    return parser.parse_args()
+
+
+def replay(recordingPath, ledInterface, fast=False, loops=1):
+    """
+    Sends every recorded frame to the LED interface and returns the number
+    of frames sent and the time it took.
+    """
+    if is_flight_recording(recordingPath):
+        counts, records = read_flight_colors(recordingPath)
+    else:
+        counts, records = read_recording(recordingPath)
+    ledCounts = user_pref.read_led_counts()
+    if any(counts[side] != ledCounts[side] for side in RECORDING_SIDES):
+        print(f"ERROR: {recordingPath} was recorded with LED counts "
+              f"{counts}, but led.json has {ledCounts}.")
+        exit(1)
+    if len(records) == 0:
+        print(f"ERROR: {recordingPath} has no frames.")
+        exit(1)
+
+    # Wait for the LED controller to start before timing anything
+    ledInterface.update_and_get_power_state()
+    ledInterface.set_colors(_record_colors(records[0]))
+    ledInterface.wait_until_colors_read(LED_STARTUP_TIMEOUT_S)
+
+    timestamps = records["timestamp"] - records["timestamp"][0]
+    numFrames = 0
+    startTime = perf_counter()
+    for _ in range(loops):
+        loopStartTime = perf_counter()
+        for frameNb, record in enumerate(records):
+            if fast:
+                # Only as fast as the LED controller takes frames, so the
+                # rate measures the LED path rather than dropped frames
+                ledInterface.wait_until_colors_read()
+            else:
+                sleep(max(0, loopStartTime + timestamps[frameNb] \
+                                - perf_counter()))
+            ledInterface.update_and_get_power_state()
+            ledInterface.set_colors(_record_colors(record), frameNb)
+            numFrames += 1
+
+    return (numFrames, perf_counter() - startTime)
+
+
+def _record_colors(record):
+    # Copied out of the memory map so they pickle as plain arrays
+    return {side: np.array(record[side]) for side in RECORDING_SIDES}
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    metricsRegistry = MetricsRegistry()
+    with LEDInterface(metricsRegistry=metricsRegistry) as ledInterface:
+        numFrames, elapsed = replay(args.recording, ledInterface, args.fast,
+                                    args.loops)
+        # Let the LED controller finish the last transition
+        sleep(0.5)
+
+    print(f"Replayed {numFrames} frames in {elapsed:.2f}s "
+          f"({numFrames / elapsed:.1f} fps)")
+    received = metricsRegistry.sample_value(
+            "backlight_led_colors_received_total")
+    dropped = metricsRegistry.sample_value("backlight_led_colors_dropped_total")
+    written = metricsRegistry.sample_value("backlight_led_frames_total")
+    print(f"LED controller received {received:.0f} frames "
+          f"({dropped:.0f} dropped) and wrote {written:.0f} frames to the "
+          f"strips ({written / elapsed:.1f} fps)")
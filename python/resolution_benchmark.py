@@ -0,0 +1,215 @@
+from frame_capture import capture_settled_frame
+from pooled_decoder import PooledTurboJPEG
+from region_sampler import RegionSampler
+from time import perf_counter
+from turbojpeg import TJFLAG_FASTDCT, TJFLAG_FASTUPSAMPLE, TJPF_RGB
+from v4l2py.device import BufferType, PixelFormat
+import numpy as np
+import sys
+import user_pref
+import v4l2py
+
+BENCHMARK_DURATION_S = 3
+BENCHMARK_FPS = 30
+# Only this many of the captured frames are decoded and sampled, the rest
+# only count towards the capture fps
+MAX_TIMED_FRAMES = 30
+# Frames dropped after changing the format, while the camera starts streaming
+WARMUP_FRAMES = 5
+# Largest mean absolute difference (0-255) of the sampled colors against the
+# highest resolution for a resolution to be recommended
+DEFAULT_COLOR_ERROR_THRESHOLD = 4.0
+# A typical setup: LED counts and a screen inset by a margin of the frame.
+# Regions are relative to the frame so every resolution samples the same
+# parts of the screen.
+BENCHMARK_LED_COUNTS = {"top": 32, "bottom": 32, "left": 18, "right": 18}
+BENCHMARK_SCREEN_MARGIN = 0.1
+BENCHMARK_INSET_DEPTH = 0.05
+
+def get_mjpeg_resolutions(cam):
+    """
+    Returns the MJPEG resolutions of an open camera, largest first. Other
+    formats are skipped since the pipeline only decodes MJPEG.
+    """
+    resolutions = set()
+    for frameSize in cam.info.frame_sizes:
+        if frameSize.pixel_format != PixelFormat.MJPEG:
+            continue
+        resolutions.add((frameSize.width, frameSize.height))
+    return sorted(resolutions, key=lambda r: r[0] * r[1], reverse=True)
+
+
+def benchmark_sample_points(resolution, counts=BENCHMARK_LED_COUNTS):
+    width, height = resolution
+    left, right = width * BENCHMARK_SCREEN_MARGIN, \
+                  width * (1 - BENCHMARK_SCREEN_MARGIN)
+    top, bottom = height * BENCHMARK_SCREEN_MARGIN, \
+                  height * (1 - BENCHMARK_SCREEN_MARGIN)
+    return {
+        "top": [[x, top] for x in np.linspace(left, right, counts["top"])],
+        "bottom": [[x, bottom] \
+                      for x in np.linspace(left, right, counts["bottom"])],
+        "left": [[left, y] for y in np.linspace(top, bottom, counts["left"])],
+        "right": [[right, y] \
+                     for y in np.linspace(top, bottom, counts["right"])],
+    }
+
+
+def benchmark_resolution(cam, resolution, jpegDecoder,
+                         durationS=BENCHMARK_DURATION_S):
+    """
+    Streams durationS seconds at the given resolution and returns the capture
+    fps, the median decode and sampling times in milliseconds and the colors
+    sampled from a settled frame.
+
+    Frames are only collected while streaming and decoded afterwards, so slow
+    decoding doesn't lower the measured capture fps.
+    """
+    cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1],
+                   "MJPG")
+    try:
+        cam.set_fps(BufferType.VIDEO_CAPTURE, BENCHMARK_FPS)
+    except OSError:
+        print(f"WARN: Could not set {BENCHMARK_FPS} fps at {resolution}.")
+
+    sampler = RegionSampler(
+            benchmark_sample_points(resolution), (resolution[1], resolution[0]),
+            insetDepth=int(resolution[1] * BENCHMARK_INSET_DEPTH))
+    # Not the pooled decoder, since the median frames must all stay alive
+    settledFrame = capture_settled_frame(cam, numMedianFrames=3,
+                                         pixelFormat=TJPF_RGB)
+    colors = sampler.sample(settledFrame)
+
+    jpegs = []
+    arrivalTimes = []
+    numFrames = 0
+    startTime = None
+    for frame in cam:
+        numFrames += 1
+        if numFrames <= WARMUP_FRAMES:
+            continue
+        now = perf_counter()
+        if startTime is None:
+            startTime = now
+        arrivalTimes.append(now)
+        if len(jpegs) < MAX_TIMED_FRAMES:
+            jpegs.append(bytes(frame))
+        if now - startTime >= durationS:
+            break
+
+    decodeTimes = []
+    sampleTimes = []
+    for jpeg in jpegs:
+        decodeStart = perf_counter()
+        try:
+            rgbFrame = jpegDecoder.decode(jpeg, pixel_format=TJPF_RGB,
+                                          flags=TJFLAG_FASTUPSAMPLE|TJFLAG_FASTDCT)
+        except OSError:
+            continue
+        sampleStart = perf_counter()
+        sampler.sample(rgbFrame)
+        sampleEnd = perf_counter()
+        decodeTimes.append(sampleStart - decodeStart)
+        sampleTimes.append(sampleEnd - sampleStart)
+
+    if len(decodeTimes) == 0:
+        print(f"WARN: No frame could be decoded at {resolution}.")
+        return None
+
+    captureTime = arrivalTimes[-1] - arrivalTimes[0]
+    return {
+        "resolution": list(resolution),
+        "capture_fps": (len(arrivalTimes) - 1) / captureTime \
+                            if captureTime > 0 else 0,
+        "decode_ms": float(np.median(decodeTimes)) * 1000,
+        "sample_ms": float(np.median(sampleTimes)) * 1000,
+        "colors": colors,
+    }
+
+
+def color_error(colors, referenceColors):
+    """
+    Mean absolute difference of all LED channels, from 0 to 255.
+    """
+    return float(np.mean([
+        np.abs(colors[side].astype(np.int16) - referenceColors[side]).mean() \
+            for side in referenceColors
+    ]))
+
+
+def run_benchmark(devicePath, threshold=DEFAULT_COLOR_ERROR_THRESHOLD):
+    """
+    Benchmarks every MJPEG resolution of a camera and returns the results
+    ranked by the time to decode and sample a frame, along with the
+    recommended resolution: the lowest one whose color error against the
+    highest resolution is at most threshold.
+    """
+    jpegDecoder = PooledTurboJPEG()
+    results = []
+    with v4l2py.Device(devicePath) as cam:
+        resolutions = get_mjpeg_resolutions(cam)
+        if len(resolutions) == 0:
+            print(f"ERROR: No valid MJPEG resolutions found for device: "
+                  f"{devicePath}. Please select another device and try again.")
+            exit(1)
+
+        for resolution in resolutions:
+            print(f"Benchmarking {resolution}...")
+            result = benchmark_resolution(cam, resolution, jpegDecoder)
+            if result is not None:
+                results.append(result)
+    jpegDecoder.close()
+
+    if len(results) == 0:
+        print(f"ERROR: Could not benchmark any resolution of {devicePath}.")
+        exit(1)
+
+    # Results are still ordered from the highest resolution
+    referenceColors = results[0]["colors"]
+    recommended = results[0]["resolution"]
+    for result in results:
+        result["color_error"] = color_error(result.pop("colors"),
+                                            referenceColors)
+        if result["color_error"] <= threshold:
+            recommended = result["resolution"]
+
+    results.sort(key=lambda r: r["decode_ms"] + r["sample_ms"])
+    return {
+        "device": devicePath,
+        "color_error_threshold": threshold,
+        "recommended": recommended,
+        "results": results,
+    }
+
+
+def print_benchmark(benchmark):
+    print()
+    print(f"{'':3}{'resolution':>14}{'capture fps':>13}{'decode ms':>11}"
+          f"{'sample ms':>11}{'max fps':>9}{'color error':>13}")
+    for idx, result in enumerate(benchmark["results"]):
+        resolution = "x".join(str(v) for v in result["resolution"])
+        frameMs = result["decode_ms"] + result["sample_ms"]
+        marker = "*" if result["resolution"] == benchmark["recommended"] \
+                    else " "
+        print(f"{idx + 1:>2}{marker}{resolution:>14}"
+              f"{result['capture_fps']:>13.1f}{result['decode_ms']:>11.2f}"
+              f"{result['sample_ms']:>11.2f}{1000 / frameMs:>9.0f}"
+              f"{result['color_error']:>13.2f}")
+    print()
+    print(f"Recommended: {tuple(benchmark['recommended'])}, the lowest "
+          f"resolution with a color error of at most "
+          f"{benchmark['color_error_threshold']}.")
+    print()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} <v4l2 device> [color error threshold]")
+        exit(1)
+
+    threshold = float(sys.argv[2]) if len(sys.argv) == 3 \
+                    else DEFAULT_COLOR_ERROR_THRESHOLD
+    benchmark = run_benchmark(sys.argv[1], threshold)
+    print_benchmark(benchmark)
+    print(f"Wrote {user_pref.write_resolution_benchmark(benchmark)}")
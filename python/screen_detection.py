@@ -0,0 +1,172 @@
+import cv2
+import numpy as np
+
+DETECTION_MAX_DIMENSION = 640
+DETECTION_BLUR_SIZE = 5
+DETECTION_CLOSE_SIZE = 7
+MIN_SCREEN_AREA_FRACTION = 0.02
+MIN_SCREEN_CONTRAST = 40
+EDGE_FIT_DEGREE = 2
+# Share of each end of an edge left out of its fit
+EDGE_TRIM_FRACTION = 0.05
+CORNER_ITERATIONS = 10
+CORNER_EDGES = {
+    "tl": ("top", "left"), "tr": ("top", "right"),
+    "bl": ("bottom", "left"), "br": ("bottom", "right"),
+}
+DEFAULT_POINTS_PER_SIDE = 5
+DEFAULT_INSET_PX = 10
+
+def detect_screen_control_points(frame, pointsPerSide=DEFAULT_POINTS_PER_SIDE,
+                                 inset=DEFAULT_INSET_PX):
+    """
+    Finds the bright screen in a BGR calibration frame and returns control
+    points in the same format as user_pref.read_calibration_data, or None if
+    no screen could be found.
+
+    The frame is downscaled before thresholding so detection stays cheap on a
+    Pi. Each edge is fit with a low order polynomial over the contour points
+    that belong to it, so the barrel/pincushion curvature introduced by the
+    camera lens is preserved. All control points are pulled `inset` pixels
+    towards the center of the screen.
+    """
+    height, width = frame.shape[:2]
+    scale = min(1, DETECTION_MAX_DIMENSION / max(height, width))
+    small = cv2.resize(frame, None, fx=scale, fy=scale,
+                       interpolation=cv2.INTER_AREA)
+    gray = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    gray = cv2.GaussianBlur(gray, (DETECTION_BLUR_SIZE, DETECTION_BLUR_SIZE), 0)
+
+    threshold, mask = cv2.threshold(gray, 0, 255,
+                                    cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Otsu splits any frame in two, even one without a screen
+    if gray[gray > threshold].mean() - gray[gray <= threshold].mean() \
+            < MIN_SCREEN_CONTRAST:
+        return None
+    kernel = np.ones((DETECTION_CLOSE_SIZE, DETECTION_CLOSE_SIZE), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL,
+                                   cv2.CHAIN_APPROX_NONE)
+    if len(contours) == 0:
+        return None
+
+    contour = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(contour) < MIN_SCREEN_AREA_FRACTION * mask.size:
+        return None
+
+    # Contour points are the centers of the outermost screen pixels
+    points = (contour.reshape(-1, 2).astype(np.float64) + 0.5) / scale - 0.5
+    roughCorners = _find_corners(points)
+    fits = _fit_edges(_split_contour_by_side(points, roughCorners),
+                      roughCorners)
+    # The blur rounds the corners of the contour, so the corners are where
+    # the fitted edges meet
+    corners = {
+        corner: _intersect_edges(fits[horizontal], fits[vertical],
+                                 roughCorners[corner]) \
+            for corner, (horizontal, vertical) in CORNER_EDGES.items()
+    }
+
+    return {
+        "top": _sample_horizontal_edge(fits["top"], corners["tl"],
+                                       corners["tr"], pointsPerSide, inset),
+        "bottom": _sample_horizontal_edge(fits["bottom"], corners["bl"],
+                                          corners["br"], pointsPerSide,
+                                          -inset),
+        "left": _sample_vertical_edge(fits["left"], corners["tl"],
+                                      corners["bl"], pointsPerSide, inset),
+        "right": _sample_vertical_edge(fits["right"], corners["tr"],
+                                       corners["br"], pointsPerSide, -inset),
+    }
+
+
+def _find_corners(points):
+    sums = points[:, 0] + points[:, 1]
+    diffs = points[:, 0] - points[:, 1]
+    return {
+        "tl": points[np.argmin(sums)],
+        "br": points[np.argmax(sums)],
+        "tr": points[np.argmax(diffs)],
+        "bl": points[np.argmin(diffs)],
+    }
+
+
+def _split_contour_by_side(points, corners):
+    """
+    Assigns every contour point to the closest of the four lines joining the
+    corners.
+    """
+    lines = {
+        "top": (corners["tl"], corners["tr"]),
+        "right": (corners["tr"], corners["br"]),
+        "bottom": (corners["bl"], corners["br"]),
+        "left": (corners["tl"], corners["bl"]),
+    }
+    names = list(lines.keys())
+    distances = np.empty((len(names), len(points)))
+    for idx, name in enumerate(names):
+        start, end = lines[name]
+        direction = end - start
+        length = np.hypot(direction[0], direction[1])
+        if length == 0:
+            distances[idx] = np.inf
+            continue
+        offsets = points - start
+        distances[idx] = np.abs(direction[0] * offsets[:, 1]
+                                - direction[1] * offsets[:, 0]) / length
+
+    closest = np.argmin(distances, axis=0)
+    return {name: points[closest == idx] for idx, name in enumerate(names)}
+
+
+def _fit_edges(sides, corners):
+    """
+    Fits the top and bottom edges as y(x) and the left and right edges as
+    x(y), leaving out the rounded ends of every edge.
+    """
+    ends = {
+        "top": ("tl", "tr", 0), "bottom": ("bl", "br", 0),
+        "left": ("tl", "bl", 1), "right": ("tr", "br", 1),
+    }
+    fits = {}
+    for side, (startCorner, endCorner, axis) in ends.items():
+        start, end = corners[startCorner][axis], corners[endCorner][axis]
+        trim = (end - start) * EDGE_TRIM_FRACTION
+        edgePoints = sides[side]
+        inRange = (edgePoints[:, axis] >= start + trim) \
+                    & (edgePoints[:, axis] <= end - trim)
+        edgePoints = edgePoints[inRange]
+        if len(edgePoints) <= EDGE_FIT_DEGREE:
+            edgePoints = np.array([corners[startCorner], corners[endCorner]])
+            degree = 1
+        else:
+            degree = EDGE_FIT_DEGREE
+        fits[side] = np.polyfit(edgePoints[:, axis], edgePoints[:, 1 - axis],
+                                degree)
+    return fits
+
+
+def _intersect_edges(horizontalFit, verticalFit, corner):
+    # Screen edges are far from parallel, so this converges in a few steps
+    x, y = corner
+    for _ in range(CORNER_ITERATIONS):
+        y = np.polyval(horizontalFit, x)
+        x = np.polyval(verticalFit, y)
+    return np.array([x, y])
+
+
+def _sample_horizontal_edge(fit, start, end, numPoints, inset):
+    xs = np.rint(np.linspace(start[0] + abs(inset), end[0] - abs(inset),
+                             numPoints)).astype(np.int32)
+    xs = np.unique(xs)
+    ys = np.rint(np.polyval(fit, xs) + inset).astype(np.int32)
+    return [(int(x), int(y)) for x, y in zip(xs, ys)]
+
+
+def _sample_vertical_edge(fit, start, end, numPoints, inset):
+    ys = np.rint(np.linspace(start[1] + abs(inset), end[1] - abs(inset),
+                             numPoints)).astype(np.int32)
+    ys = np.unique(ys)
+    xs = np.rint(np.polyval(fit, ys) + inset).astype(np.int32)
+    return [(int(x), int(y)) for x, y in zip(xs, ys)]
@@ -1,8 +1,10 @@
 from datetime import datetime
+from frame_capture import capture_settled_frame
 from os import path, mkdir
-from v4l2py.device import PixelFormat
+from v4l2py.device import BufferType, PixelFormat
 import cv2
 import re
+import resolution_benchmark
 import user_pref
 import v4l2py
 
@@ -72,7 +74,29 @@ def save_chosen_device(device):
     print()
 
 
-def choose_resolution(devicePath):
+def run_resolution_benchmark(devicePath):
+    """
+    Optionally benchmarks every resolution of the device and returns the
+    recommended one, or None if the user skips the benchmark.
+    """
+    inp = input("Benchmark every resolution to find the cheapest one that "
+                "keeps the colors accurate? This takes a few seconds per "
+                "resolution. [y/N]: ")
+    if inp.strip().lower() not in ("y", "yes"):
+        print()
+        return None
+
+    print("Show a still, colorful image on the screen until the benchmark "
+          "finishes.")
+    benchmark = resolution_benchmark.run_benchmark(devicePath)
+    resolution_benchmark.print_benchmark(benchmark)
+    print(f"Writing benchmark to "
+          f"{user_pref.write_resolution_benchmark(benchmark)}")
+    print()
+    return tuple(benchmark["recommended"])
+
+
+def choose_resolution(devicePath, recommended=None):
     availableResolutions = set()
     with v4l2py.Device(devicePath) as cam:
         for frameSize in cam.info.frame_sizes:
@@ -90,12 +114,25 @@ def choose_resolution(devicePath):
     print("Found the following resolutions:")
     availableResolutions = sorted(availableResolutions)
     availableResolutions = availableResolutions[::-1]
+    defaultInp = None
     for idx, resolution in enumerate(availableResolutions):
-        print(f"    [{idx + 1}] : {resolution}")
+        if resolution == recommended:
+            defaultInp = idx + 1
+            print(f"    [{idx + 1}] : {resolution}  (recommended)")
+        else:
+            print(f"    [{idx + 1}] : {resolution}")
 
     inp = 0
     while inp <= 0 or inp > len(availableResolutions):
-        inp = input(f"Choose a resolution[1..{len(availableResolutions)}]: ")
+        if defaultInp is None:
+            inp = input(f"Choose a resolution"
+                        f"[1..{len(availableResolutions)}]: ")
+        else:
+            inp = input(f"Choose a resolution"
+                        f"[1..{len(availableResolutions)}, "
+                        f"default {defaultInp}]: ")
+            if inp.strip() == "":
+                inp = defaultInp
         inp = int(inp)
 
     choiceIdx = inp - 1
@@ -118,23 +155,19 @@ def save_chosen_resolution(resolution):
 
 
 def draw_one_frame_from_device(devicePath, resolution):
-    cam = cv2.VideoCapture(devicePath, cv2.CAP_V4L2)
-    if not cam.isOpened():
+    try:
+        cam = v4l2py.Device(devicePath)
+        cam.open()
+    except OSError:
         print(f"ERROR: Could not open {devicePath} to capture images. "
               "Please choose another device and try again.")
         exit(1)
 
-    cam.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))
-    cam.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
-    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
-
-    print("Capturing 10 frames to let camera settle.")
-    for i in range(1, 10):
-        ret, frame = cam.read()
-        if not ret:
-            print(f"ERROR: Failed to get image from {devicePath}. "
-                "Please choose another device and try again.")
-            exit(1)
+    with cam:
+        cam.set_format(BufferType.VIDEO_CAPTURE, resolution[0], resolution[1],
+                       "MJPG")
+        print("Streaming frames until the camera settles.")
+        frame = capture_settled_frame(cam)
 
     currTime = datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%f")
     imageFileName = f"capture-{currTime}.png"
@@ -142,8 +175,6 @@ def draw_one_frame_from_device(devicePath, resolution):
     cv2.imwrite(imageFilePath, frame)
     print(f"Wrote file {imageFilePath}")
 
-    cam.release()
-
 
 if __name__ == "__main__":
     connectedDevices = get_connected_devices()
@@ -153,7 +184,8 @@ if __name__ == "__main__":
     devicePath = chosenDevice[0]
 
     # resolution = (1920, 1080)
-    resolution = choose_resolution(devicePath)
+    recommended = run_resolution_benchmark(devicePath)
+    resolution = choose_resolution(devicePath, recommended)
     save_chosen_resolution(resolution)
 
     draw_one_frame_from_device(devicePath, resolution)
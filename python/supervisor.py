@@ -0,0 +1,97 @@
+from multiprocessing.sharedctypes import RawValue
+from time import monotonic
+
+DEFAULT_SUPERVISOR_PREFS = {
+    "capture_timeout_s": 2,
+    "led_timeout_s": 5,
+    "worker_timeout_s": 10,
+    "reopen_min_backoff_s": 0.1,
+    "reopen_max_backoff_s": 5,
+    "max_decoder_restarts": 3,
+}
+RECOVERY_BUCKETS_S = (0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+class Heartbeat:
+    """
+    The last time, on the monotonic() clock, a stage showed it was alive.
+    Kept in shared memory, so a stage in another process can be checked too.
+    Like metrics, it must be created before the process beating it is
+    started.
+    """
+    def __init__(self):
+        self._time = RawValue("d", monotonic())
+
+
+    def beat(self):
+        self._time.value = monotonic()
+
+
+    def time(self):
+        return self._time.value
+
+
+    def age(self):
+        return monotonic() - self._time.value
+
+
+class Backoff:
+    """
+    Exponentially growing delays between retries, from minS up to maxS.
+    """
+    def __init__(self, minS, maxS):
+        self._minS = minS
+        self._maxS = maxS
+        self._delayS = minS
+
+
+    def next_delay(self):
+        delayS = self._delayS
+        self._delayS = min(self._delayS * 2, self._maxS)
+        return delayS
+
+
+    def reset(self):
+        self._delayS = self._minS
+
+
+class StageRecovery:
+    """
+    Counts the restarts of one pipeline stage and measures how long each one
+    took, from when the failure was noticed until the stage worked again.
+    """
+    def __init__(self, metricsRegistry, stage, labels=None):
+        self._stage = stage
+        labels = {"stage": stage, **(labels or {})}
+        self._restartsMetric = metricsRegistry.counter(
+                "backlight_stage_restarts",
+                "Times a failed pipeline stage was restarted", labels=labels)
+        self._recoveryTimeMetric = metricsRegistry.histogram(
+                "backlight_stage_recovery_seconds",
+                "Time from noticing a failed stage until it worked again",
+                labels=labels, buckets=RECOVERY_BUCKETS_S)
+        self._failedTime = None
+
+
+    def failed(self, reason):
+        """
+        Records a failure, unless the stage is already recovering from one.
+        """
+        if self._failedTime is not None:
+            return
+        print(f"WARN: {self._stage} failed: {reason}. Restarting it.")
+        self._failedTime = monotonic()
+        self._restartsMetric.inc()
+
+
+    def recovering(self):
+        return self._failedTime is not None
+
+
+    def recovered(self, recoveredTime=None):
+        if self._failedTime is None:
+            return
+        recoveryTime = (recoveredTime or monotonic()) - self._failedTime
+        self._recoveryTimeMetric.observe(recoveryTime)
+        print(f"{self._stage} recovered in {recoveryTime:.2f}s")
+        self._failedTime = None
+
@@ -0,0 +1,173 @@
+from led_discovery import DISCOVERY_EDGE_OFFSET_PX, build_gray_code_patterns, \
+    decode_led_indices, discover_led_layout, discovery_sample_points, \
+    infer_led_layout
+from pooled_decoder import PooledTurboJPEG
+import cv2
+import numpy as np
+import pytest
+
+RESOLUTION = (640, 480)
+# Left, top, right and bottom edges of the screen
+SCREEN = (80, 60, 560, 420)
+CONTROL_POINTS = {
+    "top": [(80, 60), (320, 60), (560, 60)],
+    "bottom": [(80, 420), (320, 420), (560, 420)],
+    "left": [(80, 60), (80, 240), (80, 420)],
+    "right": [(560, 60), (560, 240), (560, 420)],
+}
+# Half the width of the glow of the LEDs, centered on the sample points
+GLOW_HALF_WIDTH_PX = 8
+ROOM_LEVEL = 20
+GLOW_LEVEL = 140
+
+LAYOUTS = {
+    # Clockwise from the bottom left corner
+    "clockwise": {
+        "order": ["left", "top", "right", "bottom"],
+        "orientation": {"left": False, "top": True, "right": True,
+                        "bottom": False},
+        "counts": {"left": 24, "top": 40, "right": 24, "bottom": 40},
+    },
+    # Counterclockwise from the bottom left corner, with uneven sides
+    "counterclockwise": {
+        "order": ["bottom", "right", "top", "left"],
+        "orientation": {"bottom": True, "right": False, "top": False,
+                        "left": True},
+        "counts": {"bottom": 50, "right": 30, "top": 46, "left": 28},
+    },
+    # Clockwise from the top right corner
+    "from_top_right": {
+        "order": ["right", "bottom", "left", "top"],
+        "orientation": {"right": True, "bottom": False, "left": False,
+                        "top": True},
+        "counts": {"right": 36, "bottom": 60, "left": 36, "top": 60},
+    },
+}
+
+def _led_boxes(layout):
+    """
+    Returns the (x0, y0, x1, y1) box lit by every LED, by its index on the
+    strip, just outside the screen edge it is behind.
+    """
+    left, top, right, bottom = SCREEN
+    boxes = []
+    for side in layout["order"]:
+        count = layout["counts"][side]
+        if side in ("top", "bottom"):
+            bounds = np.linspace(left, right, count + 1)
+            y = top - DISCOVERY_EDGE_OFFSET_PX if side == "top" \
+                else bottom + DISCOVERY_EDGE_OFFSET_PX
+            sideBoxes = [(bounds[i], y - GLOW_HALF_WIDTH_PX, bounds[i + 1],
+                          y + GLOW_HALF_WIDTH_PX) for i in range(count)]
+        else:
+            bounds = np.linspace(top, bottom, count + 1)
+            x = left - DISCOVERY_EDGE_OFFSET_PX if side == "left" \
+                else right + DISCOVERY_EDGE_OFFSET_PX
+            sideBoxes = [(x - GLOW_HALF_WIDTH_PX, bounds[i],
+                          x + GLOW_HALF_WIDTH_PX, bounds[i + 1]) \
+                            for i in range(count)]
+        if not layout["orientation"][side]:
+            sideBoxes.reverse()
+        boxes += sideBoxes
+    return boxes
+
+
+def _render_leds(lit, boxes, glowLevel=GLOW_LEVEL):
+    """
+    Returns a grayscale frame of a dark room lit by the LEDs that are on.
+    """
+    frame = np.full((RESOLUTION[1], RESOLUTION[0]), ROOM_LEVEL, np.uint8)
+    for isLit, (x0, y0, x1, y1) in zip(lit, boxes):
+        if isLit:
+            frame[round(y0):round(y1), round(x0):round(x1)] = glowLevel
+    return frame
+
+
+def _decode_layout(layout, glowLevel=GLOW_LEVEL):
+    numLeds = sum(layout["counts"].values())
+    boxes = _led_boxes(layout)
+    render = lambda lit: _render_leds(lit, boxes, glowLevel)
+    offFrame = render(np.zeros(numLeds, dtype=bool))
+    onFrame = render(np.ones(numLeds, dtype=bool))
+    patternFrames = np.stack([render(pattern) for pattern \
+                                in build_gray_code_patterns(numLeds)])
+    decoded = decode_led_indices(offFrame, onFrame, patternFrames,
+                                 discovery_sample_points(CONTROL_POINTS))
+    return infer_led_layout(decoded, numLeds)
+
+
+class SimulatedStrip:
+    """
+    Stands in for a NeoPixel strip, keeping which LEDs were lit by the last
+    show().
+    """
+    def __init__(self, numLeds):
+        self._pixels = [(0, 0, 0)] * numLeds
+        self.lit = np.zeros(numLeds, dtype=bool)
+
+
+    def __setitem__(self, key, value):
+        self._pixels[key] = value
+
+
+    def fill(self, color):
+        self._pixels = [color] * len(self._pixels)
+
+
+    def show(self):
+        self.lit = np.array([any(pixel) for pixel in self._pixels])
+
+
+def _simulated_camera(strip, boxes):
+    """
+    Streams JPEG frames of whatever the strip shows.
+    """
+    while True:
+        yield cv2.imencode(".jpg", _render_leds(strip.lit, boxes))[1] \
+                .tobytes()
+
+
+@pytest.mark.parametrize("numLeds", [1, 2, 7, 128, 300])
+def test_gray_codes_are_unique_and_change_one_bit_at_a_time(numLeds):
+    patterns = build_gray_code_patterns(numLeds)
+
+    codes = [tuple(column) for column in patterns.T]
+    assert len(set(codes)) == numLeds
+    # An unlit part of the frame never decodes to an LED
+    assert patterns.any(axis=0).all()
+    assert np.all(np.count_nonzero(np.diff(patterns, axis=1), axis=0) == 1)
+
+
+@pytest.mark.parametrize("name", LAYOUTS)
+def test_layout_is_decoded_from_pattern_frames(name):
+    assert _decode_layout(LAYOUTS[name]) == LAYOUTS[name]
+
+
+@pytest.mark.parametrize("name", LAYOUTS)
+def test_layout_is_discovered_with_a_simulated_strip(name):
+    layout = LAYOUTS[name]
+    numLeds = sum(layout["counts"].values())
+    strip = SimulatedStrip(numLeds)
+
+    discovered = discover_led_layout(
+            strip, _simulated_camera(strip, _led_boxes(layout)),
+            PooledTurboJPEG(), numLeds, CONTROL_POINTS)
+
+    assert discovered == layout
+    # Turned off once done
+    assert not strip.lit.any()
+
+
+def test_too_little_contrast_is_not_decoded(capsys):
+    assert _decode_layout(LAYOUTS["clockwise"],
+                          glowLevel=ROOM_LEVEL + 5) is None
+    assert "Could not find the LEDs" in capsys.readouterr().out
+
+
+def test_overlapping_ranges_are_rejected(capsys):
+    # Three sides that all decode to the first 40 LEDs
+    indices = np.repeat(np.arange(40), 2)[:64]
+    decoded = {side: indices.copy() for side in ("top", "left", "right")}
+
+    assert infer_led_layout(decoded, 120) is None
+    assert "overlap" in capsys.readouterr().out
@@ -0,0 +1,88 @@
+from led_controller import LEDInterface
+from led_output import LEDOutput, StripOutputs
+from metrics import MetricsRegistry
+from time import sleep
+import numpy as np
+import pytest
+
+COUNTS = {"top": 12, "right": 6, "bottom": 12, "left": 6}
+ORDER = ["left", "top", "right", "bottom"]
+ORIENTATION = {"left": False, "top": True, "right": True, "bottom": False}
+SIDE_CHANNELS = {"top": 0, "right": 1, "bottom": 2, "left": 0}
+# Long enough for the LEDs to settle on the last colors sent
+SETTLE_S = 0.5
+MAX_LEVEL_ERROR = 2
+
+def _side_colors():
+    """
+    Returns colors ramping up along every side, in one channel per side.
+    """
+    colors = {}
+    for side, count in COUNTS.items():
+        sideColors = np.zeros((count, 3), dtype=np.uint8)
+        sideColors[:, SIDE_CHANNELS[side]] = np.linspace(40, 250, count)
+        colors[side] = sideColors
+    return colors
+
+
+def test_backend_without_write_cannot_be_created():
+    class IncompleteOutput(LEDOutput):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteOutput({}, 10, 1.0)
+
+
+def test_strips_get_their_slice_of_the_colors():
+    outputs = StripOutputs([{"type": "virtual"}, {"type": "virtual"}],
+                           [4, 6], 1.0)
+    colors = np.arange(30, dtype=np.uint8).reshape(10, 3)
+
+    outputs.write(colors)
+    outputs.write(colors[::-1])
+    outputs.close()
+
+    first, second = outputs.outputs
+    frames, timestamps = first.recent_frames()
+    assert np.array_equal(frames, [colors[:4], colors[::-1][:4]])
+    assert timestamps[1] >= timestamps[0]
+    frames, _ = second.recent_frames(1)
+    assert np.array_equal(frames, [colors[::-1][4:]])
+
+
+def test_led_process_writes_colors_to_a_virtual_strip(tmp_path, monkeypatch):
+    monkeypatch.setenv("BACKLIGHT_CONFIG_DIR", str(tmp_path))
+    savePath = tmp_path / "frames.npz"
+    ledConfig = {
+        "counts": COUNTS,
+        "strips": [{
+            "type": "virtual",
+            "order": ORDER,
+            "orientation": ORIENTATION,
+            "save_path": str(savePath),
+        }],
+    }
+    colors = _side_colors()
+
+    with LEDInterface(ledConfig, MetricsRegistry()) as ledInterface:
+        ledInterface.update_and_get_power_state()
+        ledInterface.set_colors(colors)
+        ledInterface.wait_until_colors_read(timeoutS=30)
+        sleep(SETTLE_S)
+
+    recording = np.load(savePath)
+    frames, timestamps = recording["frames"], recording["timestamps"]
+    assert np.all(np.diff(timestamps) >= 0)
+    # Unless it stopped first, the LED controller turned the LEDs off when
+    # the power went off on exit
+    shown = frames[frames.any(axis=(1, 2))]
+    # It kept rendering while the colors settled
+    assert len(shown) > 1
+
+    expected = np.concatenate([
+        colors[side] if ORIENTATION[side] else colors[side][::-1] \
+            for side in ORDER
+    ])
+    # Within the rounding of the HSV transitions
+    assert np.abs(shown[-1].astype(np.int64) - expected).max() \
+        <= MAX_LEVEL_ERROR
@@ -0,0 +1,103 @@
+from network_output import DDP_MAX_DATA_SIZE, E131_PIXELS_PER_UNIVERSE, \
+    DDPOutput, E131Output, UDPReceiver
+from time import monotonic, sleep
+import numpy as np
+import pytest
+
+NUM_FRAMES = 60
+# Sent slower than the receiver reads, so a loss is a bug rather than a full
+# socket buffer
+FRAME_INTERVAL_S = 0.002
+RECEIVE_TIMEOUT_S = 5
+POLL_S = 0.01
+
+def _stream(output, receiver, numLeds, brightness=1.0):
+    """
+    Sends NUM_FRAMES frames of random colors and waits until the receiver
+    got them. Returns the pixel data every frame should arrive with.
+    """
+    rng = np.random.default_rng(0)
+    expected = []
+    for _ in range(NUM_FRAMES):
+        colors = rng.integers(0, 256, (numLeds, 3), dtype=np.uint8)
+        output.write(colors)
+        expected.append(np.rint(colors * brightness).astype(np.uint8)
+                        .tobytes())
+        sleep(FRAME_INTERVAL_S)
+
+    deadline = monotonic() + RECEIVE_TIMEOUT_S
+    while receiver.frames < NUM_FRAMES and monotonic() < deadline:
+        sleep(POLL_S)
+    # Also finishes the last E1.31 frame
+    receiver.stop()
+    output.close()
+    return expected
+
+
+def _check_received(output, receiver, expected, packetsPerFrame):
+    assert output.droppedPackets == 0
+    assert receiver.lostPackets == 0
+    assert receiver.frames == NUM_FRAMES
+    assert receiver.packets == NUM_FRAMES * packetsPerFrame
+    assert receiver.frameData == expected
+
+
+@pytest.mark.parametrize("numLeds", [1, 480, 481, 1000])
+@pytest.mark.parametrize("timecode", [False, True])
+def test_ddp_frames_arrive_whole(numLeds, timecode):
+    receiver = UDPReceiver("ddp", 0)
+    receiver.start()
+    output = DDPOutput({"hosts": ["127.0.0.1"], "port": receiver.port,
+                        "timecode": timecode}, numLeds, 1.0)
+
+    expected = _stream(output, receiver, numLeds)
+
+    packetsPerFrame = -(-numLeds * 3 // DDP_MAX_DATA_SIZE)
+    _check_received(output, receiver, expected, packetsPerFrame)
+    assert len(receiver.latenciesUs) == (NUM_FRAMES if timecode else 0)
+
+
+@pytest.mark.parametrize("numLeds", [1, 170, 171, 600])
+def test_e131_frames_arrive_whole_across_universes(numLeds):
+    receiver = UDPReceiver("e131", 0, firstUniverse=3)
+    receiver.start()
+    output = E131Output({"hosts": ["127.0.0.1"], "port": receiver.port,
+                         "universe": 3}, numLeds, 1.0)
+
+    expected = _stream(output, receiver, numLeds)
+
+    packetsPerFrame = -(-numLeds // E131_PIXELS_PER_UNIVERSE)
+    _check_received(output, receiver, expected, packetsPerFrame)
+
+
+@pytest.mark.parametrize("outputClass,protocol",
+                         [(DDPOutput, "ddp"), (E131Output, "e131")])
+def test_brightness_scales_the_sent_colors(outputClass, protocol):
+    receiver = UDPReceiver(protocol, 0)
+    receiver.start()
+    output = outputClass({"hosts": ["127.0.0.1"], "port": receiver.port},
+                         300, 0.5)
+
+    expected = _stream(output, receiver, 300, brightness=0.5)
+
+    assert receiver.frameData == expected
+
+
+def test_every_receiver_gets_every_frame():
+    # Every loopback address is a receiver of its own
+    first = UDPReceiver("ddp", 0, host="127.0.0.1")
+    receivers = [first, UDPReceiver("ddp", first.port, host="127.0.0.2")]
+    for receiver in receivers:
+        receiver.start()
+    output = DDPOutput({"hosts": ["127.0.0.1", "127.0.0.2"],
+                        "port": first.port}, 200, 1.0)
+
+    expected = _stream(output, first, 200)
+    deadline = monotonic() + RECEIVE_TIMEOUT_S
+    while receivers[1].frames < NUM_FRAMES and monotonic() < deadline:
+        sleep(POLL_S)
+    receivers[1].stop()
+
+    for receiver in receivers:
+        assert receiver.lostPackets == 0
+        assert receiver.frameData == expected
@@ -0,0 +1,231 @@
+from camera_worker import BENCHMARK_LED_COUNTS, benchmark_control_points
+from image_controller import ImageController
+from led_controller import LEDInterface
+from metrics import MetricsRegistry
+from recorded_camera import RecordedCamera
+from time import monotonic, sleep
+from user_pref import DISPLAY_SIDES
+import cv2
+import errno
+import image_controller
+import json
+import numpy as np
+import os
+import pytest
+import signal
+
+RESOLUTION = (320, 240)
+RECORDED_FRAMES = 10
+SUPERVISOR_PREFS = {
+    # Short, so a stalled camera is noticed quickly
+    "capture_timeout_s": 0.3,
+    "reopen_min_backoff_s": 0.05,
+    "reopen_max_backoff_s": 0.2,
+}
+STALL_POLL_S = 0.01
+POLL_S = 0.05
+# Colors the LEDs must get after the camera failed for it to count as
+# recovered
+COLORS_AFTER_FAILURE = 5
+TIMEOUT_S = 10
+
+class CameraFailure:
+    """
+    When the FailingCameras of one test fail, shared by all of them like the
+    device node of an unplugged camera.
+    """
+    def __init__(self, stall, afterFrames=10, downS=0.5):
+        self.stall = stall
+        self.afterFrames = afterFrames
+        self.downS = downS
+        self.failed = False
+        self.downUntil = 0
+
+
+class FailingCamera(RecordedCamera):
+    """
+    A recorded camera whose stream fails once, after failure.afterFrames
+    frames, either with an error like an unplugged camera or, with
+    failure.stall, by no longer sending frames until it is closed. It then
+    can't be opened for failure.downS seconds.
+    """
+    failure = None
+
+    def open(self):
+        if monotonic() < self.failure.downUntil:
+            raise FileNotFoundError(errno.ENOENT, "Unplugged",
+                                    self._recordingPath)
+        super().open()
+
+
+    def __iter__(self):
+        for frame in super().__iter__():
+            if not self.failure.failed \
+                    and frame.frame_nb >= self.failure.afterFrames:
+                self.failure.failed = True
+                self.failure.downUntil = monotonic() + self.failure.downS
+                if self.failure.stall:
+                    while self._data is not None:
+                        sleep(STALL_POLL_S)
+                raise OSError(errno.ENODEV, "Unplugged")
+            yield frame
+
+
+class FakeLEDs:
+    """
+    Stands in for LEDInterface. The power goes off once enough colors came
+    after the camera failed, or after TIMEOUT_S.
+    """
+    def __init__(self, failure):
+        self._failure = failure
+        self._deadline = monotonic() + TIMEOUT_S
+        self.colorsAfterFailure = 0
+
+
+    def set_colors(self, colors, frameNb=-1, captureTime=None):
+        if self._failure.failed:
+            self.colorsAfterFailure += 1
+
+
+    def update_and_get_power_state(self):
+        return self.colorsAfterFailure < COLORS_AFTER_FAILURE \
+            and monotonic() < self._deadline
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    with open(tmp_path / "pipeline.json", "w") as pipelineFile:
+        json.dump({"supervisor": SUPERVISOR_PREFS}, pipelineFile)
+    monkeypatch.setenv("BACKLIGHT_CONFIG_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def display(tmp_path):
+    """
+    A display streaming a recording of noise frames.
+    """
+    recordingPath = tmp_path / "recording.mjpeg"
+    rng = np.random.default_rng(0)
+    with open(recordingPath, "wb") as recording:
+        for _ in range(RECORDED_FRAMES):
+            frame = rng.integers(0, 256, (RESOLUTION[1], RESOLUTION[0], 3),
+                                 dtype=np.uint8)
+            recording.write(cv2.imencode(".jpg", frame)[1].tobytes())
+    return {
+        "name": "display0",
+        "device": str(recordingPath),
+        "resolution": RESOLUTION,
+        "control_points": benchmark_control_points(RESOLUTION),
+        "counts": BENCHMARK_LED_COUNTS,
+    }
+
+
+def _stage_value(metricsRegistry, name, stage, labels=None):
+    return metricsRegistry.sample_value(name, {"stage": stage,
+                                               **(labels or {})})
+
+
+@pytest.mark.parametrize("stall", [False, True], ids=["error", "stall"])
+def test_camera_is_reopened_after_it_fails(config_dir, display, monkeypatch,
+                                           stall):
+    failure = CameraFailure(stall)
+    monkeypatch.setattr(FailingCamera, "failure", failure)
+    monkeypatch.setattr(image_controller, "RecordedCamera", FailingCamera)
+    metricsRegistry = MetricsRegistry()
+    leds = FakeLEDs(failure)
+
+    with ImageController(metricsRegistry, display=display) as imageController:
+        imageController.set_led_interface(leds)
+        imageController.start_capture_and_processing()
+
+    labels = {"display": "display0"}
+    assert failure.failed
+    assert leds.colorsAfterFailure >= COLORS_AFTER_FAILURE
+    assert _stage_value(metricsRegistry, "backlight_stage_restarts_total",
+                        "camera", labels) == 1
+    assert _stage_value(metricsRegistry,
+                        "backlight_stage_recovery_seconds_count", "camera",
+                        labels) == 1
+    # Reopening is retried until the camera is back, though a stall is only
+    # noticed after capture_timeout_s
+    noticedAfterS = SUPERVISOR_PREFS["capture_timeout_s"] if stall else 0
+    assert _stage_value(metricsRegistry,
+                        "backlight_stage_recovery_seconds_sum", "camera",
+                        labels) >= failure.downS - noticedAfterS
+
+
+def test_decoder_is_restarted_after_an_error(config_dir, display,
+                                             monkeypatch):
+    failure = CameraFailure(stall=False, afterFrames=float("inf"))
+    metricsRegistry = MetricsRegistry()
+    leds = FakeLEDs(failure)
+    handleFrame = ImageController._handle_frame
+
+    def fail_once(self, *args):
+        if not failure.failed:
+            failure.failed = True
+            raise RuntimeError("Broken decoder")
+        handleFrame(self, *args)
+
+    monkeypatch.setattr(ImageController, "_handle_frame", fail_once)
+    with ImageController(metricsRegistry, display=display) as imageController:
+        imageController.set_led_interface(leds)
+        imageController.start_capture_and_processing()
+
+    labels = {"display": "display0"}
+    assert leds.colorsAfterFailure >= COLORS_AFTER_FAILURE
+    assert _stage_value(metricsRegistry, "backlight_stage_restarts_total",
+                        "decode", labels) == 1
+    assert _stage_value(metricsRegistry,
+                        "backlight_stage_recovery_seconds_count", "decode",
+                        labels) == 1
+
+
+def test_repeated_decode_errors_are_raised(config_dir, display, monkeypatch):
+    failure = CameraFailure(stall=False, afterFrames=float("inf"))
+    calls = []
+
+    def always_fail(self, *args):
+        calls.append(args)
+        raise TypeError("Bug")
+
+    monkeypatch.setattr(ImageController, "_handle_frame", always_fail)
+    with ImageController(display=display) as imageController:
+        imageController.set_led_interface(FakeLEDs(failure))
+        with pytest.raises(TypeError):
+            imageController.start_capture_and_processing()
+
+    # The frame that failed after the last of the default 3 restarts
+    assert len(calls) == 4
+
+
+def test_led_process_is_restarted_after_it_dies(config_dir):
+    sides = [f"display0.{side}" for side in DISPLAY_SIDES]
+    ledConfig = {
+        "counts": {side: BENCHMARK_LED_COUNTS[side.split(".")[1]] \
+                        for side in sides},
+        "strips": [{
+            "type": "virtual",
+            "order": sides,
+            "orientation": {side: True for side in sides},
+        }],
+    }
+    metricsRegistry = MetricsRegistry()
+
+    with LEDInterface(ledConfig, metricsRegistry) as ledInterface:
+        os.kill(ledInterface._ledControllerProcess.pid, signal.SIGKILL)
+        deadline = monotonic() + TIMEOUT_S
+        while monotonic() < deadline and _stage_value(
+                metricsRegistry, "backlight_stage_recovery_seconds_count",
+                "led_controller") == 0:
+            ledInterface.update_and_get_power_state()
+            sleep(POLL_S)
+        assert ledInterface._ledControllerProcess.is_alive()
+
+    assert ledInterface.restarts == 1
+    assert _stage_value(metricsRegistry, "backlight_stage_restarts_total",
+                        "led_controller") == 1
+    assert _stage_value(metricsRegistry,
+                        "backlight_stage_recovery_seconds_count",
+                        "led_controller") == 1
@@ -0,0 +1,117 @@
+from screen_detection import detect_screen_control_points
+import cv2
+import numpy as np
+import pytest
+
+# Control points may be this far from the rendered edge, in pixels of the
+# full frame
+TOLERANCE_PX = 1.5
+EDGE_SAMPLES = 400
+
+def _curved_edge(start, end, bow):
+    """
+    Returns points along the edge from start to end, bent by bow pixels at
+    its middle to the left of its direction, like a lens bends a straight
+    screen edge.
+    """
+    start, end = np.array(start, np.float64), np.array(end, np.float64)
+    direction = end - start
+    normal = np.array([direction[1], -direction[0]]) / np.hypot(*direction)
+    t = np.linspace(0, 1, EDGE_SAMPLES)[:, None]
+    return start + t * direction + bow * 4 * t * (1 - t) * normal
+
+
+def _render_screen(resolution, corners, bow, seed=0):
+    """
+    Returns a BGR frame of a bright screen with the given corners on a dark
+    room, with sensor noise, and its edges going clockwise from the top.
+    """
+    width, height = resolution
+    edges = {
+        "top": _curved_edge(corners["tl"], corners["tr"], bow),
+        "right": _curved_edge(corners["tr"], corners["br"], bow),
+        "bottom": _curved_edge(corners["br"], corners["bl"], bow),
+        "left": _curved_edge(corners["bl"], corners["tl"], bow),
+    }
+    outline = np.concatenate(list(edges.values()))
+    mask = np.zeros((height, width), np.uint8)
+    # Drawn at 1/16 pixel precision, so the edges are where they are defined
+    cv2.fillPoly(mask, [np.rint(outline * 16).astype(np.int32)], 255,
+                 lineType=cv2.LINE_AA, shift=4)
+    rng = np.random.default_rng(seed)
+    frame = 25 + (200 / 255) * mask.astype(np.float64)
+    frame = frame[:, :, None] + rng.normal(0, 6, (height, width, 3))
+    return (np.clip(frame, 0, 255).astype(np.uint8), edges)
+
+
+def _distance_to_edge(point, edge):
+    return np.min(np.hypot(edge[:, 0] - point[0], edge[:, 1] - point[1]))
+
+
+SCREENS = {
+    "rectangle": ((1280, 720), {"tl": (200, 120), "tr": (1080, 120),
+                                "bl": (200, 600), "br": (1080, 600)}, 0),
+    "barrel": ((1280, 720), {"tl": (220, 140), "tr": (1060, 140),
+                             "bl": (220, 580), "br": (1060, 580)}, 18),
+    "pincushion": ((1280, 720), {"tl": (180, 100), "tr": (1100, 100),
+                                 "bl": (180, 620), "br": (1100, 620)}, -14),
+    "perspective": ((1280, 720), {"tl": (250, 150), "tr": (1000, 110),
+                                  "bl": (230, 560), "br": (1040, 620)}, 10),
+    "small_frame": ((640, 480), {"tl": (90, 70), "tr": (560, 60),
+                                 "bl": (80, 400), "br": (550, 420)}, 8),
+}
+
+
+@pytest.mark.parametrize("name", SCREENS)
+def test_control_points_lie_on_edges(name):
+    resolution, corners, bow = SCREENS[name]
+    frame, edges = _render_screen(resolution, corners, bow)
+
+    controlPoints = detect_screen_control_points(frame, inset=0)
+
+    assert controlPoints is not None
+    for side in ("top", "bottom", "left", "right"):
+        assert len(controlPoints[side]) >= 2
+        distances = [_distance_to_edge(point, edges[side]) \
+                        for point in controlPoints[side]]
+        assert max(distances) <= TOLERANCE_PX, (side, distances)
+
+
+@pytest.mark.parametrize("name", SCREENS)
+def test_edges_end_at_corners(name):
+    resolution, corners, bow = SCREENS[name]
+    frame, _ = _render_screen(resolution, corners, bow)
+
+    controlPoints = detect_screen_control_points(frame, inset=0)
+
+    ends = {
+        "tl": controlPoints["top"][0], "tr": controlPoints["top"][-1],
+        "bl": controlPoints["bottom"][0], "br": controlPoints["bottom"][-1],
+    }
+    for corner, point in ends.items():
+        assert np.hypot(*np.subtract(point, corners[corner])) \
+            <= TOLERANCE_PX, (corner, point)
+
+
+def test_inset_moves_points_towards_the_center():
+    resolution, corners, bow = SCREENS["barrel"]
+    frame, _ = _render_screen(resolution, corners, bow)
+
+    onEdge = detect_screen_control_points(frame, inset=0)
+    inset = detect_screen_control_points(frame, inset=10)
+
+    assert np.mean([y for _, y in inset["top"]]) \
+        == pytest.approx(np.mean([y for _, y in onEdge["top"]]) + 10, abs=1)
+    assert np.mean([y for _, y in inset["bottom"]]) \
+        == pytest.approx(np.mean([y for _, y in onEdge["bottom"]]) - 10, abs=1)
+    assert np.mean([x for x, _ in inset["left"]]) \
+        == pytest.approx(np.mean([x for x, _ in onEdge["left"]]) + 10, abs=1)
+    assert np.mean([x for x, _ in inset["right"]]) \
+        == pytest.approx(np.mean([x for x, _ in onEdge["right"]]) - 10, abs=1)
+
+
+def test_no_screen_in_a_dark_frame():
+    frame = np.random.default_rng(0).normal(25, 6, (720, 1280, 3))
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    assert detect_screen_control_points(frame) is None
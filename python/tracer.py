@@ -0,0 +1,182 @@
+from multiprocessing import active_children
+from os import path
+from time import monotonic_ns
+import glob
+import itertools
+import json
+import numpy as np
+import os
+import signal
+import sys
+import threading
+
+TRACE_DIR_ENV = "BACKLIGHT_TRACE_DIR"
+DEFAULT_TRACE_CAPACITY = 1 << 16
+MERGED_TRACE_FILE = "trace.json"
+EVENT_DTYPE = np.dtype([
+    ("start", np.int64),
+    ("duration", np.int64),
+    ("event", np.uint16),
+    ("thread", np.uint32),
+    ("frame", np.int64),
+])
+
+_tracer = None
+
+class Tracer:
+    """
+    Records one event per pipeline stage per frame into a preallocated ring
+    buffer holding the last capacity events. Timestamps come from
+    monotonic_ns(), which is the same clock in every process, so the traces
+    of all processes line up when merged.
+
+    Stages are registered once with event() and then recorded with:
+        start = tracer.now()
+        ...
+        tracer.record(DECODE_EVENT, start, frameNb)
+    """
+    def __init__(self, name, outputDir, capacity=DEFAULT_TRACE_CAPACITY):
+        self.pid = os.getpid()
+        self._name = name
+        self._outputPath = path.join(outputDir,
+                                     f"{name}-{self.pid}.trace.json")
+        self._events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self._eventNames = []
+        self._slots = itertools.count()
+
+
+    def event(self, name):
+        """
+        Registers a stage and returns the id to record it with.
+        """
+        self._eventNames.append(name)
+        return len(self._eventNames) - 1
+
+
+    def now(self):
+        return monotonic_ns()
+
+
+    def record(self, event, start, frame=-1):
+        """
+        Records that the given stage ran from start until now.
+        """
+        end = monotonic_ns()
+        # The camera thread and the decode loop share the tracer, and next()
+        # hands every record its own slot even when they interleave
+        slot = next(self._slots) % len(self._events)
+        self._events[slot] = \
+            (start, end - start, event, threading.get_native_id(), frame)
+
+
+    def write(self):
+        """
+        Writes the buffered events in the Chrome Trace Event format.
+        """
+        # Slots that were never written have no start time
+        events = self._events[self._events["start"] != 0]
+        events = events[np.argsort(events["start"], kind="stable")]
+
+        traceEvents = [{
+            "name": "process_name", "ph": "M", "pid": self.pid,
+            "args": {"name": self._name}
+        }]
+        for start, duration, event, thread, frame in events.tolist():
+            traceEvent = {
+                "name": self._eventNames[event], "ph": "X",
+                "ts": start / 1000, "dur": duration / 1000,
+                "pid": self.pid, "tid": thread,
+            }
+            if frame >= 0:
+                traceEvent["args"] = {"frame": frame}
+            traceEvents.append(traceEvent)
+
+        with open(self._outputPath, "w") as traceFile:
+            json.dump({"traceEvents": traceEvents}, traceFile)
+        return self._outputPath
+
+
+class NullTracer:
+    """
+    Stands in for Tracer when tracing is disabled.
+    """
+    pid = None
+
+    def event(self, name):
+        return 0
+
+
+    def now(self):
+        return 0
+
+
+    def record(self, event, start, frame=-1):
+        pass
+
+
+    def write(self):
+        return None
+
+
+def enable(outputDir):
+    """
+    Turns on tracing for this process and every process it starts
+    afterwards.
+    """
+    os.makedirs(outputDir, exist_ok=True)
+    os.environ[TRACE_DIR_ENV] = path.abspath(outputDir)
+
+
+def get_tracer(name):
+    """
+    Returns the tracer of the current process, creating it on first use. It
+    is a NullTracer unless tracing is enabled. The Tracer is created from the
+    main thread of the process, which then also writes the trace on SIGUSR2.
+    """
+    global _tracer
+    # A forked child inherits the parent's tracer, but records its own events
+    if _tracer is not None and _tracer.pid in (None, os.getpid()):
+        return _tracer
+
+    outputDir = os.environ.get(TRACE_DIR_ENV)
+    if outputDir is None:
+        _tracer = NullTracer()
+        return _tracer
+
+    _tracer = Tracer(name, outputDir)
+    signal.signal(signal.SIGUSR2, _on_sigusr2)
+    print(f"Tracing {name} into {outputDir}")
+    return _tracer
+
+
+def merge_traces(outputDir):
+    """
+    Merges the traces of all processes in outputDir into one file that can
+    be opened in Perfetto or chrome://tracing.
+    """
+    traceEvents = []
+    for tracePath in sorted(glob.glob(path.join(outputDir, "*.trace.json"))):
+        with open(tracePath, "r") as traceFile:
+            traceEvents.extend(json.load(traceFile)["traceEvents"])
+
+    mergedPath = path.join(outputDir, MERGED_TRACE_FILE)
+    with open(mergedPath, "w") as mergedFile:
+        json.dump({"traceEvents": traceEvents}, mergedFile)
+    return mergedPath
+
+
+def _on_sigusr2(signum, frame):
+    for child in active_children():
+        os.kill(child.pid, signal.SIGUSR2)
+    if _tracer is None or _tracer.pid != os.getpid():
+        return
+    print(f"Wrote trace to {_tracer.write()}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "merge":
+        print("Invalid args. Usage:")
+        print(f"    python {sys.argv[0]} merge <trace dir>")
+        exit(1)
+
+    print(f"Wrote merged trace to {merge_traces(sys.argv[2])}")
@@ -1,5 +1,7 @@
 from os import path
 import json
+import os
+import numpy as np
 
 CONFIG_PATH = "config"
 IGNORED_NODE_FILE = "ignored_nodes.txt"
@@ -8,10 +10,23 @@ RESOLUTION_FILE = "resolution.txt"
 CALIBRATION_FILE = "calibration.json"
 LED_INFO_FILE = "led.json"
 SAMPLE_POINTS_FILE = "sample_points.json"
+PIPELINE_FILE = "pipeline.json"
+COLOR_LUT_FILE = "color_lut.npy"
+RESOLUTION_BENCHMARK_FILE = "resolution_benchmark.json"
+DISPLAYS_FILE = "displays.json"
+DISPLAY_SIDES = ("top", "bottom", "left", "right")
+# Overrides the config directory, ex. to run the benchmarks against the
+# default prefs
+CONFIG_DIR_ENV = "BACKLIGHT_CONFIG_DIR"
+
+
+def config_path():
+    return os.environ.get(CONFIG_DIR_ENV) \
+        or path.join(path.dirname(__file__), CONFIG_PATH)
 
 
 def read_ignored_nodes():
-    configPath = path.join(path.dirname(__file__), CONFIG_PATH)
+    configPath = config_path()
     if not path.exists(configPath):
         return set()
 
@@ -76,7 +91,7 @@ def _read_resolution(configPath):
 
 
 def read_device_prefs():
-    configPath = path.join(path.dirname(__file__), CONFIG_PATH)
+    configPath = config_path()
     if not path.exists(configPath):
         print(f"ERROR: {configPath} does not exist. Run setup.py first!")
         exit(1)
@@ -86,16 +101,16 @@ def read_device_prefs():
     return (device, resolution)
 
 
-def read_calibration_data():
-    configPath = path.join(path.dirname(__file__), CONFIG_PATH)
+def read_calibration_data(calibrationFile=CALIBRATION_FILE):
+    configPath = config_path()
     if not path.exists(configPath):
         print(f"ERROR: {configPath} does not exist. Run setup.py first!")
         exit(1)
 
-    calibrationFilePath = path.join(configPath, CALIBRATION_FILE)
+    calibrationFilePath = path.join(configPath, calibrationFile)
     if not path.exists(calibrationFilePath):
         print(f"ERROR: {calibrationFilePath} does not exist. Please populate "
-              f"{CALIBRATION_FILE} from the calibration frame.")
+              f"{calibrationFile} from the calibration frame.")
         exit(1)
 
     with open(calibrationFilePath, "r") as calibrationFile:
@@ -147,8 +162,25 @@ def read_calibration_data():
         "right": rightControlPoints
     }
 
+def write_calibration_data(controlPoints):
+    configPath = config_path()
+    if not path.exists(configPath):
+        print(f"ERROR: {configPath} does not exist. Run setup.py first!")
+        exit(1)
+
+    rawJson = {
+        side: [int(v) for point in controlPoints[side] for v in point] \
+            for side in ["top", "bottom", "left", "right"]
+    }
+
+    calibrationFilePath = path.join(configPath, CALIBRATION_FILE)
+    with open(calibrationFilePath, "w") as calibrationFile:
+        json.dump(rawJson, calibrationFile, indent=4)
+
+    return calibrationFilePath
+
 def read_led_counts():
-    configPath = path.join(path.dirname(__file__), CONFIG_PATH)
+    configPath = config_path()
     if not path.exists(configPath):
         print(f"ERROR: {configPath} does not exist. Run setup.py first!")
         exit(1)
@@ -164,7 +196,7 @@ def read_led_counts():
     return rawJson["counts"]
 
 def read_led_info():
-    configPath = path.join(path.dirname(__file__), CONFIG_PATH)
+    configPath = config_path()
     if not path.exists(configPath):
         print(f"ERROR: {configPath} does not exist. Run setup.py first!")
         exit(1)
@@ -178,3 +210,97 @@ def read_led_info():
         rawJson = json.load(ledInfoFile)
 
     return rawJson
+
+
+def read_displays():
+    """
+    Returns the displays of the optional displays.json, or None for the
+    single camera setup. Each display has a "name", its camera's "device"
+    and "resolution", the "control_points" of its calibration file and the
+    "counts" of its sides, which led.json lists as "<name>.<side>".
+    """
+    configPath = config_path()
+    displaysFilePath = path.join(configPath, DISPLAYS_FILE)
+    if not path.exists(displaysFilePath):
+        return None
+
+    with open(displaysFilePath, "r") as displaysFile:
+        rawJson = json.load(displaysFile)
+
+    ledCounts = read_led_counts()
+    displays = []
+    for rawDisplay in rawJson["displays"]:
+        name = rawDisplay["name"]
+        missingSides = [side for side in DISPLAY_SIDES \
+                            if f"{name}.{side}" not in ledCounts]
+        if missingSides:
+            print(f"ERROR: {LED_INFO_FILE} has no counts for "
+                  f"{[f'{name}.{side}' for side in missingSides]}.")
+            exit(1)
+
+        displays.append({
+            "name": name,
+            "device": rawDisplay["device"],
+            "resolution": tuple(rawDisplay["resolution"]),
+            "control_points": read_calibration_data(
+                    rawDisplay["calibration"]),
+            "counts": {side: ledCounts[f"{name}.{side}"] \
+                            for side in DISPLAY_SIDES},
+        })
+
+    return displays
+
+
+def read_pipeline_prefs(section, defaults):
+    """
+    Returns the given section of the optional pipeline.json, with any missing
+    values filled in from defaults.
+    """
+    prefs = dict(defaults)
+    pipelinePrefPath = path.join(config_path(), PIPELINE_FILE)
+    if not path.exists(pipelinePrefPath):
+        return prefs
+
+    with open(pipelinePrefPath, "r") as pipelineFile:
+        rawJson = json.load(pipelineFile)
+
+    prefs.update(rawJson.get(section, {}))
+    return prefs
+
+
+def read_color_lut():
+    colorLutPath = path.join(config_path(), COLOR_LUT_FILE)
+    if not path.exists(colorLutPath):
+        return None
+
+    lut = np.load(colorLutPath)
+    if lut.ndim != 4 or lut.shape[3] != 3 \
+            or not (lut.shape[0] == lut.shape[1] == lut.shape[2]):
+        print(f"ERROR: {colorLutPath} is not a valid color LUT. Rebuild it "
+              "with color_correction.py.")
+        exit(1)
+
+    return lut
+
+
+def write_color_lut(lut):
+    configPath = config_path()
+    if not path.exists(configPath):
+        print(f"ERROR: {configPath} does not exist. Run setup.py first!")
+        exit(1)
+
+    colorLutPath = path.join(configPath, COLOR_LUT_FILE)
+    np.save(colorLutPath, lut)
+    return colorLutPath
+
+
+def write_resolution_benchmark(benchmark):
+    configPath = config_path()
+    if not path.exists(configPath):
+        print(f"ERROR: {configPath} does not exist. Run setup.py first!")
+        exit(1)
+
+    benchmarkPath = path.join(configPath, RESOLUTION_BENCHMARK_FILE)
+    with open(benchmarkPath, "w") as benchmarkFile:
+        json.dump(benchmark, benchmarkFile, indent=4)
+    return benchmarkPath